@@ -3,6 +3,7 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 from datetime import datetime, date, time
+from utils.week_view import WeekViewData
 
 # Configuração da página
 st.set_page_config(
@@ -685,7 +686,9 @@ def appointments_tab():
                 st.rerun()
     
     # Mostrar grade de horários da semana selecionada com nomes clicáveis
-    schedule_data_raw = db.get_week_schedule_data_with_details(st.session_state.selected_week_start)
+    # Grade, clientes, horários fixos e agendamentos da semana num número fixo de consultas
+    week_view = WeekViewData(db, st.session_state.selected_week_start)
+    schedule_data_raw = week_view.grid
     
     # Configurar display da tabela
     if schedule_data_raw:
@@ -774,18 +777,13 @@ def appointments_tab():
                 with cols[i+1]:
                     if day_data['clients']:
                         for client_idx, client_info in enumerate(day_data['clients']):
-                            # Buscar informações do tipo de agendamento
-                            client_schedules = db.get_client_schedule(client_info['client_id'])
-                            schedule_type = "Fixo"  # Padrão
-                            
-                            # Procurar o tipo correto para este dia/horário
-                            for sched in client_schedules:
-                                if sched['day_of_week'] == day_data['day_of_week'] and sched['time'] == hour_data['time']:
-                                    schedule_type = sched.get('schedule_type', 'Fixo')
-                                    break
+                            # Tipo do horário fixo para este dia/horário
+                            schedule_type = week_view.get_schedule_type(
+                                client_info['client_id'], day_data['day_of_week'], hour_data['time']
+                            )
                             
-                            # Buscar agendamento específico para verificar presença
-                            appointment = db.get_appointment_by_details(
+                            # Agendamento específico para verificar presença
+                            appointment = week_view.get_appointment(
                                 client_info['client_id'], 
                                 day_data['date'], 
                                 hour_data['time']
@@ -806,10 +804,8 @@ def appointments_tab():
                                 # Garantir que o nome do cliente seja exibido
                                 client_name = client_info.get('client_name', 'Cliente')
                                 if not client_name or client_name == 'None':
-                                    # Buscar nome do banco se não vier
-                                    clients = db.get_clients()
-                                    client = next((c for c in clients if c['id'] == client_info['client_id']), None)
-                                    client_name = client['name'] if client else 'Cliente'
+                                    # Buscar nome nos clientes já carregados se não vier
+                                    client_name = week_view.get_client_name(client_info['client_id'])
                                 
                                 # Botão clicável com o nome do cliente
                                 btn_label = f"{icon} {client_name}"
@@ -913,8 +909,7 @@ def appointments_tab():
             from_time = st.session_state.get('editing_from_time')
             
             # Buscar informações do cliente
-            clients = db.get_clients()
-            client = next((c for c in clients if c['id'] == client_id), None)
+            client = week_view.get_client(client_id)
             
             if client:
                 st.subheader(f"✏️ Editando: {client['name']}")
@@ -928,7 +923,7 @@ def appointments_tab():
                 
                 if editing_date:
                     # Buscar o agendamento
-                    appointment = db.get_appointment_by_details(client_id, editing_date, from_time)
+                    appointment = week_view.get_appointment(client_id, editing_date, from_time)
                     
                     if appointment:
                         col1, col2, col3 = st.columns(3)
@@ -1012,7 +1007,7 @@ def appointments_tab():
                     # MODO REPOSIÇÃO - Buscar o agendamento específico
                     st.info(f"📌 Você clicou em uma REPOSIÇÃO do dia {editing_date}")
                     
-                    appointments = db.get_appointments()
+                    appointments = db.get_appointments(client_id=client_id, date_filter=editing_date)
                     appointment = next((apt for apt in appointments 
                                        if apt['client_id'] == client_id 
                                        and apt['date'] == editing_date 
@@ -1129,7 +1124,7 @@ def appointments_tab():
                     day_of_week = date_obj.weekday() + 1
                     
                     # Buscar agendamentos confirmados para esta data
-                    appointments = db.get_appointments()
+                    appointments = db.get_appointments(date_filter=target_date)
                     slots_count = {}
                     
                     for hour in hours_list:
@@ -1254,7 +1249,7 @@ def appointments_tab():
                                 repos_time = None
                             else:
                                 # Verificar se o cliente já tem reposição nesta data/horário
-                                existing_appointments = db.get_appointments()
+                                existing_appointments = db.get_appointments(client_id=client_id, date_filter=repos_date_str)
                                 client_appointments_on_date = [
                                     apt for apt in existing_appointments 
                                     if apt['client_id'] == client_id 
@@ -1346,7 +1341,7 @@ def appointments_tab():
                         st.divider()
                     
                     # Buscar e mostrar reposições (appointments) do cliente
-                    appointments = db.get_appointments()
+                    appointments = db.get_appointments(client_id=client_id, start_date=date.today().strftime('%Y-%m-%d'))
                     client_appointments = [
                         apt for apt in appointments 
                         if apt['client_id'] == client_id 
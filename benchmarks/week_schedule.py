@@ -0,0 +1,155 @@
+"""Benchmark de Database.get_week_schedule_data
+
+Monta um banco temporário com 200 clientes e um ano de agendamentos e compara
+a grade atual (dicionários por horário, uma passada) com a montagem original,
+que percorria todos os agendamentos e horários fixos para cada célula.
+Confere também que os dois DataFrames são iguais.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.week_schedule
+"""
+import os
+import random
+import tempfile
+from datetime import date, timedelta
+from time import perf_counter
+
+from utils.database import Database
+
+CLIENTS = 200
+WEEKS = 52
+YEAR_START = date(2025, 1, 6)  # segunda-feira
+SAMPLE_WEEKS = ('2025-03-03', '2025-07-07', '2025-11-03')
+REPEAT = 15
+
+
+def build_dataset(db: Database, seed: int = 42):
+    """Clientes, horários fixos (2 a 3 por cliente) e um ano de agendamentos"""
+    rng = random.Random(seed)
+    hours = [f"{h:02d}:00" for h in range(6, 21)]
+
+    with db.connection() as conn:
+        equipment = [row[0] for row in conn.execute('SELECT id FROM equipment')]
+        conn.executemany(
+            "INSERT INTO users (name, phone, email, password, type) VALUES (?, '', ?, '', 'client')",
+            [(f"Cliente {i:03d}", f"bench{i}@teste.com") for i in range(CLIENTS)]
+        )
+        clients = [row[0] for row in conn.execute("SELECT id FROM users WHERE type = 'client'")]
+
+        schedules = []
+        for client_id in clients:
+            for day_of_week in rng.sample(range(1, 6), rng.choice((2, 3))):
+                schedules.append((client_id, day_of_week, rng.choice(hours), rng.choice(equipment)))
+        conn.executemany(
+            'INSERT INTO client_schedule (client_id, day_of_week, time, equipment_id) VALUES (?, ?, ?, ?)',
+            schedules
+        )
+
+        appointments = []
+        for week in range(WEEKS):
+            monday = YEAR_START + timedelta(weeks=week)
+            for client_id, day_of_week, time, _ in schedules:
+                day = (monday + timedelta(days=day_of_week - 1)).isoformat()
+                status = 'cancelled' if rng.random() < 0.05 else 'scheduled'
+                appointments.append((client_id, day, time, day_of_week, status))
+        conn.executemany(
+            'INSERT INTO appointments (client_id, date, time, day_of_week, status) VALUES (?, ?, ?, ?, ?)',
+            appointments
+        )
+    return len(schedules), len(appointments)
+
+
+def week_schedule_by_scanning(db: Database, start_date: str):
+    """Montagem original: varre agendamentos e horários fixos em cada célula"""
+    import pandas as pd
+    from datetime import datetime
+
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    appointments = db.get_appointments(
+        start_date=start_date,
+        end_date=(start + timedelta(days=4)).strftime('%Y-%m-%d'),
+        include_cancelled=False
+    )
+    client_schedules = db.get_all_client_schedules()
+
+    def norm_time(t):
+        try:
+            return t.strip()[:5]
+        except Exception:
+            return t
+
+    schedule_data = []
+    for hour in [f"{h:02d}:00" for h in range(6, 21)]:
+        row = {'Horário': hour}
+        for i in range(5):
+            current_date = start + timedelta(days=i)
+            date_str = current_date.strftime('%Y-%m-%d')
+            day_of_week = current_date.weekday() + 1
+            day_name = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta'][i]
+            column_name = f"{day_name} {current_date.strftime('%d/%m')}"
+
+            day_appointments = [apt for apt in appointments
+                                if norm_time(apt['time']) == norm_time(hour)
+                                and apt['date'] == date_str
+                                and apt['status'] != 'cancelled']
+            clients_with_appointments = {apt['client_id'] for apt in day_appointments}
+            fixed_schedules = [sched for sched in client_schedules
+                               if norm_time(sched['time']) == norm_time(hour)
+                               and sched['day_of_week'] == day_of_week]
+
+            client_list = []
+            for apt in day_appointments:
+                client_sched = next((s for s in client_schedules
+                                     if s['client_id'] == apt['client_id']
+                                     and s['day_of_week'] == day_of_week
+                                     and norm_time(s['time']) == norm_time(hour)), None)
+                if client_sched and client_sched.get('equipment_name'):
+                    client_list.append(f"✅ {apt['client_name']} 🏋️{client_sched['equipment_name']}")
+                else:
+                    client_list.append(f"✅ {apt['client_name']}")
+            for sched in fixed_schedules:
+                if sched['client_id'] not in clients_with_appointments:
+                    if sched.get('equipment_name'):
+                        client_list.append(f"📅 {sched['client_name']} 🏋️{sched['equipment_name']}")
+                    else:
+                        client_list.append(f"📅 {sched['client_name']}")
+
+            row[column_name] = "<br>".join(client_list) if client_list else ""
+        schedule_data.append(row)
+
+    return pd.DataFrame(schedule_data)
+
+
+def timed(db: Database, build, start_date: str) -> float:
+    """Tempo médio (ms) de `build`, sem o cache de leitura do Database"""
+    total = 0.0
+    for _ in range(REPEAT):
+        db.clear_read_cache()
+        start = perf_counter()
+        build(start_date)
+        total += perf_counter() - start
+    return total / REPEAT * 1000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        try:
+            schedules, appointments = build_dataset(db)
+            print(f"{CLIENTS} clientes, {schedules} horários fixos, {appointments} agendamentos "
+                  f"({WEEKS} semanas); média de {REPEAT} execuções por semana\n")
+            print(f"{'semana':<12}{'varredura (ms)':>16}{'dicionários (ms)':>18}{'ganho':>8}")
+
+            for week in SAMPLE_WEEKS:
+                expected = week_schedule_by_scanning(db, week)
+                assert db.get_week_schedule_data(week).equals(expected), f"grade diferente em {week}"
+
+                scanning = timed(db, lambda w: week_schedule_by_scanning(db, w), week)
+                current = timed(db, db.get_week_schedule_data, week)
+                print(f"{week:<12}{scanning:>16.1f}{current:>18.1f}{scanning / current:>7.1f}x")
+        finally:
+            db.close()
+
+
+if __name__ == '__main__':
+    main()
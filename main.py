@@ -1,7 +1,6 @@
 import streamlit as st
 from utils.database import db
 from datetime import datetime, date
-import sqlite3
 import bcrypt
 import time
 from zoneinfo import ZoneInfo
@@ -153,14 +152,8 @@ def client_dashboard():
 def master_dashboard():
     """Dashboard do usuário Master"""
     
-    # Verificar notificações não lidas
-    import sqlite3
-    conn = sqlite3.connect("pilates.db")
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM notifications WHERE is_read = 0')
-    unread_count = cursor.fetchone()[0]
-    conn.close()
+    # Verificar notificações não lidas (contador em cache até o próximo commit)
+    unread_count = db.get_unread_notification_count()
     
     # Balão de notificação
     if unread_count > 0:
@@ -180,21 +173,7 @@ def master_dashboard():
         st.markdown("---")
         st.markdown("### 🔔 Notificações Recentes")
         
-        conn = sqlite3.connect("pilates.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT n.id, n.client_id, n.client_name, n.type, n.message, n.is_read, n.created_at,
-                   u.phone
-            FROM notifications n
-            LEFT JOIN users u ON n.client_id = u.id
-            WHERE n.is_read = 0
-            ORDER BY n.created_at DESC
-            LIMIT 5
-        ''')
-        
-        recent_notifications = cursor.fetchall()
-        conn.close()
+        recent_notifications = db.get_unread_notifications(limit=5)
         
         if recent_notifications:
             for notif in recent_notifications:
@@ -219,11 +198,9 @@ def master_dashboard():
                     col_btn1, col_btn2 = st.columns(2)
                     with col_btn1:
                         if st.button("✅ Marcar como lida", key=f"mark_read_{notif_id}"):
-                            conn = sqlite3.connect("pilates.db")
-                            cursor = conn.cursor()
-                            cursor.execute('UPDATE notifications SET is_read = 1 WHERE id = ?', (notif_id,))
-                            conn.commit()
-                            conn.close()
+                            with db.connection() as conn:
+                                cursor = conn.cursor()
+                                cursor.execute('UPDATE notifications SET is_read = 1 WHERE id = ?', (notif_id,))
                             st.rerun()
         else:
             st.info("Nenhuma notificação não lida")
@@ -234,32 +211,52 @@ def master_dashboard():
         
         st.markdown("---")
     
-    # Tabs para o master
-    tabs = st.tabs(["� Agendamentos", "👥 Clientes", "🏋️ Equipamentos", "⏰ Horários", "💰 Financeiro", "� Análises"])
-    
-    with tabs[0]:
-        appointments_tab()
-    
-    with tabs[1]:
-        clients_tab()
-    
-    with tabs[2]:
-        equipment_tab()
-    
-    with tabs[3]:
-        schedules_overview_tab()
-    
-    with tabs[4]:
-        financial_tab()
-    
-    with tabs[5]:
-        attendance_history_tab()
+    # Seções do master (só a selecionada é executada)
+    section_router([
+        ("� Agendamentos", appointments_tab),
+        ("👥 Clientes", clients_tab),
+        ("🏋️ Equipamentos", equipment_tab),
+        ("⏰ Horários", schedules_overview_tab),
+        ("💰 Financeiro", financial_tab),
+        ("� Análises", attendance_history_tab),
+    ], key="master_section")
+
+def section_router(sections, key):
+    """Seletor de seções que executa apenas a seção selecionada
+    
+    Diferente de st.tabs, que roda o código de todas as abas a cada rerun,
+    aqui só a função da seção escolhida é chamada. A seção fica em
+    st.session_state[key] e o tempo de renderização de cada seção em
+    st.session_state['section_render_times'][rótulo] ({'last_ms', 'total_ms', 'runs'}).
+    
+    Args:
+        sections: Lista de (rótulo, função sem argumentos)
+        key: Chave do seletor no session_state
+    """
+    labels = [label for label, _ in sections]
+    if st.session_state.get(key) not in labels:
+        st.session_state[key] = labels[0]
+    
+    selected = st.radio("Seção:", labels, key=key, horizontal=True, label_visibility="collapsed")
+    render = dict(sections)[selected]
+    
+    start = time.perf_counter()
+    try:
+        render()
+    finally:
+        # Também registra seções interrompidas por st.rerun()/st.stop()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        timing = st.session_state.setdefault('section_render_times', {}).setdefault(
+            selected, {'last_ms': 0.0, 'total_ms': 0.0, 'runs': 0}
+        )
+        timing['last_ms'] = elapsed_ms
+        timing['total_ms'] += elapsed_ms
+        timing['runs'] += 1
 
 def appointments_tab():
     """Aba de gerenciamento de agendamentos com seletor de data"""
     from datetime import datetime, timedelta
     from collections import defaultdict
-    import sqlite3
     
     # Preparar lista de equipamentos para os selectboxes
     equipment_list = db.get_equipment() if hasattr(db, 'get_equipment') else []
@@ -280,20 +277,7 @@ def appointments_tab():
     st.info(f"📅 {day_name} - {selected_date.strftime('%d/%m/%Y')}")
 
     # Buscar todos os appointments do dia selecionado
-    conn = sqlite3.connect("pilates.db")
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT a.id, a.client_id, a.time, a.attended, a.equipamento, a.observacao,
-               u.name as client_name
-        FROM appointments a
-        JOIN users u ON a.client_id = u.id
-        WHERE a.date = ?
-        ORDER BY a.time
-    ''', (selected_date_str,))
-    
-    appointments_today = cursor.fetchall()
-    conn.close()
+    appointments_today = db.get_day_view_appointments(selected_date_str)
     
     # Organizar por horário
     appointments_by_hour = defaultdict(list)
@@ -349,14 +333,12 @@ def appointments_tab():
                     
                     # Se mudou, salvar automaticamente
                     if new_equipment != apt['equipamento']:
-                        conn = sqlite3.connect("pilates.db")
-                        cursor = conn.cursor()
-                        cursor.execute(
-                            'UPDATE appointments SET equipamento = ? WHERE id = ?',
-                            (new_equipment, apt['id'])
-                        )
-                        conn.commit()
-                        conn.close()
+                        with db.connection() as conn:
+                            cursor = conn.cursor()
+                            cursor.execute(
+                                'UPDATE appointments SET equipamento = ? WHERE id = ?',
+                                (new_equipment, apt['id'])
+                            )
                         st.rerun()
             
             with col_pf:
@@ -410,18 +392,17 @@ def appointments_tab():
         editing_apt_id = st.session_state.get('editing_appointment_id')
         
         # Buscar dados do appointment
-        conn = sqlite3.connect("pilates.db")
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT a.id, a.client_id, a.date, a.time, a.equipamento, a.observacao,
-                   u.name as client_name
-            FROM appointments a
-            JOIN users u ON a.client_id = u.id
-            WHERE a.id = ?
-        ''', (editing_apt_id,))
-        
-        apt_data = cursor.fetchone()
-        conn.close()
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT a.id, a.client_id, a.date, a.time, a.equipamento, a.observacao,
+                       u.name as client_name
+                FROM appointments a
+                JOIN users u ON a.client_id = u.id
+                WHERE a.id = ?
+            ''', (editing_apt_id,))
+        
+            apt_data = cursor.fetchone()
         
         if apt_data:
             apt_id, client_id, apt_date, apt_time, apt_equip, apt_obs, client_name = apt_data
@@ -481,27 +462,23 @@ def appointments_tab():
 
                     if mudou_data or mudou_horario:
                         # Atualizar data e horário
-                        conn = sqlite3.connect("pilates.db")
-                        cursor = conn.cursor()
-                        cursor.execute('''
-                            UPDATE appointments
-                            SET date = ?, time = ?, equipamento = ?, observacao = ?
-                            WHERE id = ?
-                        ''', (new_date.strftime('%Y-%m-%d'), new_time, new_equipment, new_obs, apt_id))
-                        conn.commit()
-                        conn.close()
+                        with db.connection() as conn:
+                            cursor = conn.cursor()
+                            cursor.execute('''
+                                UPDATE appointments
+                                SET date = ?, time = ?, equipamento = ?, observacao = ?
+                                WHERE id = ?
+                            ''', (new_date.strftime('%Y-%m-%d'), new_time, new_equipment, new_obs, apt_id))
                         st.success("✅ Horário atualizado!")
                     elif mudou_equip or mudou_obs:
                         # Atualizar apenas equipamento/observação
-                        conn = sqlite3.connect("pilates.db")
-                        cursor = conn.cursor()
-                        cursor.execute('''
-                            UPDATE appointments
-                            SET equipamento = ?, observacao = ?
-                            WHERE id = ?
-                        ''', (new_equipment, new_obs, apt_id))
-                        conn.commit()
-                        conn.close()
+                        with db.connection() as conn:
+                            cursor = conn.cursor()
+                            cursor.execute('''
+                                UPDATE appointments
+                                SET equipamento = ?, observacao = ?
+                                WHERE id = ?
+                            ''', (new_equipment, new_obs, apt_id))
                         st.success("✅ Equipamento/observação atualizado!")
                     else:
                         st.info("ℹ️ Nenhuma alteração detectada")
@@ -594,7 +571,7 @@ def appointments_tab():
                             if appointment_date and selected_time:
                                 # Verificar se o cliente já tem agendamento neste dia
                                 date_str = appointment_date.strftime('%Y-%m-%d')
-                                existing_appointments = db.get_appointments(client_id=client_id)
+                                existing_appointments = db.get_appointments(client_id=client_id, date_filter=date_str)
                                 has_appointment_on_date = any(
                                     apt['date'] == date_str and apt['status'] != 'cancelled'
                                     for apt in existing_appointments
@@ -820,9 +797,6 @@ def clients_tab():
                         import bcrypt
                         
                         # Criar cliente com os novos campos
-                        conn = sqlite3.connect(db.db_path)
-                        cursor = conn.cursor()
-                        
                         try:
                             # Hash da senha
                             hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
@@ -830,26 +804,27 @@ def clients_tab():
                             # Preparar dias_semana como JSON com horários: {"1": "08:00", "5": "14:00"}
                             dias_semana_json = json.dumps({str(k): v for k, v in dias_horarios.items()})
                             
-                            # Inserir cliente com novos campos
-                            cursor.execute("""
-                                INSERT INTO users (
-                                    name, phone, email, password, medical_history, type,
-                                    data_inicio_contrato, tipo_contrato, sessoes_contratadas,
-                                    sessoes_utilizadas, dias_semana, contrato_ativo
-                                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            """, (
-                                name, phone, email, hashed_password, medical_history, 'client',
-                                data_inicio_contrato.strftime('%Y-%m-%d'),
-                                tipo_contrato_clean,
-                                sessoes_contratadas if tipo_contrato_clean == 'sessoes' else 0,
-                                0,  # sessoes_utilizadas começa em 0
-                                dias_semana_json,  # {"1": "08:00", "5": "14:00"}
-                                1  # contrato_ativo = True
-                            ))
+                            with db.connection() as conn:
+                                cursor = conn.cursor()
+                                
+                                # Inserir cliente com novos campos
+                                cursor.execute("""
+                                    INSERT INTO users (
+                                        name, phone, email, password, medical_history, type,
+                                        data_inicio_contrato, tipo_contrato, sessoes_contratadas,
+                                        sessoes_utilizadas, dias_semana, contrato_ativo
+                                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                """, (
+                                    name, phone, email, hashed_password, medical_history, 'client',
+                                    data_inicio_contrato.strftime('%Y-%m-%d'),
+                                    tipo_contrato_clean,
+                                    sessoes_contratadas if tipo_contrato_clean == 'sessoes' else 0,
+                                    0,  # sessoes_utilizadas começa em 0
+                                    dias_semana_json,  # {"1": "08:00", "5": "14:00"}
+                                    1  # contrato_ativo = True
+                                ))
                             
-                            client_id = cursor.lastrowid
-                            conn.commit()
-                            conn.close()
+                                client_id = cursor.lastrowid
                             
                             # Gerar agendamentos automaticamente com horários por dia
                             appointments_created = db.gerar_appointments_cliente(client_id, dias_horarios)
@@ -867,8 +842,6 @@ def clients_tab():
                             st.rerun()
                             
                         except Exception as e:
-                            conn.rollback()
-                            conn.close()
                             if "UNIQUE constraint failed" in str(e):
                                 st.error("❌ Erro: Email já está em uso.")
                             else:
@@ -1637,23 +1610,21 @@ def notifications_tab():
     """Aba de notificações"""
     st.subheader("🔔 Notificações dos Clientes")
     
-    import sqlite3
     from datetime import datetime
     
     # Buscar notificações do banco
-    conn = sqlite3.connect("pilates.db")
-    cursor = conn.cursor()
+    with db.connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT n.id, n.client_id, n.client_name, n.type, n.message, n.is_read, n.created_at,
-               u.phone
-        FROM notifications n
-        LEFT JOIN users u ON n.client_id = u.id
-        ORDER BY n.is_read ASC, n.created_at DESC
-    ''')
+        cursor.execute('''
+            SELECT n.id, n.client_id, n.client_name, n.type, n.message, n.is_read, n.created_at,
+                   u.phone
+            FROM notifications n
+            LEFT JOIN users u ON n.client_id = u.id
+            ORDER BY n.is_read ASC, n.created_at DESC
+        ''')
     
-    notifications = cursor.fetchall()
-    conn.close()
+        notifications = cursor.fetchall()
     
     if notifications:
         for notif in notifications:
@@ -1696,11 +1667,9 @@ def notifications_tab():
                 with col3:
                     if not is_read:
                         if st.button("✅ Marcar como Lida", key=f"read_{notif_id}", use_container_width=True):
-                            conn = sqlite3.connect("pilates.db")
-                            cursor = conn.cursor()
-                            cursor.execute('UPDATE notifications SET is_read = 1 WHERE id = ?', (notif_id,))
-                            conn.commit()
-                            conn.close()
+                            with db.connection() as conn:
+                                cursor = conn.cursor()
+                                cursor.execute('UPDATE notifications SET is_read = 1 WHERE id = ?', (notif_id,))
                             st.success("Marcada como lida!")
                             st.rerun()
                     else:
@@ -1708,11 +1677,9 @@ def notifications_tab():
                     
                     # Botão para limpar/excluir notificação
                     if st.button("🗑️ Limpar", key=f"delete_{notif_id}", use_container_width=True, type="secondary"):
-                        conn = sqlite3.connect("pilates.db")
-                        cursor = conn.cursor()
-                        cursor.execute('DELETE FROM notifications WHERE id = ?', (notif_id,))
-                        conn.commit()
-                        conn.close()
+                        with db.connection() as conn:
+                            cursor = conn.cursor()
+                            cursor.execute('DELETE FROM notifications WHERE id = ?', (notif_id,))
                         st.success("Notificação removida!")
                         st.rerun()
                 
@@ -2004,28 +1971,25 @@ def contas_receber_section():
                         with col_save:
                             if st.form_submit_button("💾 Salvar", use_container_width=True):
                                 # Atualizar conta
-                                import sqlite3
                                 try:
-                                    conn = sqlite3.connect('pilates.db')
-                                    if edit_status == 'pago' and edit_data_pag:
-                                        conn.execute('''
-                                            UPDATE contas_receber 
-                                            SET tipo_plano=?, valor=?, quantidade=?, 
-                                                data_vencimento=?, status=?, data_pagamento=?, observacoes=?
-                                            WHERE id=?
-                                        ''', (edit_tipo, edit_valor, edit_qtd, 
-                                              edit_venc.strftime('%Y-%m-%d'), edit_status,
-                                              edit_data_pag.strftime('%Y-%m-%d'), edit_obs, conta['id']))
-                                    else:
-                                        conn.execute('''
-                                            UPDATE contas_receber 
-                                            SET tipo_plano=?, valor=?, quantidade=?, 
-                                                data_vencimento=?, status=?, observacoes=?
-                                            WHERE id=?
-                                        ''', (edit_tipo, edit_valor, edit_qtd, 
-                                              edit_venc.strftime('%Y-%m-%d'), edit_status, edit_obs, conta['id']))
-                                    conn.commit()
-                                    conn.close()
+                                    with db.connection() as conn:
+                                        if edit_status == 'pago' and edit_data_pag:
+                                            conn.execute('''
+                                                UPDATE contas_receber 
+                                                SET tipo_plano=?, valor=?, quantidade=?, 
+                                                    data_vencimento=?, status=?, data_pagamento=?, observacoes=?
+                                                WHERE id=?
+                                            ''', (edit_tipo, edit_valor, edit_qtd, 
+                                                  edit_venc.strftime('%Y-%m-%d'), edit_status,
+                                                  edit_data_pag.strftime('%Y-%m-%d'), edit_obs, conta['id']))
+                                        else:
+                                            conn.execute('''
+                                                UPDATE contas_receber 
+                                                SET tipo_plano=?, valor=?, quantidade=?, 
+                                                    data_vencimento=?, status=?, observacoes=?
+                                                WHERE id=?
+                                            ''', (edit_tipo, edit_valor, edit_qtd, 
+                                                  edit_venc.strftime('%Y-%m-%d'), edit_status, edit_obs, conta['id']))
                                     st.success("✅ Conta atualizada!")
                                     st.session_state[f"editing_receber_{conta['id']}"] = False
                                     st.rerun()
@@ -2086,8 +2050,8 @@ def contas_pagar_section():
                      "Manutenção", "Salário", "Impostos", "Marketing", "Outros"])
                 valor_total = st.number_input("Valor Total (R$):", 
                     min_value=0.0, value=100.0, step=10.0)
-                recorrente = st.checkbox("🔄 Recorrente (até Dezembro)", value=False,
-                    help="Marca para criar parcelas mensais automaticamente até dezembro do ano atual")
+                recorrente = st.checkbox("🔄 Recorrente (mensal)", value=False,
+                    help="Repete o valor todo mês a partir da data do débito, sem data final")
             
             with col2:
                 if not recorrente:
@@ -2097,10 +2061,9 @@ def contas_pagar_section():
                         format_func=lambda x: "Mensal (mesmo valor repetido)" if x == "mensal" 
                                             else "Parcelado (dividir valor)")
                 else:
-                    # Calcular meses até dezembro
-                    meses_ate_dez = 12 - date.today().month + 1
-                    st.info(f"📅 Serão criadas {meses_ate_dez} parcelas até Dezembro/{date.today().year}")
-                    quantidade = meses_ate_dez
+                    # Recorrente é uma regra: as parcelas são geradas mês a mês
+                    st.info(f"📅 Uma parcela por mês a partir de {data_debito.strftime('%d/%m/%Y')}")
+                    quantidade = 1
                     tipo_parcelamento = "mensal"
                 
                 observacoes = st.text_area("Observações:", max_chars=200)
@@ -2108,7 +2071,7 @@ def contas_pagar_section():
             if not recorrente:
                 st.info(f"💡 {quantidade} parcela(s) de R$ {(valor_total/quantidade if tipo_parcelamento=='parcelado' else valor_total):.2f}")
             else:
-                st.info(f"💡 {quantidade} parcelas mensais de R$ {valor_total:.2f} (recorrente)")
+                st.info(f"💡 R$ {valor_total:.2f} todo mês (recorrente)")
             
             col_save, col_cancel = st.columns(2)
             
@@ -2186,6 +2149,9 @@ def contas_pagar_section():
         for parcela in parcelas_filtradas:
             from datetime import datetime
             
+            # Ocorrências de recorrentes ainda não gravadas não têm id
+            parcela_key = parcela['id'] or f"r{parcela['conta_pagar_id']}_{parcela['numero_parcela']}"
+            
             status_icon = "✅" if parcela['status'] == 'pago' else "⏳"
             bg_color = "#d4edda" if parcela['status'] == 'pago' else "#f8d7da"
             
@@ -2210,44 +2176,46 @@ def contas_pagar_section():
                 
                 with col2:
                     # Botão editar
-                    if st.button("✏️ Editar", key=f"edit_p_{parcela['id']}", use_container_width=True):
-                        st.session_state[f"editing_pagar_{parcela['id']}"] = True
+                    if st.button("✏️ Editar", key=f"edit_p_{parcela_key}", use_container_width=True):
+                        st.session_state[f"editing_pagar_{parcela_key}"] = True
                         st.rerun()
                 
                 with col3:
                     if parcela['status'] != 'pago':
-                        if st.button("💰 Pagar", key=f"pagar_p_{parcela['id']}", use_container_width=True):
-                            if db.update_pagamento_pagar(parcela['id'], date.today().strftime('%Y-%m-%d')):
+                        if st.button("💰 Pagar", key=f"pagar_p_{parcela_key}", use_container_width=True):
+                            parcela_id = parcela['id'] or db.materializar_parcela_pagar(
+                                parcela['conta_pagar_id'], parcela['numero_parcela'])
+                            if parcela_id and db.update_pagamento_pagar(parcela_id, date.today().strftime('%Y-%m-%d')):
                                 st.success("Pago!")
                                 st.rerun()
                     else:
                         st.success("✓ Pago")
                 
                 with col4:
-                    if st.button("🗑️", key=f"del_p_{parcela['id']}", use_container_width=True, 
+                    if st.button("🗑️", key=f"del_p_{parcela_key}", use_container_width=True, 
                                 help="Excluir esta parcela"):
-                        if db.delete_parcela_pagar(parcela['id']):
+                        parcela_id = parcela['id'] or db.materializar_parcela_pagar(
+                            parcela['conta_pagar_id'], parcela['numero_parcela'])
+                        if parcela_id and db.delete_parcela_pagar(parcela_id):
                             st.success("Parcela excluída!")
                             st.rerun()
                         else:
                             st.error("Erro ao excluir parcela")
                 
                 # Formulário de edição
-                if st.session_state.get(f"editing_pagar_{parcela['id']}", False):
-                    with st.form(f"form_edit_pagar_{parcela['id']}"):
+                if st.session_state.get(f"editing_pagar_{parcela_key}", False):
+                    with st.form(f"form_edit_pagar_{parcela_key}"):
                         st.markdown("#### ✏️ Editar Parcela")
                         
                         # Buscar informações da conta principal
-                        import sqlite3
-                        conn = sqlite3.connect('pilates.db')
-                        cursor = conn.cursor()
-                        cursor.execute('''
-                            SELECT recorrente, data_debito, valor_total
-                            FROM contas_pagar 
-                            WHERE id=(SELECT conta_pagar_id FROM parcelas_pagar WHERE id=?)
-                        ''', (parcela['id'],))
-                        conta_info = cursor.fetchone()
-                        conn.close()
+                        with db.connection() as conn:
+                            cursor = conn.cursor()
+                            cursor.execute('''
+                                SELECT recorrente, data_debito, valor_total
+                                FROM contas_pagar 
+                                WHERE id=?
+                            ''', (parcela['conta_pagar_id'],))
+                            conta_info = cursor.fetchone()
                         
                         is_recorrente = conta_info[0] if conta_info else 0
                         data_debito_original = conta_info[1] if conta_info else None
@@ -2263,27 +2231,27 @@ def contas_pagar_section():
                                        "Manutenção", "Salário", "Impostos", "Marketing", "Outros"].index(parcela['tipo_debito']) 
                                     if parcela['tipo_debito'] in ["Aluguel", "Energia", "Água", "Internet", "Equipamento", 
                                                                     "Manutenção", "Salário", "Impostos", "Marketing", "Outros"] else 10,
-                                key=f"edit_tipo_p_{parcela['id']}")
+                                key=f"edit_tipo_p_{parcela_key}")
                             edit_valor_p = st.number_input("Valor (R$):", 
                                 min_value=0.0, 
                                 value=float(parcela['valor']), 
                                 step=10.0,
-                                key=f"edit_valor_p_{parcela['id']}")
+                                key=f"edit_valor_p_{parcela_key}")
                             
                             # Sempre mostrar o checkbox recorrente
                             edit_recorrente = st.checkbox("🔄 Recorrente", 
                                 value=bool(is_recorrente), 
-                                key=f"edit_recorrente_{parcela['id']}",
+                                key=f"edit_recorrente_{parcela_key}",
                                 help="Atualizar todas as parcelas futuras com o novo valor")
                         
                         with col_e2:
                             edit_venc_p = st.date_input("Data de Vencimento:",
                                 value=datetime.strptime(parcela['data_vencimento'], '%Y-%m-%d').date(),
-                                key=f"edit_venc_p_{parcela['id']}")
+                                key=f"edit_venc_p_{parcela_key}")
                             edit_status_p = st.selectbox("Status:",
                                 ["pendente", "pago"],
                                 index=0 if parcela['status'] == 'pendente' else 1,
-                                key=f"edit_status_p_{parcela['id']}")
+                                key=f"edit_status_p_{parcela_key}")
                             
                             if edit_status_p == 'pago':
                                 if parcela['data_pagamento']:
@@ -2292,7 +2260,7 @@ def contas_pagar_section():
                                     default_pag_p = date.today()
                                 edit_data_pag_p = st.date_input("Data de Pagamento:",
                                     value=default_pag_p,
-                                    key=f"edit_data_pag_p_{parcela['id']}")
+                                    key=f"edit_data_pag_p_{parcela_key}")
                             else:
                                 edit_data_pag_p = None
                         
@@ -2303,65 +2271,33 @@ def contas_pagar_section():
                         
                         with col_save:
                             if st.form_submit_button("💾 Salvar", use_container_width=True):
-                                # Atualizar parcela
-                                import sqlite3
+                                # Atualizar parcela (gravando a ocorrência se ainda for só regra)
                                 try:
-                                    conn = sqlite3.connect('pilates.db')
+                                    parcela_id = parcela['id'] or db.materializar_parcela_pagar(
+                                        parcela['conta_pagar_id'], parcela['numero_parcela'])
+                                    if not parcela_id or not db.update_parcela_pagar(
+                                        parcela_id, edit_tipo_p, edit_valor_p,
+                                        edit_venc_p.strftime('%Y-%m-%d'), edit_status_p,
+                                        edit_data_pag_p.strftime('%Y-%m-%d') if edit_data_pag_p else None,
+                                        edit_recorrente
+                                    ):
+                                        raise RuntimeError("parcela não encontrada")
                                     
-                                    # Atualizar tipo_debito, valor_total e recorrente na conta_pagar principal
-                                    conn.execute('''
-                                        UPDATE contas_pagar 
-                                        SET tipo_debito=?, valor_total=?, recorrente=?
-                                        WHERE id=(SELECT conta_pagar_id FROM parcelas_pagar WHERE id=?)
-                                    ''', (edit_tipo_p, edit_valor_p, 1 if edit_recorrente else 0, parcela['id']))
+                                    parcelas_atualizadas = edit_recorrente and edit_valor_p != parcela['valor']
                                     
-                                    # Atualizar parcela atual
-                                    if edit_status_p == 'pago' and edit_data_pag_p:
-                                        conn.execute('''
-                                            UPDATE parcelas_pagar 
-                                            SET valor=?, data_vencimento=?, status=?, data_pagamento=?
-                                            WHERE id=?
-                                        ''', (edit_valor_p, edit_venc_p.strftime('%Y-%m-%d'), 
-                                              edit_status_p, edit_data_pag_p.strftime('%Y-%m-%d'), parcela['id']))
-                                    else:
-                                        conn.execute('''
-                                            UPDATE parcelas_pagar 
-                                            SET valor=?, data_vencimento=?, status=?, data_pagamento=NULL
-                                            WHERE id=?
-                                        ''', (edit_valor_p, edit_venc_p.strftime('%Y-%m-%d'), 
-                                              edit_status_p, parcela['id']))
-                                    
-                                    # Se for recorrente e o valor mudou, atualizar parcelas futuras
-                                    if edit_recorrente and edit_valor_p != parcela['valor']:
-                                        hoje_str = date.today().strftime('%Y-%m-%d')
-                                        cursor = conn.cursor()
-                                        cursor.execute('''
-                                            UPDATE parcelas_pagar 
-                                            SET valor=?
-                                            WHERE conta_pagar_id=(SELECT conta_pagar_id FROM parcelas_pagar WHERE id=?)
-                                            AND data_vencimento > ?
-                                            AND id != ?
-                                        ''', (edit_valor_p, parcela['id'], hoje_str, parcela['id']))
-                                        parcelas_atualizadas = cursor.rowcount
-                                    else:
-                                        parcelas_atualizadas = 0
-                                    
-                                    conn.commit()
-                                    conn.close()
-                                    
-                                    if parcelas_atualizadas > 0:
-                                        st.success(f"✅ Parcela atualizada! {parcelas_atualizadas} parcelas futuras também foram atualizadas.")
+                                    if parcelas_atualizadas:
+                                        st.success("✅ Parcela atualizada! As parcelas futuras também usarão o novo valor.")
                                     else:
                                         st.success("✅ Parcela atualizada!")
                                     
-                                    st.session_state[f"editing_pagar_{parcela['id']}"] = False
+                                    st.session_state[f"editing_pagar_{parcela_key}"] = False
                                     st.rerun()
                                 except Exception as e:
                                     st.error(f"❌ Erro ao atualizar: {e}")
                         
                         with col_cancel:
                             if st.form_submit_button("❌ Cancelar", use_container_width=True):
-                                st.session_state[f"editing_pagar_{parcela['id']}"] = False
+                                st.session_state[f"editing_pagar_{parcela_key}"] = False
                                 st.rerun()
                 
                 st.markdown("---")
@@ -2535,23 +2471,18 @@ def fluxo_caixa_mensal():
             index=2,
             key="ano_mensal")
     
-    # Buscar dados de todo o ano
-    data_inicio = f"{ano_selecionado}-01-01"
-    data_fim = f"{ano_selecionado}-12-31"
-    
-    fluxo = db.get_fluxo_caixa(data_inicio, data_fim)
-    
-    # Agrupar por mês
-    meses_receber = {}
-    meses_pagar = {}
-    
-    for data_str, valor in fluxo['receber'].items():
-        mes = data_str[:7]  # YYYY-MM
-        meses_receber[mes] = meses_receber.get(mes, 0) + valor
+    with col2:
+        if st.button("🔄 Recalcular resumo", key="rebuild_fluxo_mensal",
+                     help="Refaz os totais mensais a partir das contas cadastradas"):
+            if db.rebuild_fluxo_caixa_mensal():
+                st.success("✅ Resumo mensal recalculado!")
+            else:
+                st.error("❌ Erro ao recalcular o resumo mensal")
     
-    for data_str, valor in fluxo['pagar'].items():
-        mes = data_str[:7]  # YYYY-MM
-        meses_pagar[mes] = meses_pagar.get(mes, 0) + valor
+    # Resumo do ano já agregado por mês (tabela fluxo_caixa_mensal)
+    resumo_mensal = db.get_fluxo_caixa_mensal(ano_selecionado)
+    meses_receber = {linha['mes']: linha['receber'] for linha in resumo_mensal}
+    meses_pagar = {linha['mes']: linha['pagar'] for linha in resumo_mensal}
     
     # Criar lista de todos os meses do ano
     meses_nomes = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 
@@ -2668,8 +2599,6 @@ def attendance_history_tab():
     import streamlit as st
     from utils.database import db
     from datetime import datetime, timedelta, date
-    import sqlite3
-    from collections import defaultdict
     import calendar
     from dateutil.relativedelta import relativedelta
     
@@ -2690,46 +2619,27 @@ def attendance_history_tab():
     
     st.markdown("---")
     
-    # Buscar appointments dos últimos 3 meses até próximos 9 meses (12 meses total)
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
-    
+    # Resumo dos últimos 3 meses até próximos 9 meses (12 meses total)
     today = get_brasilia_today()
     # 3 meses atrás
     three_months_ago = today - relativedelta(months=3)
     # 9 meses à frente
     nine_months_ahead = today + relativedelta(months=9)
     
-    # Query para buscar TODOS os appointments (marcados e não marcados)
-    if selected_client_id:
-        cursor.execute('''
-            SELECT a.id, a.client_id, a.date, a.time, a.attended, u.name as client_name
-            FROM appointments a
-            JOIN users u ON a.client_id = u.id
-            WHERE a.date >= ? AND a.date <= ?
-            AND a.client_id = ?
-            ORDER BY a.date, a.time
-        ''', (three_months_ago.strftime('%Y-%m-%d'), nine_months_ahead.strftime('%Y-%m-%d'), selected_client_id))
-    else:
-        cursor.execute('''
-            SELECT a.id, a.client_id, a.date, a.time, a.attended, u.name as client_name
-            FROM appointments a
-            JOIN users u ON a.client_id = u.id
-            WHERE a.date >= ? AND a.date <= ?
-            ORDER BY a.date, a.time
-        ''', (three_months_ago.strftime('%Y-%m-%d'), nine_months_ahead.strftime('%Y-%m-%d')))
+    window_start = three_months_ago.strftime('%Y-%m-%d')
+    window_end = nine_months_ahead.strftime('%Y-%m-%d')
     
-    all_appointments = cursor.fetchall()
-    conn.close()
+    # Presenças/faltas/não marcados por dia numa única consulta agrupada;
+    # os registros de cada mês só são buscados quando o mês é aberto para edição
+    summary = db.get_attendance_summary(window_start, window_end, selected_client_id)
+    appointments_by_date = summary['by_date']
     
-    # Filtrar apenas appointments marcados para estatísticas
-    marked_appointments = [apt for apt in all_appointments if apt[4] is not None]
+    # Estatísticas gerais (apenas appointments marcados)
+    total = summary['present'] + summary['absent']
     
-    # Mostrar estatísticas gerais
-    if marked_appointments:
-        total = len(marked_appointments)
-        presencas = sum(1 for apt in marked_appointments if apt[4] == 1)
-        faltas = sum(1 for apt in marked_appointments if apt[4] == 0)
+    if total:
+        presencas = summary['present']
+        faltas = summary['absent']
         
         col_stat1, col_stat2, col_stat3, col_stat4 = st.columns(4)
         
@@ -2748,18 +2658,6 @@ def attendance_history_tab():
         
         st.markdown("---")
     
-    # Organizar appointments por data para facilitar busca
-    appointments_by_date = defaultdict(list)
-    for apt in all_appointments:
-        apt_id, client_id, date_str, time_str, attended, client_name = apt
-        appointments_by_date[date_str].append({
-            'id': apt_id,
-            'client_id': client_id,
-            'client_name': client_name,
-            'time': time_str,
-            'attended': attended
-        })
-    
     # Função para criar calendário de um mês
     def create_month_calendar(year, month, appointments_dict):
         # Nome do mês em português
@@ -2831,12 +2729,12 @@ def attendance_history_tab():
                     
                     # Verificar se há appointments neste dia
                     if date_str in appointments_dict:
-                        day_apts = appointments_dict[date_str]
+                        day_counts = appointments_dict[date_str]
                         
-                        # Separar appointments marcados e não marcados
-                        presencas_dia = sum(1 for apt in day_apts if apt['attended'] == 1)
-                        faltas_dia = sum(1 for apt in day_apts if apt['attended'] == 0)
-                        nao_marcados = sum(1 for apt in day_apts if apt['attended'] is None)
+                        # Appointments marcados e não marcados do dia
+                        presencas_dia = day_counts['present']
+                        faltas_dia = day_counts['absent']
+                        nao_marcados = day_counts['unmarked']
                         
                         # Determinar cor:
                         # AZUL = presença (attended=1)
@@ -2880,19 +2778,19 @@ def attendance_history_tab():
         html += '</table>'
         st.markdown(html, unsafe_allow_html=True)
         
-        # Lista de appointments do mês para edição
-        month_dates = [f"{year:04d}-{month:02d}-{day:02d}" for week in cal for day in week if day != 0]
-        month_appointments = []
-        
-        for date_str in sorted(month_dates):
-            if date_str in appointments_dict:
-                for apt in appointments_dict[date_str]:
-                    month_appointments.append((date_str, apt))
-        
-        if month_appointments:
-            with st.expander(f"📝 Editar registros de {meses[month]}", expanded=False):
-                for date_str, apt in month_appointments:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
+        # Registros do mês para edição: buscados só quando o mês é aberto
+        month_prefix = f"{year:04d}-{month:02d}-"
+        if any(date_str.startswith(month_prefix) for date_str in appointments_dict):
+            if st.checkbox(f"📝 Editar registros de {meses[month]}", key=f"edit_month_{year}_{month}"):
+                last_day = calendar.monthrange(year, month)[1]
+                month_appointments = db.get_appointments(
+                    client_id=selected_client_id,
+                    start_date=max(f"{month_prefix}01", window_start),
+                    end_date=min(f"{month_prefix}{last_day:02d}", window_end)
+                )
+                
+                for apt in month_appointments:
+                    date_obj = datetime.strptime(apt['date'], '%Y-%m-%d')
                     col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
                     
                     with col1:
@@ -2958,7 +2856,7 @@ def attendance_history_tab():
                 with cols[col_idx]:
                     create_month_calendar(year, month, appointments_by_date)
     
-    if not marked_appointments:
+    if not total:
         st.info("📭 Nenhum registro de presença/falta encontrado nos últimos 3 meses.")
 
 if __name__ == "__main__":
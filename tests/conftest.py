@@ -0,0 +1,18 @@
+import pytest
+
+from utils.database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Database num arquivo temporário, já migrado e com os dados padrão"""
+    database = Database(str(tmp_path / "pilates.db"))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def client_id(db):
+    """ID de um cliente recém-criado"""
+    db.create_client("Cliente Teste", "11999999999", "cliente@teste.com", "senha")
+    return next(c['id'] for c in db.get_clients() if c['email'] == "cliente@teste.com")
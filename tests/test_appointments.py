@@ -0,0 +1,20 @@
+def _key(appointment):
+    return (appointment['date'], appointment['time'], appointment['id'])
+
+
+def test_pagination_survives_deleted_cursor_row(db, client_id):
+    """A próxima página continua depois da chave mesmo se a última linha sumiu"""
+    occurrences = [(f'2030-01-{day:02d}', '08:00') for day in range(7, 12)]
+    assert all(r['accepted'] for r in db.create_appointments_bulk(client_id, occurrences))
+
+    first_page = db.get_appointments(client_id=client_id, limit=2)
+    assert [a['date'] for a in first_page] == ['2030-01-07', '2030-01-08']
+
+    with db.connection() as conn:
+        conn.execute('DELETE FROM appointments WHERE id = ?', (first_page[-1]['id'],))
+
+    second_page = db.get_appointments(client_id=client_id, limit=2, after=_key(first_page[-1]))
+    assert [a['date'] for a in second_page] == ['2030-01-09', '2030-01-10']
+
+    last_page = db.get_appointments(client_id=client_id, limit=2, after=_key(second_page[-1]))
+    assert [a['date'] for a in last_page] == ['2030-01-11']
@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+
+def _count(db, sql, params=()):
+    with db.connection() as conn:
+        return conn.execute(sql, params).fetchone()[0]
+
+
+def test_nested_error_keeps_outer_writes(db, client_id):
+    """Erro num método chamado dentro de outra transação desfaz só as escritas dele"""
+    assert db.create_appointment(client_id, "2030-01-07", "08:00")
+
+    # O último DELETE de delete_client falha depois dos anteriores
+    with db.connection() as conn:
+        conn.execute('''
+            CREATE TRIGGER block_user_delete BEFORE DELETE ON users
+            BEGIN SELECT RAISE(ABORT, 'bloqueado'); END
+        ''')
+
+    with db.connection() as conn:
+        conn.execute("INSERT INTO equipment (name, description) VALUES ('Externo', '')")
+        assert db.delete_client(client_id) is False
+
+    assert _count(db, "SELECT COUNT(*) FROM equipment WHERE name = 'Externo'") == 1
+    assert _count(db, "SELECT COUNT(*) FROM appointments WHERE client_id = ?", (client_id,)) == 1
+    assert _count(db, "SELECT COUNT(*) FROM users WHERE id = ?", (client_id,)) == 1
+
+
+def test_failed_rotation_does_not_roll_back_caller(db, client_id, monkeypatch):
+    """rotate_equipment_daily com erro não desfaz as escritas anteriores do chamador"""
+    other = db.create_client("Outro", "11888888888", "outro@teste.com", "senha")
+    assert other
+    for cid in (client_id, next(c['id'] for c in db.get_clients() if c['email'] == "outro@teste.com")):
+        with db.connection() as conn:
+            conn.execute(
+                "INSERT INTO client_schedule (client_id, day_of_week, time) VALUES (?, 1, '08:00')",
+                (cid,)
+            )
+
+    def fail(*args):
+        raise sqlite3.OperationalError("falha simulada")
+    monkeypatch.setattr(db, 'get_equipment_capacity', fail)
+
+    with db.connection() as conn:
+        conn.execute("INSERT INTO equipment (name, description) VALUES ('Externo', '')")
+        result = db.rotate_equipment_daily()
+
+    assert result['status'] == 'error'
+    assert _count(db, "SELECT COUNT(*) FROM equipment WHERE name = 'Externo'") == 1
+
+
+def test_nested_block_releases_savepoint(db):
+    """Blocos aninhados sem erro deixam a transação externa para o commit final"""
+    with db.connection() as outer:
+        outer.execute("INSERT INTO equipment (name, description) VALUES ('A', '')")
+        with db.connection() as inner:
+            assert inner is outer
+            inner.execute("INSERT INTO equipment (name, description) VALUES ('B', '')")
+        assert outer.in_transaction
+
+    assert _count(db, "SELECT COUNT(*) FROM equipment WHERE name IN ('A', 'B')") == 2
+
+
+def test_nested_writes_roll_back_with_outer_block(db):
+    """Bloco aninhado aberto antes de o externo escrever é desfeito junto com ele"""
+    with pytest.raises(RuntimeError):
+        with db.connection() as conn:
+            conn.execute("SELECT COUNT(*) FROM equipment").fetchone()
+            assert db.create_equipment('X')
+            raise RuntimeError("falha depois do bloco aninhado")
+
+    assert _count(db, "SELECT COUNT(*) FROM equipment WHERE name = 'X'") == 0
@@ -0,0 +1,68 @@
+import sqlite3
+
+from utils.database import Database
+from utils.migrations import MIGRATIONS, LATEST_SCHEMA_VERSION, run_migrations
+
+
+def _migrate_to(conn, target):
+    """Aplica os passos até `target`, como um banco antigo parado nessa versão"""
+    for version, step in MIGRATIONS:
+        if version > target:
+            break
+        step(conn.cursor())
+        conn.execute(f'PRAGMA user_version = {version}')
+    conn.commit()
+
+
+def test_m009_keeps_a_backup_of_removed_installments(tmp_path):
+    """Parcelas iguais à regra vão para a cópia; pagas e editadas ficam e valem no lugar da regra"""
+    conn = sqlite3.connect(tmp_path / "pilates.db")
+    _migrate_to(conn, 8)
+
+    # Conta recorrente gravada no formato antigo: 12 parcelas mensais
+    conn.execute('''
+        INSERT INTO contas_pagar (id, data_debito, tipo_debito, valor_total, quantidade, recorrente)
+        VALUES (1, '2025-01-31', 'Aluguel', 1500.0, 12, 1)
+    ''')
+    conn.executemany('''
+        INSERT INTO parcelas_pagar (conta_pagar_id, numero_parcela, data_vencimento, valor, data_pagamento, status)
+        VALUES (1, ?, ?, ?, ?, ?)
+    ''', [
+        (1, '2025-01-31', 1500.0, '2025-01-31', 'pago'),     # paga: fica
+        (2, '2025-02-28', 1500.0, None, 'pendente'),         # igual à regra: sai
+        (3, '2025-03-31', 1500.0, None, 'pendente'),         # igual à regra: sai
+        (4, '2025-04-30', 1800.0, None, 'pendente'),         # valor editado: fica
+        (5, '2025-05-10', 1500.0, None, 'pendente'),         # data editada: fica
+    ])
+    conn.commit()
+    before = conn.execute('SELECT * FROM parcelas_pagar ORDER BY id').fetchall()
+
+    assert run_migrations(conn) == LATEST_SCHEMA_VERSION
+
+    kept = conn.execute('SELECT numero_parcela FROM parcelas_pagar ORDER BY numero_parcela').fetchall()
+    assert [n for (n,) in kept] == [1, 4, 5]
+    backup = conn.execute('SELECT * FROM parcelas_pagar_m009_backup ORDER BY id').fetchall()
+    assert [row[2] for row in backup] == [2, 3]
+
+    # Linhas editadas valem no lugar da regra; as removidas voltam geradas
+    database = Database(str(tmp_path / "pilates.db"))
+    try:
+        parcelas = database.get_parcelas_pagar(conta_id=1, ate='2025-06-30')
+    finally:
+        database.close()
+    assert [(p['numero_parcela'], p['data_vencimento'], p['valor'], p['id'] is None) for p in parcelas] == [
+        (1, '2025-01-31', 1500.0, False),
+        (2, '2025-02-28', 1500.0, True),
+        (3, '2025-03-31', 1500.0, True),
+        (4, '2025-04-30', 1800.0, False),
+        (5, '2025-05-10', 1500.0, False),
+        (6, '2025-06-30', 1500.0, True),
+    ]
+
+    # Restaurar a cópia devolve as linhas originais
+    conn.execute('''
+        INSERT INTO parcelas_pagar SELECT * FROM parcelas_pagar_m009_backup
+        WHERE id NOT IN (SELECT id FROM parcelas_pagar)
+    ''')
+    assert conn.execute('SELECT * FROM parcelas_pagar ORDER BY id').fetchall() == before
+    conn.close()
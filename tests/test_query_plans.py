@@ -0,0 +1,15 @@
+def test_hot_queries_use_indexes(db):
+    """Nenhuma consulta quente faz varredura completa de tabela"""
+    full_scans = db.check_query_plans()
+    assert full_scans == {}, "\n".join(
+        f"{name}: {' | '.join(plan)}" for name, plan in full_scans.items()
+    )
+
+
+def test_check_detects_missing_index(db):
+    """Sem o índice de data, a consulta de agendamentos por dia vira varredura"""
+    with db.connection() as conn:
+        conn.execute('DROP INDEX idx_appointments_date_time')
+
+    assert 'get_appointments_by_date' in db.check_query_plans()
+
@@ -0,0 +1,117 @@
+import sqlite3
+
+import pytest
+
+
+def _client_names(db):
+    return sorted(c['name'] for c in db.get_clients())
+
+
+def _hits(db, method):
+    return db.get_cache_stats()['methods'].get(method, {}).get('hits', 0)
+
+
+def test_pool_write_invalidates(db, client_id):
+    """Escrita pelos métodos do Database descarta a entrada da tabela lida"""
+    assert _client_names(db) == ["Cliente Teste"]
+    hits = _hits(db, 'get_clients')
+    assert _client_names(db) == ["Cliente Teste"]
+    assert _hits(db, 'get_clients') == hits + 1
+
+    db.update_client(client_id, "Cliente Alterado", "11999999999", "cliente@teste.com")
+    assert _client_names(db) == ["Cliente Alterado"]
+
+    with db.connection() as conn:
+        conn.execute("UPDATE users SET name = 'Cliente SQL' WHERE id = ?", (client_id,))
+    assert _client_names(db) == ["Cliente SQL"]
+
+
+def test_external_write_invalidates(db, client_id):
+    """Escrita por outra conexão (outro processo) também invalida o cache"""
+    assert _client_names(db) == ["Cliente Teste"]
+
+    external = sqlite3.connect(db.db_path)
+    try:
+        external.execute("UPDATE users SET name = 'Cliente Externo' WHERE id = ?", (client_id,))
+        external.commit()
+    finally:
+        external.close()
+
+    assert _client_names(db) == ["Cliente Externo"]
+
+
+def test_rollback_keeps_entry(db, client_id):
+    """Transação desfeita não muda a tabela: a entrada continua válida"""
+    assert _client_names(db) == ["Cliente Teste"]
+
+    with pytest.raises(RuntimeError):
+        with db.connection() as conn:
+            conn.execute("UPDATE users SET name = 'Desfeito' WHERE id = ?", (client_id,))
+            # Dentro da transação o cache é ignorado e a leitura vê a escrita
+            assert _client_names(db) == ["Desfeito"]
+            raise RuntimeError("desfaz")
+
+    hits = _hits(db, 'get_clients')
+    assert _client_names(db) == ["Cliente Teste"]
+    assert _hits(db, 'get_clients') == hits + 1
+
+
+def test_other_table_write_keeps_entry(db, client_id):
+    """Escrita em tabela que o método não lê não invalida a entrada"""
+    assert _client_names(db) == ["Cliente Teste"]
+    db.create_equipment("Reformer Extra")
+
+    hits = _hits(db, 'get_clients')
+    assert _client_names(db) == ["Cliente Teste"]
+    assert _hits(db, 'get_clients') == hits + 1
+
+
+def test_cache_bounded_by_bytes(db, client_id):
+    """O total guardado respeita READ_CACHE_MAX_BYTES e resultados grandes não entram"""
+    db.clear_read_cache()
+    db.get_clients()
+    client_size = db.get_cache_stats()['bytes']
+    db.get_equipment()
+    equipment_size = db.get_cache_stats()['bytes'] - client_size
+    assert client_size > 0 and equipment_size > 0
+    largest = max(client_size, equipment_size)
+
+    # Resultado maior que o limite por entrada não é guardado
+    db.clear_read_cache()
+    db.READ_CACHE_MAX_ENTRY_BYTES = client_size - 1
+    db.get_clients()
+    db.get_clients()
+    stats = db.get_cache_stats()
+    assert stats['entries'] == 0 and stats['bytes'] == 0
+    assert stats['methods']['get_clients'] == {'hits': 0, 'misses': 2}
+
+    # Limite total: a entrada menos usada sai até caber
+    db.clear_read_cache()
+    db.READ_CACHE_MAX_ENTRY_BYTES = largest
+    db.READ_CACHE_MAX_BYTES = largest
+    db.get_clients()
+    db.get_equipment()
+    stats = db.get_cache_stats()
+    assert stats['entries'] == 1
+    assert stats['bytes'] == equipment_size
+
+    db.get_clients()
+    assert _hits(db, 'get_clients') == 0
+
+
+def test_failed_read_is_not_cached(db, client_id):
+    """Erro na leitura não fica guardado até a próxima escrita na tabela"""
+    assert db.create_conta_receber(client_id, 'Mensal', 100.0, 1, '2030-01-10')
+
+    # Renomear a tabela faz a leitura falhar sem mudar a geração de contas_receber
+    external = sqlite3.connect(db.db_path)
+    try:
+        external.execute('ALTER TABLE contas_receber RENAME TO contas_receber_tmp')
+        external.commit()
+        assert db.get_contas_receber() == []
+        external.execute('ALTER TABLE contas_receber_tmp RENAME TO contas_receber')
+        external.commit()
+    finally:
+        external.close()
+
+    assert len(db.get_contas_receber()) == 1
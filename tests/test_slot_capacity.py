@@ -0,0 +1,135 @@
+import sqlite3
+import threading
+
+import pytest
+
+from utils.database import Database
+
+
+def _occupancy(db):
+    """(contador slot_occupancy, recontagem por GROUP BY) sem linhas zeradas"""
+    with db.connection() as conn:
+        counter = dict(((d, t), n) for d, t, n in conn.execute(
+            'SELECT date, time, booked FROM slot_occupancy WHERE booked != 0'
+        ))
+        recount = dict(((d, t), n) for d, t, n in conn.execute('''
+            SELECT date, time, COUNT(*) FROM appointments
+            WHERE status != 'cancelled'
+            GROUP BY date, time
+        '''))
+    return counter, recount
+
+
+def test_concurrent_bookings_respect_capacity(db):
+    """N threads reservando o mesmo horário: no máximo `capacidade` entram"""
+    threads_count = 40
+    date, time = '2030-01-07', '08:00'
+    capacity = db.get_slot_capacity(1, time)
+
+    # Clientes direto no banco (create_client gasta ~0,25 s com bcrypt por cliente)
+    with db.connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (name, phone, email, password, type) VALUES (?, '', ?, '', 'client')",
+            [(f"Cliente {i}", f"c{i}@teste.com") for i in range(threads_count)]
+        )
+    client_ids = [c['id'] for c in db.get_clients()]
+    assert len(client_ids) == threads_count
+
+    barrier = threading.Barrier(threads_count)
+    reports = []
+    reports_lock = threading.Lock()
+
+    def book(client_id):
+        barrier.wait()
+        report = db.create_appointments_bulk(client_id, [(date, time)])
+        with reports_lock:
+            reports.extend(report)
+
+    threads = [threading.Thread(target=book, args=(cid,)) for cid in client_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    accepted = sum(1 for r in reports if r['accepted'])
+    assert 0 < accepted <= capacity
+
+    counter, recount = _occupancy(db)
+    assert recount == {(date, time): accepted}
+    assert counter == recount
+
+
+def test_occupancy_counter_follows_cancel_and_reschedule(db, client_id):
+    """slot_occupancy acompanha cancelamento, remarcação e exclusão"""
+    report = db.create_appointments_bulk(client_id, [('2030-01-07', '08:00'), ('2030-01-08', '09:00')])
+    assert all(r['accepted'] for r in report)
+    first, second = db.get_appointments(client_id=client_id)
+
+    assert db.cancel_appointment(first['id'])
+    assert db.reschedule_appointment(second['id'], '2030-01-09', '10:00')
+    assert db.create_appointments_bulk(client_id, [('2030-01-07', '08:00')])[0]['accepted']
+
+    counter, recount = _occupancy(db)
+    assert counter == recount
+
+    with db.connection() as conn:
+        conn.execute('DELETE FROM appointments WHERE client_id = ?', (client_id,))
+    counter, recount = _occupancy(db)
+    assert counter == recount == {}
+
+
+def test_capacity_changes_from_other_writers_are_seen(db):
+    """Capacidade alterada por outra instância ou outro processo é relida"""
+    assert db.get_slot_capacity(1, '08:00') == 3
+
+    other = Database(db.db_path)
+    try:
+        assert other.set_slot_capacity(5, day_of_week=1, time='08:00')
+    finally:
+        other.close()
+    assert db.get_slot_capacity(1, '08:00') == 5
+
+    external = sqlite3.connect(db.db_path)
+    external.execute("UPDATE slot_capacity SET capacity = 1 WHERE day_of_week = 1 AND time = '08:00'")
+    external.commit()
+    external.close()
+    assert db.get_slot_capacity(1, '08:00') == 1
+
+
+def test_capacity_map_resolved_once_per_booking(db, client_id, monkeypatch):
+    """Reserva em lote valida o mapa de capacidades uma vez, não por ocorrência"""
+    calls = []
+    get_capacity_map = db._get_capacity_map
+
+    def counting():
+        calls.append(1)
+        return get_capacity_map()
+    monkeypatch.setattr(db, '_get_capacity_map', counting)
+
+    occurrences = [(f'2030-01-{day:02d}', '08:00') for day in range(7, 12)]
+    report = db.create_appointments_bulk(client_id, occurrences)
+    assert all(r['accepted'] for r in report)
+    assert len(calls) == 1
+
+
+def test_weekly_generation_skips_full_slots(db, monkeypatch):
+    """Horário lotado fica de fora; erro de programação não vira 'nada gerado'"""
+    with db.connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (name, phone, email, password, type) VALUES (?, '', ?, '', 'client')",
+            [("Cliente A", "a@teste.com"), ("Cliente B", "b@teste.com")]
+        )
+        conn.execute('''
+            INSERT INTO client_schedule (client_id, day_of_week, time)
+            SELECT id, 1, '08:00' FROM users WHERE type = 'client'
+        ''')
+    assert db.set_slot_capacity(1, day_of_week=1, time='08:00')
+
+    assert db.generate_weekly_appointments('2030-01-07', '2030-01-13') is True
+    assert len(db.get_appointments(start_date='2030-01-07', end_date='2030-01-13')) == 1
+
+    def broken(*args, **kwargs):
+        raise KeyError('bug')
+    monkeypatch.setattr(db, 'get_slot_capacity', broken)
+    with pytest.raises(KeyError):
+        db.generate_weekly_appointments('2030-01-14', '2030-01-20')
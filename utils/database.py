@@ -1,9 +1,23 @@
+import functools
+import logging
+import os
+import pickle
 import sqlite3
+import threading
 import bcrypt
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, date
-import pandas as pd
-from typing import List, Dict, Optional, Union
+from time import perf_counter
+from typing import List, Dict, Optional, Union, Iterator, TYPE_CHECKING
 from zoneinfo import ZoneInfo
+from utils.migrations import run_migrations, rebuild_fluxo_caixa_mensal
+
+if TYPE_CHECKING:
+    # pandas é importado sob demanda para não pesar no import do módulo
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
 
 # Timezone de Brasília
 BRASILIA_TZ = ZoneInfo("America/Sao_Paulo")
@@ -16,435 +30,685 @@ def get_brasilia_today():
     """Retorna date de hoje no timezone de Brasília"""
     return get_brasilia_now().date()
 
+def cached_read(*tables: str):
+    """Guarda o resultado de um método de leitura do Database em cache
+    
+    O resultado fica associado aos argumentos da chamada e à geração das
+    tabelas lidas (table_versions). Qualquer escrita numa dessas tabelas
+    (métodos create_*/update_*/delete_*, SQL direto ou outro processo)
+    incrementa a geração via trigger e invalida só as entradas que dependem
+    dela. O cache é da instância, compartilhado por todas as sessões, e é
+    limitado pelo tamanho serializado dos resultados (READ_CACHE_MAX_BYTES);
+    resultados maiores que READ_CACHE_MAX_ENTRY_BYTES não são guardados.
+
+    O método decorado não deve capturar as próprias exceções: o resultado de
+    erro (ex.: []) ficaria guardado até a próxima escrita na tabela. Uma
+    exceção não é guardada; trate-a num método público que chama o decorado.
+    
+    Args:
+        tables: Tabelas lidas pelo método
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            return self._cached_call(method, tables, args, kwargs)
+        return wrapper
+    return decorator
+
 class Database:
+    # PRAGMAs aplicados uma única vez, quando a conexão é aberta pelo pool
+    CONNECTION_PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -8000",
+    )
+    
+    # Quantidade máxima de conexões ociosas mantidas pelo pool
+    POOL_SIZE = 8
+    
+    # Limites do cache de leitura (@cached_read), pelo tamanho dos resultados
+    # serializados: total guardado e maior resultado aceito (ex.: get_appointments()
+    # sem filtro traz a tabela inteira e não deve ocupar o cache sozinho)
+    READ_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    READ_CACHE_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+    
+    # Capacidades usadas quando slot_capacity não tem regra para o horário
+    DEFAULT_SLOT_CAPACITY = 3
+    DEFAULT_EQUIPMENT_CAPACITY = 1
+    
+    # Colunas retornadas por get_appointments (chave do dict -> expressão SQL)
+    _APPOINTMENT_FIELDS = (
+        ('id', 'a.id'),
+        ('client_id', 'a.client_id'),
+        ('date', 'a.date'),
+        ('time', 'a.time'),
+        ('day_of_week', 'a.day_of_week'),
+        ('client_sequence_id', 'a.client_sequence_id'),
+        ('last_equipment_used', 'a.last_equipment_used'),
+        ('status', 'a.status'),
+        ('delay_notification', 'a.delay_notification'),
+        ('absence_notification', 'a.absence_notification'),
+        ('created_at', 'a.created_at'),
+        ('is_recurring', 'a.is_recurring'),
+        ('attended', 'a.attended'),
+        ('observacao', 'a.observacao'),
+        ('equipamento', 'a.equipamento'),
+        ('client_name', 'u.name'),
+        ('client_phone', 'u.phone'),
+        ('sequence_name', 'cs.name'),
+    )
+    APPOINTMENT_COLUMNS = tuple(key for key, _ in _APPOINTMENT_FIELDS)
+    _APPOINTMENT_SELECT = ', '.join(expr for _, expr in _APPOINTMENT_FIELDS)
+    
+    # Base de get_appointments; _appointments_query acrescenta WHERE/ORDER BY/LIMIT
+    _APPOINTMENTS_SQL = f'''
+        SELECT {_APPOINTMENT_SELECT}
+        FROM appointments a
+        JOIN users u ON a.client_id = u.id
+        LEFT JOIN client_sequences cs ON a.client_sequence_id = cs.id
+    '''
+
+    # Grade diária da aba de agendamentos (get_day_view_appointments)
+    _DAY_VIEW_SQL = '''
+        SELECT a.id, a.client_id, a.time, a.attended, a.equipamento, a.observacao,
+               u.name as client_name
+        FROM appointments a
+        JOIN users u ON a.client_id = u.id
+        WHERE a.date = ?
+        ORDER BY a.time
+    '''
+
+    # Datas em que o cliente já tem agendamento no intervalo (gerar_appointments_cliente)
+    _EXISTING_DATES_SQL = '''
+        SELECT DISTINCT date FROM appointments
+        WHERE client_id = ? AND date BETWEEN ? AND ? AND status != 'cancelled'
+    '''
+
+    # Notificações não lidas mais recentes (popup do painel, get_unread_notifications)
+    _UNREAD_NOTIFICATIONS_SQL = '''
+        SELECT n.id, n.client_id, n.client_name, n.type, n.message, n.is_read, n.created_at,
+               u.phone
+        FROM notifications n
+        LEFT JOIN users u ON n.client_id = u.id
+        WHERE n.is_read = 0
+        ORDER BY n.created_at DESC
+        LIMIT ?
+    '''
+
+    # Ocupação de cada (date, time) pedido numa única consulta: agendamentos
+    # confirmados (contador slot_occupancy), do próprio cliente e horários fixos
+    # de outros clientes ainda sem agendamento naquela data.
+    # {values} recebe um '(?, ?, ?)' por par.
+    _SLOT_OCCUPANCY_SQL = '''
+        WITH req(date, time, day_of_week) AS (VALUES {values})
+        SELECT req.date, req.time,
+               COALESCE(so.booked, 0) AS confirmed,
+               EXISTS (
+                   SELECT 1 FROM appointments a
+                   WHERE a.client_id = ? AND a.date = req.date
+                   AND a.time = req.time AND a.status != 'cancelled'
+               ) AS own,
+               (SELECT COUNT(*) FROM client_schedule cs
+                WHERE cs.day_of_week = req.day_of_week AND cs.time = req.time
+                AND cs.is_active = 1 AND cs.client_id != ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM appointments a2
+                    WHERE a2.client_id = cs.client_id AND a2.date = req.date
+                    AND a2.time = req.time AND a2.status != 'cancelled'
+                )) AS fixed
+        FROM req
+        LEFT JOIN slot_occupancy so
+            ON so.date = req.date AND so.time = req.time
+    '''
+    
+    # Consulta da grade semanal detalhada (get_week_schedule_data_with_details)
+    _WEEK_DETAILS_SQL = '''
+        SELECT a.id, a.client_id, a.date, a.time, a.status, a.attended,
+               u.name, cs.equipment_id, e.name, cs.schedule_type
+        FROM appointments a
+        JOIN users u ON a.client_id = u.id
+        LEFT JOIN client_schedule cs
+            ON cs.client_id = a.client_id AND cs.day_of_week = a.day_of_week
+            AND cs.time = a.time AND cs.is_active = 1
+        LEFT JOIN equipment e ON cs.equipment_id = e.id
+        WHERE a.date >= ? AND a.date <= ?
+        AND a.status != 'cancelled'
+        AND a.attended IS NULL
+        ORDER BY a.date, a.time, a.id
+    '''
+    
+    # Agendamentos não cancelados por semana (get_weeks_with_appointments);
+    # date(..., 'weekday 0', '-6 days') é a segunda-feira da semana da data
+    _WEEKLY_COUNTS_SQL = '''
+        SELECT date(date, 'weekday 0', '-6 days') AS week_start, COUNT(*)
+        FROM appointments
+        WHERE date BETWEEN ? AND ?
+        AND status != 'cancelled'
+        AND strftime('%w', date) BETWEEN '1' AND '5'
+        GROUP BY week_start
+    '''
+    
+    # Presenças (attended = 1), faltas (0) e não marcados (NULL) por dia
+    # (get_attendance_summary); {client_filter} limita a um cliente
+    _ATTENDANCE_SUMMARY_SQL = '''
+        SELECT a.date,
+               SUM(a.attended IS 1), SUM(a.attended IS 0), SUM(a.attended IS NULL)
+        FROM appointments a
+        JOIN users u ON a.client_id = u.id
+        WHERE a.date BETWEEN ? AND ?{client_filter}
+        GROUP BY a.date
+    '''
+    
     def __init__(self, db_path: str = "pilates.db"):
         self.db_path = db_path
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._idle_connections: List[sqlite3.Connection] = []
+        # Capacidades em cache: (geração de slot_capacity, {(day_of_week, time, equipment_id): capacidade})
+        self._capacity_cache: Optional[tuple] = None
+        # Conexão usada só para PRAGMA data_version (invalidação de caches)
+        self._version_conn: Optional[sqlite3.Connection] = None
+        self._version_lock = threading.Lock()
+        # Notificações não lidas em cache: (data_version da leitura, contagem)
+        self._unread_cache: Optional[tuple] = None
+        # Gerações de table_versions em cache: (data_version da leitura, {tabela: geração})
+        self._table_versions_cache: Optional[tuple] = None
+        # Cache de leitura (@cached_read): {(método, args, kwargs): (token, resultado serializado)}
+        self._read_cache: 'OrderedDict[tuple, tuple]' = OrderedDict()
+        self._read_cache_lock = threading.Lock()
+        self._read_cache_bytes = 0
+        self._read_cache_stats: Dict[str, Dict[str, int]] = {}
         self.init_database()
+    
+    # MÉTODOS DE CONEXÃO
+    def _open_connection(self) -> sqlite3.Connection:
+        """Abre uma nova conexão e aplica os PRAGMAs de conexão"""
+        # check_same_thread=False: a conexão pode voltar ao pool e ser usada por
+        # outra thread (cada rerun do Streamlit roda em uma thread própria), mas
+        # nunca por duas threads ao mesmo tempo
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma in self.CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        """Verifica se a conexão do pool ainda responde"""
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def _acquire_connection(self) -> sqlite3.Connection:
+        """Retira uma conexão saudável do pool ou abre uma nova"""
+        while True:
+            with self._pool_lock:
+                conn = self._idle_connections.pop() if self._idle_connections else None
+            if conn is None:
+                return self._open_connection()
+            if self._is_healthy(conn):
+                return conn
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+    
+    def _release_connection(self, conn: sqlite3.Connection):
+        """Devolve a conexão ao pool (ou fecha, se o pool estiver cheio)"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
         
-    def init_database(self):
-        """Inicializa o banco de dados com todas as tabelas necessárias"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Tabela de usuários
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                phone TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                type TEXT NOT NULL DEFAULT 'client',
-                medical_history TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabela de equipamentos
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS equipment (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabela de sequências de equipamentos (templates globais)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS equipment_sequences (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                day_of_week INTEGER NOT NULL,
-                equipment_order TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabela de sequências personalizadas por cliente
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS client_sequences (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_id INTEGER NOT NULL,
-                name TEXT NOT NULL,
-                day_of_week INTEGER NOT NULL,
-                equipment_order TEXT NOT NULL,
-                current_position INTEGER DEFAULT 0,
-                is_active BOOLEAN DEFAULT 1,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (client_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Tabela de horários fixos por cliente
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS client_schedule (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_id INTEGER NOT NULL,
-                day_of_week INTEGER NOT NULL,
-                time TEXT NOT NULL,
-                is_active BOOLEAN DEFAULT 1,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (client_id) REFERENCES users (id),
-                UNIQUE(client_id, day_of_week, time)
-            )
-        ''')
-        
-        # Tabela de agendamentos
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS appointments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_id INTEGER NOT NULL,
-                date TEXT NOT NULL,
-                time TEXT NOT NULL,
-                day_of_week INTEGER NOT NULL,
-                client_sequence_id INTEGER,
-                last_equipment_used TEXT,
-                status TEXT DEFAULT 'scheduled',
-                delay_notification TEXT,
-                absence_notification TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (client_id) REFERENCES users (id),
-                FOREIGN KEY (client_sequence_id) REFERENCES client_sequences (id)
-            )
-        ''')
+        with self._pool_lock:
+            if len(self._idle_connections) < self.POOL_SIZE:
+                self._idle_connections.append(conn)
+                return
+        conn.close()
+    
+    @contextmanager
+    def connection(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        """Fornece a conexão da thread atual, reutilizando conexões do pool.
         
-        # Tabela de notificações
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS notifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_id INTEGER NOT NULL,
-                client_name TEXT NOT NULL,
-                type TEXT NOT NULL,
-                message TEXT NOT NULL,
-                is_read INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (client_id) REFERENCES users (id)
-            )
-        ''')
+        Faz commit ao sair do bloco mais externo e rollback em caso de exceção.
+        Blocos aninhados (ex.: um método chamando outro) compartilham a mesma
+        conexão e transação, cada um dentro de um SAVEPOINT: uma exceção que sai
+        do bloco aninhado desfaz só as escritas dele, sem tocar nas escritas
+        anteriores do bloco externo. Não chame commit()/rollback() dentro do
+        bloco; deixe a exceção sair dele.
         
-        # Tabela de contas a receber
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS contas_receber (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_id INTEGER NOT NULL,
-                tipo_plano TEXT NOT NULL,
-                valor REAL NOT NULL,
-                quantidade INTEGER,
-                data_vencimento TEXT NOT NULL,
-                data_pagamento TEXT,
-                status TEXT DEFAULT 'pendente',
-                observacoes TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (client_id) REFERENCES users (id)
-            )
-        ''')
+        Args:
+            immediate: Abre a transação com BEGIN IMMEDIATE, reservando a escrita
+                antes das leituras (checagem + INSERT sem corrida entre sessões)
         
-        # Tabela de contas a pagar
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS contas_pagar (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                data_debito TEXT NOT NULL,
-                tipo_debito TEXT NOT NULL,
-                valor_total REAL NOT NULL,
-                quantidade INTEGER DEFAULT 1,
-                tipo_parcelamento TEXT DEFAULT 'mensal',
-                status TEXT DEFAULT 'pendente',
-                observacoes TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        Uso:
+            with db.connection() as conn:
+                conn.execute(...)
+        """
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        
+        if conn is not None:
+            # Bloco aninhado: reutiliza conexão e transação do bloco externo.
+            # Se o externo ainda não escreveu, abre a transação dele aqui; senão
+            # o SAVEPOINT viraria uma transação própria e o RELEASE faria commit
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            local.depth = getattr(local, 'depth', 0) + 1
+            savepoint = f'sp_{local.depth}'
+            conn.execute(f'SAVEPOINT {savepoint}')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute(f'ROLLBACK TO {savepoint}')
+                conn.execute(f'RELEASE {savepoint}')
+                raise
+            else:
+                conn.execute(f'RELEASE {savepoint}')
+            finally:
+                local.depth -= 1
+            return
         
-        # Tabela de parcelas de contas a pagar
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS parcelas_pagar (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                conta_pagar_id INTEGER NOT NULL,
-                numero_parcela INTEGER NOT NULL,
-                data_vencimento TEXT NOT NULL,
-                valor REAL NOT NULL,
-                data_pagamento TEXT,
-                status TEXT DEFAULT 'pendente',
-                FOREIGN KEY (conta_pagar_id) REFERENCES contas_pagar (id)
-            )
-        ''')
+        conn = self._acquire_connection()
+        local.conn = conn
+        try:
+            if immediate:
+                conn.execute('BEGIN IMMEDIATE')
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            local.conn = None
+            self._release_connection(conn)
+    
+    def _data_version(self) -> int:
+        """Versão dos dados do arquivo (PRAGMA data_version)
         
-        conn.commit()
+        Lida sempre na mesma conexão dedicada, que nunca escreve: o valor muda
+        a cada commit de qualquer outra conexão (do pool ou de outro processo).
+        Não lê tabelas, então serve para validar caches a custo quase zero.
+        """
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            return self._version_conn.execute('PRAGMA data_version').fetchone()[0]
+    
+    def close(self):
+        """Fecha todas as conexões ociosas do pool"""
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
+        with self._pool_lock:
+            connections, self._idle_connections = self._idle_connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+    
+    def get_table_versions(self) -> Dict[str, int]:
+        """Geração atual de cada tabela monitorada (tabela table_versions)
         
-        # Migrar banco existente se necessário
-        self.migrate_database()
+        A geração é incrementada por triggers a cada INSERT/UPDATE/DELETE na
+        tabela. A leitura fica em cache até o próximo commit no banco
+        (PRAGMA data_version), então consultar com frequência é barato.
+        """
+        version = self._data_version()
+        cached = self._table_versions_cache
+        if cached is not None and cached[0] == version:
+            return cached[1]
         
-        # Criar usuário master padrão se não existir
-        self.create_default_master()
+        try:
+            with self.connection() as conn:
+                rows = conn.execute('SELECT table_name, version FROM table_versions').fetchall()
+        except Exception as e:
+            print(f"Erro ao ler versões das tabelas: {e}")
+            return {}
         
-        # Criar equipamentos padrão se não existirem
-        self.create_default_equipment()
+        versions = dict(rows)
+        self._table_versions_cache = (version, versions)
+        return versions
+    
+    def get_change_token(self, *tables: str) -> tuple:
+        """Token com a geração atual das tabelas informadas (todas, se nenhuma)
+        
+        O token é hashable e pode ser usado como chave de cache; passe-o depois
+        para changed_since() para saber se alguma dessas tabelas mudou. É o que
+        valida o cache de leitura (@cached_read) e o mapa de capacidades; a
+        interface lê pelos métodos do Database e não precisa de cache próprio.
+        
+        Uso:
+            token = db.get_change_token('users', 'client_schedule')
+            ...
+            if db.changed_since(token): ...
+        """
+        versions = self.get_table_versions()
+        names = tables or sorted(versions)
+        return tuple((table, versions.get(table)) for table in names)
+    
+    def changed_since(self, token: tuple) -> bool:
+        """Indica se alguma tabela do token foi alterada desde que ele foi gerado"""
+        versions = self.get_table_versions()
+        return any(versions.get(table) != generation for table, generation in token)
+    
+    def _cached_call(self, method, tables: tuple, args: tuple, kwargs: dict):
+        """Executa um método decorado com @cached_read, usando o cache quando válido"""
+        name = method.__name__
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        
+        # Dentro de uma transação a leitura precisa enxergar as escritas ainda
+        # não confirmadas, que não mudam a geração vista pelas outras conexões
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and conn.in_transaction:
+            return method(self, *args, **kwargs)
+        
+        token = self.get_change_token(*tables)
+        if any(generation is None for _, generation in token):
+            return method(self, *args, **kwargs)
+        
+        with self._read_cache_lock:
+            stats = self._read_cache_stats.setdefault(name, {'hits': 0, 'misses': 0})
+            entry = self._read_cache.get(key)
+            if entry is not None and entry[0] == token:
+                self._read_cache.move_to_end(key)
+                stats['hits'] += 1
+                data = entry[1]
+            else:
+                stats['misses'] += 1
+                data = None
+        
+        # Cada chamada recebe uma cópia: alterações do chamador não vazam para
+        # outras sessões
+        if data is not None:
+            return pickle.loads(data)
+        
+        result = method(self, *args, **kwargs)
+        data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.READ_CACHE_MAX_ENTRY_BYTES:
+            return result
+
+        with self._read_cache_lock:
+            previous = self._read_cache.pop(key, None)
+            if previous is not None:
+                self._read_cache_bytes -= len(previous[1])
+            self._read_cache[key] = (token, data)
+            self._read_cache_bytes += len(data)
+            # Descarta os menos usados até caber no limite total
+            while self._read_cache_bytes > self.READ_CACHE_MAX_BYTES:
+                _, (_, evicted) = self._read_cache.popitem(last=False)
+                self._read_cache_bytes -= len(evicted)
+        return result
+    
+    def get_cache_stats(self) -> Dict:
+        """Contadores do cache de leitura (@cached_read)
         
-        conn.close()
+        Returns:
+            {'hits', 'misses', 'entries', 'bytes', 'methods': {método: {'hits', 'misses'}}}
+        """
+        with self._read_cache_lock:
+            methods = {name: dict(stats) for name, stats in self._read_cache_stats.items()}
+            entries = len(self._read_cache)
+            size = self._read_cache_bytes
+        return {
+            'hits': sum(stats['hits'] for stats in methods.values()),
+            'misses': sum(stats['misses'] for stats in methods.values()),
+            'entries': entries,
+            'bytes': size,
+            'methods': methods
+        }
     
-    def migrate_database(self):
-        """Migra banco de dados existente para nova estrutura"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def clear_read_cache(self):
+        """Descarta os resultados guardados e zera os contadores do cache de leitura"""
+        with self._read_cache_lock:
+            self._read_cache.clear()
+            self._read_cache_bytes = 0
+            self._read_cache_stats.clear()
+    
+    def hot_queries(self) -> Dict[str, tuple]:
+        """Consultas quentes que precisam usar índice (nome -> (SQL, parâmetros de exemplo))
+
+        O SQL vem das mesmas constantes e do mesmo montador usados pelos métodos,
+        então a verificação acompanha o que o app realmente executa.
+        """
+        return {
+            'get_appointments_by_date': self._appointments_query(date_filter='2025-01-06'),
+            'get_appointments_by_client': self._appointments_query(client_id=1),
+            'get_appointments_by_range': self._appointments_query(
+                start_date='2025-01-01', end_date='2025-01-31'
+            ),
+            'get_appointments_client_range': self._appointments_query(
+                client_id=1, start_date='2025-01-01', end_date='2025-01-31'
+            ),
+            'get_appointments_page': self._appointments_query(
+                start_date='2025-01-01', limit=50, after=('2025-01-01', '08:00', 1)
+            ),
+            'create_appointments_bulk_occupancy': (
+                self._SLOT_OCCUPANCY_SQL.format(values='(?, ?, ?)'), ('2025-01-06', '08:00', 1, 1, 1)
+            ),
+            'week_schedule_with_details': (self._WEEK_DETAILS_SQL, ('2025-01-06', '2025-01-10')),
+            'weeks_with_appointments': (self._WEEKLY_COUNTS_SQL, ('2025-01-06', '2025-03-28')),
+            'gerar_appointments_existing_dates': (
+                self._EXISTING_DATES_SQL, (1, '2025-01-06', '2025-07-06')
+            ),
+            'day_view_appointments': (self._DAY_VIEW_SQL, ('2025-01-06',)),
+            'attendance_summary_all': (
+                self._ATTENDANCE_SUMMARY_SQL.format(client_filter=''),
+                ('2025-01-01', '2025-12-31')
+            ),
+            'attendance_summary_client': (
+                self._ATTENDANCE_SUMMARY_SQL.format(client_filter=' AND a.client_id = ?'),
+                ('2025-01-01', '2025-12-31', 1)
+            ),
+            'unread_notifications_popup': (self._UNREAD_NOTIFICATIONS_SQL, (5,)),
+        }
+
+    def check_query_plans(self) -> Dict[str, List[str]]:
+        """Roda EXPLAIN QUERY PLAN nas consultas de hot_queries().
         
-        try:
-            # Verificar se coluna client_sequence_id existe
-            cursor.execute("PRAGMA table_info(appointments)")
-            columns = [col[1] for col in cursor.fetchall()]
-            
-            if 'client_sequence_id' not in columns:
-                # Adicionar nova coluna se não existir
-                cursor.execute('ALTER TABLE appointments ADD COLUMN client_sequence_id INTEGER')
-                
-                # Migrar dados da coluna antiga se existir
-                if 'equipment_sequence_id' in columns:
-                    cursor.execute('''
-                        UPDATE appointments 
-                        SET client_sequence_id = equipment_sequence_id 
-                        WHERE equipment_sequence_id IS NOT NULL
-                    ''')
-                
-                conn.commit()
-                print("Banco de dados migrado com sucesso!")
-            
-            # Verificar se coluna current_position existe na tabela client_sequences
-            cursor.execute("PRAGMA table_info(client_sequences)")
-            seq_columns = [col[1] for col in cursor.fetchall()]
-            
-            if 'current_position' not in seq_columns:
-                cursor.execute('ALTER TABLE client_sequences ADD COLUMN current_position INTEGER DEFAULT 0')
-                conn.commit()
-                print("Coluna current_position adicionada!")
-            
-            # Verificar se coluna is_recurring existe na tabela appointments
-            if 'is_recurring' not in columns:
-                cursor.execute('ALTER TABLE appointments ADD COLUMN is_recurring INTEGER DEFAULT 0')
-                conn.commit()
-                print("Coluna is_recurring adicionada!")
-            
-            # Verificar se coluna equipment_id existe na tabela client_schedule
-            cursor.execute("PRAGMA table_info(client_schedule)")
-            schedule_columns = [col[1] for col in cursor.fetchall()]
-            
-            if 'equipment_id' not in schedule_columns:
-                cursor.execute('ALTER TABLE client_schedule ADD COLUMN equipment_id INTEGER')
-                conn.commit()
-                print("Coluna equipment_id adicionada na tabela client_schedule!")
-            
-            # Verificar se coluna schedule_type existe na tabela client_schedule
-            if 'schedule_type' not in schedule_columns:
-                cursor.execute("ALTER TABLE client_schedule ADD COLUMN schedule_type TEXT DEFAULT 'Fixo'")
-                conn.commit()
-                print("Coluna schedule_type adicionada na tabela client_schedule!")
-            
-            # Verificar se coluna sessions_count existe na tabela client_schedule
-            if 'sessions_count' not in schedule_columns:
-                cursor.execute('ALTER TABLE client_schedule ADD COLUMN sessions_count INTEGER DEFAULT 0')
-                conn.commit()
-                print("Coluna sessions_count adicionada na tabela client_schedule!")
-            
-            # Verificar e adicionar coluna attended na tabela appointments
-            cursor.execute("PRAGMA table_info(appointments)")
-            appointments_columns = [col[1] for col in cursor.fetchall()]
-            
-            if 'attended' not in appointments_columns:
-                cursor.execute('ALTER TABLE appointments ADD COLUMN attended INTEGER DEFAULT NULL')
-                conn.commit()
-                print("Coluna attended adicionada na tabela appointments!")
-            
-            # Verificar e adicionar coluna recorrente na tabela contas_pagar
-            cursor.execute("PRAGMA table_info(contas_pagar)")
-            contas_pagar_columns = [col[1] for col in cursor.fetchall()]
-            
-            if 'recorrente' not in contas_pagar_columns:
-                cursor.execute('ALTER TABLE contas_pagar ADD COLUMN recorrente INTEGER DEFAULT 0')
-                conn.commit()
-                print("Coluna recorrente adicionada na tabela contas_pagar!")
+        Returns:
+            Dict {nome_da_consulta: [passos do plano]} apenas com as consultas
+            que fazem varredura completa de tabela (vazio = tudo indexado)
+        """
+        full_scans = {}
+        with self.connection() as conn:
+            for name, (query, params) in self.hot_queries().items():
+                plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+                # CTEs (ex.: lista VALUES de parâmetros) não são tabelas do banco
+                ctes = {step.split()[-1] for step in plan if step.startswith('CO-ROUTINE')}
+                # "SCAN tabela" = leitura da tabela inteira, mesmo "USING INDEX"
+                # (percorre o índice todo só para obter a ordem)
+                scans = [step for step in plan
+                         if step.startswith('SCAN')
+                         and 'CONSTANT ROW' not in step
+                         and step.split()[1] not in ctes]
+                if scans:
+                    full_scans[name] = plan
+        return full_scans
+    
+    def init_database(self):
+        """Inicializa o banco de dados: aplica migrações pendentes e cria dados padrão"""
+        # Migrar banco existente se necessário (inclui criação das tabelas)
+        self.migrate_database()
 
-            # Backfill: atribuir equipamento onde estiver NULL para horários ativos
-            try:
-                cursor.execute('''
-                    SELECT id, client_id, day_of_week, time
-                    FROM client_schedule
-                    WHERE is_active = 1 AND (equipment_id IS NULL OR equipment_id = '')
-                ''')
-                rows = cursor.fetchall()
-                for sched_id, client_id, day_of_week, time in rows:
-                    eq_id = self.assign_equipment_to_client(client_id, day_of_week, time)
-                    if eq_id:
-                        cursor.execute('UPDATE client_schedule SET equipment_id = ? WHERE id = ?', (eq_id, sched_id))
-                conn.commit()
-            except Exception as e:
-                print(f"Backfill equipment_id falhou: {e}")
+        with self.connection():
+            # Criar usuário master padrão se não existir
+            self.create_default_master()
             
-        except sqlite3.OperationalError as e:
-            # Tabela pode não existir ainda, isso é normal
-            print(f"⚠️ Migração: {e}")
-        
-        conn.close()
+            # Criar equipamentos padrão se não existirem
+            self.create_default_equipment()
+    
+    def migrate_database(self) -> int:
+        """Aplica as migrações de schema pendentes e retorna a versão atual
+
+        As migrações fazem commit das próprias transações, então rodam numa
+        conexão do pool separada de qualquer bloco connection() aberto.
+        """
+        conn = self._acquire_connection()
+        try:
+            return run_migrations(conn)
+        finally:
+            self._release_connection(conn)
         
     def create_default_master(self):
         """Cria usuário master padrão"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        # Verificar se já existe um usuário master
-        cursor.execute("SELECT id FROM users WHERE type = 'master'")
-        if cursor.fetchone() is None:
-            master_password = bcrypt.hashpw('master123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            cursor.execute('''
-                INSERT INTO users (name, phone, email, password, type) 
-                VALUES (?, ?, ?, ?, ?)
-            ''', ('Master Admin', '(11) 99999-9999', 'master@pilates.com', master_password, 'master'))
-            conn.commit()
+            # Verificar se já existe um usuário master
+            cursor.execute("SELECT id FROM users WHERE type = 'master'")
+            if cursor.fetchone() is None:
+                master_password = bcrypt.hashpw('master123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                cursor.execute('''
+                    INSERT INTO users (name, phone, email, password, type) 
+                    VALUES (?, ?, ?, ?, ?)
+                ''', ('Master Admin', '(11) 99999-9999', 'master@pilates.com', master_password, 'master'))
             
-        conn.close()
-    
     def create_default_equipment(self):
         """Cria equipamentos padrão"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Lista de equipamentos padrão
-        default_equipment = [
-            ('Cavalo', 'Equipamento de Pilates'),
-            ('Cadilak', 'Equipamento de Pilates'),
-            ('Chase', 'Equipamento de Pilates'),
-            ('Solo', 'Exercícios no solo')
-        ]
+        with self.connection() as conn:
+            cursor = conn.cursor()
+        
+            # Lista de equipamentos padrão
+            default_equipment = [
+                ('Cavalo', 'Equipamento de Pilates'),
+                ('Cadilak', 'Equipamento de Pilates'),
+                ('Chase', 'Equipamento de Pilates'),
+                ('Solo', 'Exercícios no solo')
+            ]
         
-        # Verificar se já existem equipamentos
-        cursor.execute("SELECT COUNT(*) FROM equipment")
-        count = cursor.fetchone()[0]
+            # Verificar se já existem equipamentos
+            cursor.execute("SELECT COUNT(*) FROM equipment")
+            count = cursor.fetchone()[0]
         
-        if count == 0:
-            # Inserir equipamentos padrão
-            cursor.executemany('''
-                INSERT INTO equipment (name, description) 
-                VALUES (?, ?)
-            ''', default_equipment)
-            conn.commit()
-            print("✅ Equipamentos padrão criados!")
+            if count == 0:
+                # Inserir equipamentos padrão
+                cursor.executemany('''
+                    INSERT INTO equipment (name, description) 
+                    VALUES (?, ?)
+                ''', default_equipment)
+                print("✅ Equipamentos padrão criados!")
             
-        conn.close()
-
     # MÉTODOS DE USUÁRIO
     def authenticate_user(self, email: str, password: str) -> Optional[Dict]:
         """Autentica usuário"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
-        user = cursor.fetchone()
-        
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        if user:
-            stored_password = user[4]
-            # Se a senha armazenada é bytes, use diretamente; se é string, faça encode
-            if isinstance(stored_password, str):
-                stored_password = stored_password.encode('utf-8')
-            
-            if bcrypt.checkpw(password.encode('utf-8'), stored_password):
-                return {
-                    'id': user[0],
-                    'name': user[1],
-                    'phone': user[2],
-                    'email': user[3],
-                    'type': user[5],
-                    'medical_history': user[6]
-                }
-        return None
+            cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
+            user = cursor.fetchone()
+        
+            if user:
+                stored_password = user[4]
+                # Se a senha armazenada é bytes, use diretamente; se é string, faça encode
+                if isinstance(stored_password, str):
+                    stored_password = stored_password.encode('utf-8')
+            
+                if bcrypt.checkpw(password.encode('utf-8'), stored_password):
+                    return {
+                        'id': user[0],
+                        'name': user[1],
+                        'phone': user[2],
+                        'email': user[3],
+                        'type': user[5],
+                        'medical_history': user[6]
+                    }
+            return None
     
     def create_client(self, name: str, phone: str, email: str, password: str, medical_history: str = "") -> bool:
         """Cria novo cliente"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
             
-            cursor.execute('''
-                INSERT INTO users (name, phone, email, password, type, medical_history) 
-                VALUES (?, ?, ?, ?, 'client', ?)
-            ''', (name, phone, email, hashed_password, medical_history))
+                cursor.execute('''
+                    INSERT INTO users (name, phone, email, password, type, medical_history) 
+                    VALUES (?, ?, ?, ?, 'client', ?)
+                ''', (name, phone, email, hashed_password, medical_history))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except sqlite3.IntegrityError:
             return False
     
+    @cached_read('users')
     def get_clients(self) -> List[Dict]:
         """Retorna lista de clientes com todos os campos incluindo os novos"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, phone, email, password, type, medical_history, created_at,
-                   data_inicio_contrato, tipo_contrato, sessoes_contratadas, 
-                   sessoes_utilizadas, dias_semana, contrato_ativo
-            FROM users 
-            WHERE type = "client" 
-            ORDER BY name
-        ''')
-        clients = cursor.fetchall()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        conn.close()
+            cursor.execute('''
+                SELECT id, name, phone, email, password, type, medical_history, created_at,
+                       data_inicio_contrato, tipo_contrato, sessoes_contratadas, 
+                       sessoes_utilizadas, dias_semana, contrato_ativo
+                FROM users 
+                WHERE type = "client" 
+                ORDER BY name
+            ''')
+            clients = cursor.fetchall()
         
-        return [{
-            'id': client[0],
-            'name': client[1],
-            'phone': client[2],
-            'email': client[3],
-            'medical_history': client[6] or '',
-            'created_at': client[7],
-            'data_inicio_contrato': client[8],
-            'tipo_contrato': client[9],
-            'sessoes_contratadas': client[10] or 0,
-            'sessoes_utilizadas': client[11] or 0,
-            'dias_semana': client[12],
-            'contrato_ativo': client[13]
-        } for client in clients]
+            return [{
+                'id': client[0],
+                'name': client[1],
+                'phone': client[2],
+                'email': client[3],
+                'medical_history': client[6] or '',
+                'created_at': client[7],
+                'data_inicio_contrato': client[8],
+                'tipo_contrato': client[9],
+                'sessoes_contratadas': client[10] or 0,
+                'sessoes_utilizadas': client[11] or 0,
+                'dias_semana': client[12],
+                'contrato_ativo': client[13]
+            } for client in clients]
     
     def update_client(self, client_id: int, name: str, phone: str, email: str, medical_history: str = "") -> bool:
         """Atualiza dados do cliente"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('''
-                UPDATE users SET name = ?, phone = ?, email = ?, medical_history = ? 
-                WHERE id = ? AND type = 'client'
-            ''', (name, phone, email, medical_history, client_id))
+                cursor.execute('''
+                    UPDATE users SET name = ?, phone = ?, email = ?, medical_history = ? 
+                    WHERE id = ? AND type = 'client'
+                ''', (name, phone, email, medical_history, client_id))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except:
             return False
     
     def delete_client(self, client_id: int) -> bool:
         """Exclui cliente e todos os dados relacionados"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            # Excluir agendamentos do cliente
-            cursor.execute('DELETE FROM appointments WHERE client_id = ?', (client_id,))
+                # Excluir agendamentos do cliente
+                cursor.execute('DELETE FROM appointments WHERE client_id = ?', (client_id,))
             
-            # Excluir horários fixos do cliente
-            cursor.execute('DELETE FROM client_schedule WHERE client_id = ?', (client_id,))
+                # Excluir horários fixos do cliente
+                cursor.execute('DELETE FROM client_schedule WHERE client_id = ?', (client_id,))
             
-            # Excluir sequências personalizadas do cliente
-            cursor.execute('DELETE FROM client_sequences WHERE client_id = ?', (client_id,))
+                # Excluir sequências personalizadas do cliente
+                cursor.execute('DELETE FROM client_sequences WHERE client_id = ?', (client_id,))
             
-            # Excluir o cliente
-            cursor.execute('DELETE FROM users WHERE id = ? AND type = "client"', (client_id,))
+                # Excluir o cliente
+                cursor.execute('DELETE FROM users WHERE id = ? AND type = "client"', (client_id,))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except Exception as e:
             print(f"Erro ao excluir cliente: {e}")
             return False
@@ -453,59 +717,52 @@ class Database:
     def create_equipment(self, name: str, description: str = "") -> bool:
         """Cria novo equipamento"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('INSERT INTO equipment (name, description) VALUES (?, ?)', (name, description))
+                cursor.execute('INSERT INTO equipment (name, description) VALUES (?, ?)', (name, description))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except:
             return False
     
+    @cached_read('equipment')
     def get_equipment(self) -> List[Dict]:
         """Retorna lista de equipamentos"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM equipment ORDER BY name')
-        equipment = cursor.fetchall()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        conn.close()
+            cursor.execute('SELECT * FROM equipment ORDER BY name')
+            equipment = cursor.fetchall()
         
-        return [{
-            'id': equip[0],
-            'name': equip[1],
-            'description': equip[2] or '',
-            'created_at': equip[3]
-        } for equip in equipment]
+            return [{
+                'id': equip[0],
+                'name': equip[1],
+                'description': equip[2] or '',
+                'created_at': equip[3]
+            } for equip in equipment]
     
     def update_equipment(self, equipment_id: int, name: str, description: str = "") -> bool:
         """Atualiza equipamento"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('UPDATE equipment SET name = ?, description = ? WHERE id = ?', 
-                         (name, description, equipment_id))
+                cursor.execute('UPDATE equipment SET name = ?, description = ? WHERE id = ?', 
+                             (name, description, equipment_id))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except:
             return False
     
     def delete_equipment(self, equipment_id: int) -> bool:
         """Exclui equipamento"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('DELETE FROM equipment WHERE id = ?', (equipment_id,))
-            conn.commit()
-            conn.close()
-            return True
+                cursor.execute('DELETE FROM equipment WHERE id = ?', (equipment_id,))
+                return True
         except:
             return False
 
@@ -513,60 +770,56 @@ class Database:
     def create_equipment_sequence(self, name: str, day_of_week: int, equipment_order: List[int]) -> bool:
         """Cria sequência de equipamentos (template global)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            import json
-            equipment_order_json = json.dumps(equipment_order)
+                import json
+                equipment_order_json = json.dumps(equipment_order)
             
-            cursor.execute('''
-                INSERT INTO equipment_sequences (name, day_of_week, equipment_order) 
-                VALUES (?, ?, ?)
-            ''', (name, day_of_week, equipment_order_json))
+                cursor.execute('''
+                    INSERT INTO equipment_sequences (name, day_of_week, equipment_order) 
+                    VALUES (?, ?, ?)
+                ''', (name, day_of_week, equipment_order_json))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except:
             return False
     
+    @cached_read('equipment_sequences')
     def get_equipment_sequences(self, day_of_week: int = None) -> List[Dict]:
         """Retorna sequências de equipamentos (templates globais)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        if day_of_week:
-            cursor.execute('SELECT * FROM equipment_sequences WHERE day_of_week = ? ORDER BY name', (day_of_week,))
-        else:
-            cursor.execute('SELECT * FROM equipment_sequences ORDER BY day_of_week, name')
+            if day_of_week:
+                cursor.execute('SELECT * FROM equipment_sequences WHERE day_of_week = ? ORDER BY name', (day_of_week,))
+            else:
+                cursor.execute('SELECT * FROM equipment_sequences ORDER BY day_of_week, name')
         
-        sequences = cursor.fetchall()
-        conn.close()
+            sequences = cursor.fetchall()
         
-        import json
-        result = []
-        for seq in sequences:
-            equipment_order = json.loads(seq[3])
-            result.append({
-                'id': seq[0],
-                'name': seq[1],
-                'day_of_week': seq[2],
-                'equipment_order': equipment_order,
-                'created_at': seq[4]
-            })
+            import json
+            result = []
+            for seq in sequences:
+                equipment_order = json.loads(seq[3])
+                result.append({
+                    'id': seq[0],
+                    'name': seq[1],
+                    'day_of_week': seq[2],
+                    'equipment_order': equipment_order,
+                    'created_at': seq[4]
+                })
         
-        return result
+            return result
     
     def delete_equipment_sequence(self, sequence_id: int) -> bool:
         """Exclui sequência de equipamentos (template global)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('DELETE FROM equipment_sequences WHERE id = ?', (sequence_id,))
-            conn.commit()
-            conn.close()
-            return True
+                cursor.execute('DELETE FROM equipment_sequences WHERE id = ?', (sequence_id,))
+                return True
         except:
             return False
 
@@ -574,94 +827,88 @@ class Database:
     def create_client_sequence(self, client_id: int, name: str, day_of_week: int, equipment_order: List[int]) -> bool:
         """Cria sequência personalizada para cliente"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            import json
-            equipment_order_json = json.dumps(equipment_order)
+                import json
+                equipment_order_json = json.dumps(equipment_order)
             
-            cursor.execute('''
-                INSERT INTO client_sequences (client_id, name, day_of_week, equipment_order) 
-                VALUES (?, ?, ?, ?)
-            ''', (client_id, name, day_of_week, equipment_order_json))
+                cursor.execute('''
+                    INSERT INTO client_sequences (client_id, name, day_of_week, equipment_order) 
+                    VALUES (?, ?, ?, ?)
+                ''', (client_id, name, day_of_week, equipment_order_json))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except:
             return False
     
+    @cached_read('client_sequences')
     def get_client_sequences(self, client_id: int, day_of_week: int = None) -> List[Dict]:
         """Retorna sequências personalizadas do cliente"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        query = 'SELECT * FROM client_sequences WHERE client_id = ? AND is_active = 1'
-        params = [client_id]
+            query = 'SELECT * FROM client_sequences WHERE client_id = ? AND is_active = 1'
+            params = [client_id]
         
-        if day_of_week:
-            query += ' AND day_of_week = ?'
-            params.append(day_of_week)
+            if day_of_week:
+                query += ' AND day_of_week = ?'
+                params.append(day_of_week)
         
-        query += ' ORDER BY day_of_week, name'
+            query += ' ORDER BY day_of_week, name'
         
-        cursor.execute(query, params)
-        sequences = cursor.fetchall()
-        conn.close()
+            cursor.execute(query, params)
+            sequences = cursor.fetchall()
         
-        import json
-        result = []
-        for seq in sequences:
-            equipment_order = json.loads(seq[4])
-            # Verificar se current_position existe (compatibilidade com versões antigas)
-            current_position = seq[5] if len(seq) > 6 else 0
-            is_active = seq[6] if len(seq) > 7 else seq[5]
-            created_at = seq[7] if len(seq) > 8 else seq[6]
-            
-            result.append({
-                'id': seq[0],
-                'client_id': seq[1],
-                'name': seq[2],
-                'day_of_week': seq[3],
-                'equipment_order': equipment_order,
-                'current_position': current_position,
-                'is_active': is_active,
-                'created_at': created_at
-            })
+            import json
+            result = []
+            for seq in sequences:
+                equipment_order = json.loads(seq[4])
+                # Verificar se current_position existe (compatibilidade com versões antigas)
+                current_position = seq[5] if len(seq) > 6 else 0
+                is_active = seq[6] if len(seq) > 7 else seq[5]
+                created_at = seq[7] if len(seq) > 8 else seq[6]
+            
+                result.append({
+                    'id': seq[0],
+                    'client_id': seq[1],
+                    'name': seq[2],
+                    'day_of_week': seq[3],
+                    'equipment_order': equipment_order,
+                    'current_position': current_position,
+                    'is_active': is_active,
+                    'created_at': created_at
+                })
         
-        return result
+            return result
     
     def update_client_sequence(self, sequence_id: int, name: str, day_of_week: int, equipment_order: List[int]) -> bool:
         """Atualiza sequência personalizada do cliente"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            import json
-            equipment_order_json = json.dumps(equipment_order)
+                import json
+                equipment_order_json = json.dumps(equipment_order)
             
-            cursor.execute('''
-                UPDATE client_sequences 
-                SET name = ?, day_of_week = ?, equipment_order = ? 
-                WHERE id = ?
-            ''', (name, day_of_week, equipment_order_json, sequence_id))
+                cursor.execute('''
+                    UPDATE client_sequences 
+                    SET name = ?, day_of_week = ?, equipment_order = ? 
+                    WHERE id = ?
+                ''', (name, day_of_week, equipment_order_json, sequence_id))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except:
             return False
     
     def delete_client_sequence(self, sequence_id: int) -> bool:
         """Remove sequência personalizada do cliente (soft delete)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('UPDATE client_sequences SET is_active = 0 WHERE id = ?', (sequence_id,))
-            conn.commit()
-            conn.close()
-            return True
+                cursor.execute('UPDATE client_sequences SET is_active = 0 WHERE id = ?', (sequence_id,))
+                return True
         except:
             return False
     
@@ -689,49 +936,45 @@ class Database:
     def get_next_equipment_for_client(self, client_id: int, day_of_week: int) -> Dict:
         """Retorna o próximo equipamento na rotação para o cliente"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            # Buscar sequência do cliente para este dia
-            cursor.execute('''
-                SELECT id, equipment_order, current_position 
-                FROM client_sequences 
-                WHERE client_id = ? AND day_of_week = ? AND is_active = 1
-                LIMIT 1
-            ''', (client_id, day_of_week))
+                # Buscar sequência do cliente para este dia
+                cursor.execute('''
+                    SELECT id, equipment_order, current_position 
+                    FROM client_sequences 
+                    WHERE client_id = ? AND day_of_week = ? AND is_active = 1
+                    LIMIT 1
+                ''', (client_id, day_of_week))
             
-            sequence = cursor.fetchone()
+                sequence = cursor.fetchone()
             
-            if not sequence:
-                conn.close()
-                return {'equipment_id': None, 'equipment_name': 'Nenhuma sequência configurada'}
+                if not sequence:
+                    return {'equipment_id': None, 'equipment_name': 'Nenhuma sequência configurada'}
             
-            sequence_id, equipment_order_json, current_position = sequence
+                sequence_id, equipment_order_json, current_position = sequence
             
-            import json
-            equipment_order = json.loads(equipment_order_json)
+                import json
+                equipment_order = json.loads(equipment_order_json)
             
-            if not equipment_order:
-                conn.close()
-                return {'equipment_id': None, 'equipment_name': 'Sequência vazia'}
+                if not equipment_order:
+                    return {'equipment_id': None, 'equipment_name': 'Sequência vazia'}
             
-            # Obter equipamento atual na rotação
-            current_equipment_id = equipment_order[current_position % len(equipment_order)]
+                # Obter equipamento atual na rotação
+                current_equipment_id = equipment_order[current_position % len(equipment_order)]
             
-            # Buscar nome do equipamento
-            cursor.execute('SELECT name FROM equipment WHERE id = ?', (current_equipment_id,))
-            equipment_result = cursor.fetchone()
-            equipment_name = equipment_result[0] if equipment_result else 'Equipamento não encontrado'
+                # Buscar nome do equipamento
+                cursor.execute('SELECT name FROM equipment WHERE id = ?', (current_equipment_id,))
+                equipment_result = cursor.fetchone()
+                equipment_name = equipment_result[0] if equipment_result else 'Equipamento não encontrado'
             
-            conn.close()
-            
-            return {
-                'sequence_id': sequence_id,
-                'equipment_id': current_equipment_id,
-                'equipment_name': equipment_name,
-                'position': current_position,
-                'total_equipment': len(equipment_order)
-            }
+                return {
+                    'sequence_id': sequence_id,
+                    'equipment_id': current_equipment_id,
+                    'equipment_name': equipment_name,
+                    'position': current_position,
+                    'total_equipment': len(equipment_order)
+                }
             
         except Exception as e:
             return {'equipment_id': None, 'equipment_name': f'Erro: {str(e)}'}
@@ -739,45 +982,41 @@ class Database:
     def advance_equipment_rotation(self, client_id: int, day_of_week: int) -> bool:
         """Avança para o próximo equipamento na rotação"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            # Buscar sequência atual
-            cursor.execute('''
-                SELECT id, equipment_order, current_position 
-                FROM client_sequences 
-                WHERE client_id = ? AND day_of_week = ? AND is_active = 1
-                LIMIT 1
-            ''', (client_id, day_of_week))
+                # Buscar sequência atual
+                cursor.execute('''
+                    SELECT id, equipment_order, current_position 
+                    FROM client_sequences 
+                    WHERE client_id = ? AND day_of_week = ? AND is_active = 1
+                    LIMIT 1
+                ''', (client_id, day_of_week))
             
-            sequence = cursor.fetchone()
+                sequence = cursor.fetchone()
             
-            if not sequence:
-                conn.close()
-                return False
+                if not sequence:
+                    return False
             
-            sequence_id, equipment_order_json, current_position = sequence
+                sequence_id, equipment_order_json, current_position = sequence
             
-            import json
-            equipment_order = json.loads(equipment_order_json)
+                import json
+                equipment_order = json.loads(equipment_order_json)
             
-            if not equipment_order:
-                conn.close()
-                return False
+                if not equipment_order:
+                    return False
             
-            # Avançar posição (ciclo)
-            new_position = (current_position + 1) % len(equipment_order)
+                # Avançar posição (ciclo)
+                new_position = (current_position + 1) % len(equipment_order)
             
-            # Atualizar posição no banco
-            cursor.execute('''
-                UPDATE client_sequences 
-                SET current_position = ? 
-                WHERE id = ?
-            ''', (new_position, sequence_id))
+                # Atualizar posição no banco
+                cursor.execute('''
+                    UPDATE client_sequences 
+                    SET current_position = ? 
+                    WHERE id = ?
+                ''', (new_position, sequence_id))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
             
         except:
             return False
@@ -785,100 +1024,92 @@ class Database:
     def set_equipment_position(self, client_id: int, day_of_week: int, equipment_id: int) -> bool:
         """Define equipamento específico como atual e reinicia ciclo a partir dele"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            # Buscar sequência atual
-            cursor.execute('''
-                SELECT id, equipment_order 
-                FROM client_sequences 
-                WHERE client_id = ? AND day_of_week = ? AND is_active = 1
-                LIMIT 1
-            ''', (client_id, day_of_week))
+                # Buscar sequência atual
+                cursor.execute('''
+                    SELECT id, equipment_order 
+                    FROM client_sequences 
+                    WHERE client_id = ? AND day_of_week = ? AND is_active = 1
+                    LIMIT 1
+                ''', (client_id, day_of_week))
             
-            sequence = cursor.fetchone()
+                sequence = cursor.fetchone()
             
-            if not sequence:
-                conn.close()
-                return False
+                if not sequence:
+                    return False
             
-            sequence_id, equipment_order_json = sequence
+                sequence_id, equipment_order_json = sequence
             
-            import json
-            equipment_order = json.loads(equipment_order_json)
+                import json
+                equipment_order = json.loads(equipment_order_json)
             
-            # Encontrar posição do equipamento especificado
-            try:
-                new_position = equipment_order.index(equipment_id)
-            except ValueError:
-                # Equipamento não está na sequência
-                conn.close()
-                return False
+                # Encontrar posição do equipamento especificado
+                try:
+                    new_position = equipment_order.index(equipment_id)
+                except ValueError:
+                    # Equipamento não está na sequência
+                    return False
             
-            # Atualizar posição no banco
-            cursor.execute('''
-                UPDATE client_sequences 
-                SET current_position = ? 
-                WHERE id = ?
-            ''', (new_position, sequence_id))
+                # Atualizar posição no banco
+                cursor.execute('''
+                    UPDATE client_sequences 
+                    SET current_position = ? 
+                    WHERE id = ?
+                ''', (new_position, sequence_id))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
             
         except:
             return False
 
     # MÉTODOS DE HORÁRIOS FIXOS POR CLIENTE
     def create_client_schedule(self, client_id: int, day_of_week: int, time: str, schedule_type: str = "Fixo", sessions_count: int = 0) -> bool:
-        """Adiciona horário fixo para cliente com atribuição automática de equipamento"""
+        """Adiciona horário fixo para cliente com atribuição automática de equipamento (solve_equipment_assignment)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            # Verificar se já existe um horário para este cliente neste dia/hora (ativo ou inativo)
-            cursor.execute('''
-                SELECT id, is_active FROM client_schedule 
-                WHERE client_id = ? AND day_of_week = ? AND time = ?
-            ''', (client_id, day_of_week, time))
+                # Verificar se já existe um horário para este cliente neste dia/hora (ativo ou inativo)
+                cursor.execute('''
+                    SELECT id, is_active FROM client_schedule 
+                    WHERE client_id = ? AND day_of_week = ? AND time = ?
+                ''', (client_id, day_of_week, time))
             
-            existing = cursor.fetchone()
+                existing = cursor.fetchone()
             
-            if existing:
-                schedule_id, is_active = existing
-                if is_active == 1:
-                    # Já existe e está ativo - atualizar tipo e sessões
-                    cursor.execute('''
-                        UPDATE client_schedule 
-                        SET schedule_type = ?, sessions_count = ?
-                        WHERE id = ?
-                    ''', (schedule_type, sessions_count, schedule_id))
-                    conn.commit()
-                    conn.close()
-                    return True
-                else:
-                    # Existe mas está inativo - REATIVAR!
-                    cursor.execute('''
-                        UPDATE client_schedule 
-                        SET is_active = 1, schedule_type = ?, sessions_count = ?
-                        WHERE id = ?
-                    ''', (schedule_type, sessions_count, schedule_id))
-                    conn.commit()
-                    conn.close()
-                    return True
+                if existing:
+                    schedule_id, is_active = existing
+                    if is_active == 1:
+                        # Já existe e está ativo - atualizar tipo e sessões
+                        cursor.execute('''
+                            UPDATE client_schedule 
+                            SET schedule_type = ?, sessions_count = ?
+                            WHERE id = ?
+                        ''', (schedule_type, sessions_count, schedule_id))
+                        return True
+                    else:
+                        # Existe mas está inativo - REATIVAR!
+                        cursor.execute('''
+                            UPDATE client_schedule 
+                            SET is_active = 1, schedule_type = ?, sessions_count = ?
+                            WHERE id = ?
+                        ''', (schedule_type, sessions_count, schedule_id))
+                        # O equipamento antigo pode ter sido ocupado nesse meio tempo
+                        self.solve_equipment_assignment(day_of_week, time)
+                        return True
             
-            # Não existe - criar novo
-            # Atribuir equipamento automaticamente
-            equipment_id = self.assign_equipment_to_client(client_id, day_of_week, time)
+                # Não existe - criar novo
+                cursor.execute('''
+                    INSERT INTO client_schedule (client_id, day_of_week, time, is_active, schedule_type, sessions_count) 
+                    VALUES (?, ?, ?, 1, ?, ?)
+                ''', (client_id, day_of_week, time, schedule_type, sessions_count))
             
-            cursor.execute('''
-                INSERT INTO client_schedule (client_id, day_of_week, time, equipment_id, is_active, schedule_type, sessions_count) 
-                VALUES (?, ?, ?, ?, 1, ?, ?)
-            ''', (client_id, day_of_week, time, equipment_id, schedule_type, sessions_count))
+                # Atribuir equipamento automaticamente, sem conflito no horário
+                self.solve_equipment_assignment(day_of_week, time)
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except sqlite3.IntegrityError as e:
             # Horário já existe para este cliente
             print(f"IntegrityError ao criar horário: {e}")
@@ -887,170 +1118,228 @@ class Database:
             print(f"Erro ao criar horário: {e}")
             return False
     
+    @cached_read('client_schedule', 'equipment')
     def get_client_schedule(self, client_id: int) -> List[Dict]:
         """Retorna horários fixos do cliente com informação de equipamento"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT cs.*, e.name as equipment_name
-            FROM client_schedule cs
-            LEFT JOIN equipment e ON cs.equipment_id = e.id
-            WHERE cs.client_id = ? AND cs.is_active = 1 
-            ORDER BY cs.day_of_week, cs.time
-        ''', (client_id,))
-        
-        schedules = cursor.fetchall()
-        conn.close()
+            cursor.execute('''
+                SELECT cs.*, e.name as equipment_name
+                FROM client_schedule cs
+                LEFT JOIN equipment e ON cs.equipment_id = e.id
+                WHERE cs.client_id = ? AND cs.is_active = 1 
+                ORDER BY cs.day_of_week, cs.time
+            ''', (client_id,))
         
-        return [{
-            'id': sched[0],
-            'client_id': sched[1],
-            'day_of_week': sched[2],
-            'time': sched[3],
-            'is_active': sched[4],
-            'created_at': sched[5],
-            'equipment_id': sched[6],
-            'equipment_name': sched[7] if len(sched) > 7 else None
-        } for sched in schedules]
+            schedules = cursor.fetchall()
+        
+            return [{
+                'id': sched[0],
+                'client_id': sched[1],
+                'day_of_week': sched[2],
+                'time': sched[3],
+                'is_active': sched[4],
+                'created_at': sched[5],
+                'equipment_id': sched[6],
+                'equipment_name': sched[7] if len(sched) > 7 else None
+            } for sched in schedules]
     
     def update_client_schedule(self, client_id: int, schedules: List[Dict]) -> bool:
         """Atualiza todos os horários fixos do cliente"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            # Remover horários existentes (soft delete)
-            cursor.execute('UPDATE client_schedule SET is_active = 0 WHERE client_id = ?', (client_id,))
+                # Remover horários existentes (soft delete)
+                cursor.execute('UPDATE client_schedule SET is_active = 0 WHERE client_id = ?', (client_id,))
             
-            # Adicionar novos horários
-            for schedule in schedules:
-                cursor.execute('''
-                    INSERT INTO client_schedule (client_id, day_of_week, time) 
-                    VALUES (?, ?, ?)
-                ''', (client_id, schedule['day_of_week'], schedule['time']))
+                # Adicionar novos horários
+                for schedule in schedules:
+                    cursor.execute('''
+                        INSERT INTO client_schedule (client_id, day_of_week, time) 
+                        VALUES (?, ?, ?)
+                    ''', (client_id, schedule['day_of_week'], schedule['time']))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except:
             return False
     
     def delete_client_schedule(self, schedule_id: int) -> bool:
         """Remove horário fixo específico (soft delete)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('UPDATE client_schedule SET is_active = 0 WHERE id = ?', (schedule_id,))
+                cursor.execute('UPDATE client_schedule SET is_active = 0 WHERE id = ?', (schedule_id,))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except:
             return False
     
-    def assign_equipment_to_client(self, client_id: int, day_of_week: int, time: str) -> Optional[int]:
+    @staticmethod
+    def _match_slot_equipment(preferences: List[List[int]], seats: Dict[int, int]) -> List[Optional[int]]:
+        """
+        Distribui os clientes de um horário entre os equipamentos, cada um com
+        `seats[eq]` vagas: cada cliente, na ordem, fica com a primeira vaga livre
+        da sua ordem de preferência.
+        
+        Como todo cliente aceita qualquer equipamento, a escolha gulosa ocupa
+        todas as vagas existentes; só fica sem vaga quem excede o total do horário.
+        
+        Args:
+            preferences: Para cada cliente, equipamentos em ordem de preferência
+            seats: {equipment_id: capacidade no horário}
+        
+        Returns:
+            Equipamento de cada cliente (None = sem vaga)
         """
-        Atribui automaticamente um equipamento ao cliente baseado em rotação e conflito de horário.
-        - Rotação: equipamentos alternam entre os dias/horários do mesmo cliente, voltando ao 1º quando acabar a lista.
-        - Conflito: no mesmo dia/horário, clientes diferentes não podem usar o mesmo equipamento.
-        Retorna o ID do equipamento atribuído.
+        free = dict(seats)
+        assigned: List[Optional[int]] = []
+        for prefs in preferences:
+            eq = next((eq for eq in prefs if free.get(eq, 0) > 0), None)
+            if eq is not None:
+                free[eq] -= 1
+            assigned.append(eq)
+        return assigned
+    
+    def solve_equipment_assignment(self, day_of_week: int = None, time: str = None,
+                                   dry_run: bool = False) -> Dict:
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        Recalcula a atribuição de equipamentos de todos os horários fixos ativos,
+        sem conflito: no mesmo dia/horário nenhum equipamento recebe mais clientes
+        do que sua capacidade (slot_capacity).
         
-        try:
-            # Obter todos os equipamentos disponíveis
+        Preferências de cada horário do cliente: o equipamento atual (evita trocas
+        desnecessárias) e depois a ordem de equipamentos rotacionada pela posição
+        do horário entre os do cliente.
+        
+        Args:
+            day_of_week, time: Restringe a um único horário (opcional)
+            dry_run: Apenas calcula, sem gravar
+        
+        Returns:
+            {'changes_made', 'changes': [...], 'unassignable': [...]}
+        """
+        with self.connection(immediate=not dry_run) as conn:
+            cursor = conn.cursor()
+            
             cursor.execute('SELECT id FROM equipment ORDER BY id')
             all_equipment = [row[0] for row in cursor.fetchall()]
             
-            if not all_equipment:
-                conn.close()
-                return None
+            cursor.execute('''
+                SELECT id, client_id, day_of_week, time, equipment_id
+                FROM client_schedule
+                WHERE is_active = 1
+                ORDER BY id
+            ''')
+            schedules = cursor.fetchall()
+            
+            # Posição de cada horário entre os horários ativos do cliente (ordem de criação)
+            rotation_offset = {}
+            client_counts: Dict[int, int] = {}
+            for schedule_id, client_id, _, _, _ in schedules:
+                rotation_offset[schedule_id] = client_counts.get(client_id, 0)
+                client_counts[client_id] = rotation_offset[schedule_id] + 1
             
+            slots: Dict[tuple, list] = {}
+            for schedule in schedules:
+                if day_of_week is not None and schedule[2] != day_of_week:
+                    continue
+                if time is not None and schedule[3] != time:
+                    continue
+                slots.setdefault((schedule[2], schedule[3]), []).append(schedule)
+            
+            changes = []
+            unassignable = []
             total_equipment = len(all_equipment)
-
-            # Calcular offset de rotação baseado na quantidade de horários já configurados para o cliente
-            cursor.execute('''
-                SELECT COUNT(*) FROM client_schedule
-                WHERE client_id = ? AND is_active = 1
-            ''', (client_id,))
-            client_schedule_count = cursor.fetchone()[0]
-
-            rotation_offset = client_schedule_count % total_equipment if total_equipment > 0 else 0
-
-            # Gerar ordem de preferência rotacionada para este cliente
-            rotated_order = all_equipment[rotation_offset:] + all_equipment[:rotation_offset]
-
-            # Obter equipamentos já em uso nesse dia e horário por outros clientes
-            cursor.execute('''
-                SELECT DISTINCT cs.equipment_id
-                FROM client_schedule cs
-                WHERE cs.day_of_week = ? 
-                AND cs.time = ?
-                AND cs.client_id != ?
-                AND cs.is_active = 1
-                AND cs.equipment_id IS NOT NULL
-            ''', (day_of_week, time, client_id))
-            
-            used_equipment = [row[0] for row in cursor.fetchall()]
-            
-            # Escolher o primeiro equipamento da ordem rotacionada que não esteja em uso
-            selected_equipment = None
-            for eq in rotated_order:
-                if eq not in used_equipment:
-                    selected_equipment = eq
-                    break
-
-            # Se todos estão em uso neste slot, escolher o primeiro da ordem rotacionada
-            if selected_equipment is None:
-                selected_equipment = rotated_order[0]
+            capacity_map = self._get_capacity_map()
             
-            conn.close()
-            return selected_equipment
+            for (slot_day, slot_time), rows in sorted(slots.items()):
+                seats = {eq: self.get_equipment_capacity(slot_day, slot_time, eq, capacity_map)
+                         for eq in all_equipment}
+                
+                preferences = []
+                for schedule_id, _, _, _, current_eq in rows:
+                    offset = rotation_offset[schedule_id] % total_equipment if total_equipment else 0
+                    rotated_order = all_equipment[offset:] + all_equipment[:offset]
+                    if current_eq in seats:
+                        rotated_order.remove(current_eq)
+                        rotated_order.insert(0, current_eq)
+                    preferences.append(rotated_order)
+                
+                assigned = self._match_slot_equipment(preferences, seats)
+                
+                missing = [row[0] for row, eq in zip(rows, assigned) if eq is None]
+                if missing:
+                    unassignable.append({
+                        'day': slot_day,
+                        'time': slot_time,
+                        'clients': len(rows),
+                        'seats': sum(seats.values()),
+                        'schedule_ids': missing
+                    })
+                
+                # Sem vaga: o horário fica sem equipamento em vez de repetir um já usado
+                for (schedule_id, client_id, _, _, current_eq), new_eq in zip(rows, assigned):
+                    if new_eq != current_eq:
+                        changes.append({
+                            'schedule_id': schedule_id,
+                            'client_id': client_id,
+                            'day_of_week': slot_day,
+                            'time': slot_time,
+                            'old_equipment_id': current_eq,
+                            'new_equipment_id': new_eq
+                        })
+            
+            if not dry_run:
+                cursor.executemany(
+                    'UPDATE client_schedule SET equipment_id = ? WHERE id = ?',
+                    [(change['new_equipment_id'], change['schedule_id']) for change in changes]
+                )
             
-        except Exception as e:
-            print(f"Erro ao atribuir equipamento: {e}")
-            conn.close()
-            return None
+            return {
+                'changes_made': len(changes),
+                'changes': changes,
+                'unassignable': unassignable
+            }
     
+    @cached_read('client_schedule', 'users', 'equipment')
     def get_all_client_schedules(self) -> List[Dict]:
         """Retorna todos os horários fixos de todos os clientes com equipamentos"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT cs.*, u.name as client_name, u.phone as client_phone, e.name as equipment_name
-            FROM client_schedule cs
-            JOIN users u ON cs.client_id = u.id
-            LEFT JOIN equipment e ON cs.equipment_id = e.id
-            WHERE cs.is_active = 1
-            ORDER BY cs.day_of_week, cs.time, u.name
-        ''')
+            cursor.execute('''
+                SELECT cs.*, u.name as client_name, u.phone as client_phone, e.name as equipment_name
+                FROM client_schedule cs
+                JOIN users u ON cs.client_id = u.id
+                LEFT JOIN equipment e ON cs.equipment_id = e.id
+                WHERE cs.is_active = 1
+                ORDER BY cs.day_of_week, cs.time, u.name
+            ''')
         
-        schedules = cursor.fetchall()
-        conn.close()
+            schedules = cursor.fetchall()
         
-        # Estrutura: id(0), client_id(1), day_of_week(2), time(3), is_active(4), created_at(5),
-        # equipment_id(6), schedule_type(7), sessions_count(8), 
-        # JOINs: client_name(9), client_phone(10), equipment_name(11)
-        return [{
-            'id': sched[0],
-            'client_id': sched[1],
-            'day_of_week': sched[2],
-            'time': sched[3],
-            'is_active': sched[4],
-            'created_at': sched[5],
-            'equipment_id': sched[6] if len(sched) > 6 else None,
-            'schedule_type': sched[7] if len(sched) > 7 else 'Fixo',
-            'sessions_count': sched[8] if len(sched) > 8 else 0,
-            'client_name': sched[9] if len(sched) > 9 else None,
-            'client_phone': sched[10] if len(sched) > 10 else None,
-            'equipment_name': sched[11] if len(sched) > 11 else None
-        } for sched in schedules]
-    
-    def rotate_equipment_daily(self) -> Dict:
+            # Estrutura: id(0), client_id(1), day_of_week(2), time(3), is_active(4), created_at(5),
+            # equipment_id(6), schedule_type(7), sessions_count(8), 
+            # JOINs: client_name(9), client_phone(10), equipment_name(11)
+            return [{
+                'id': sched[0],
+                'client_id': sched[1],
+                'day_of_week': sched[2],
+                'time': sched[3],
+                'is_active': sched[4],
+                'created_at': sched[5],
+                'equipment_id': sched[6] if len(sched) > 6 else None,
+                'schedule_type': sched[7] if len(sched) > 7 else 'Fixo',
+                'sessions_count': sched[8] if len(sched) > 8 else 0,
+                'client_name': sched[9] if len(sched) > 9 else None,
+                'client_phone': sched[10] if len(sched) > 10 else None,
+                'equipment_name': sched[11] if len(sched) > 11 else None
+            } for sched in schedules]
+    
+    def rotate_equipment_daily(self, dry_run: bool = False) -> Dict:
         """
         Rotaciona equipamentos de um dia para outro, mantendo unicidade no mesmo horário.
         Para cada horário, os clientes trocam de equipamento em rotação circular.
@@ -1060,292 +1349,523 @@ class Database:
         Dia 2: A=Cadilak, B=Chase, C=Cavalo (rotação)
         Dia 3: A=Chase, B=Cavalo, C=Cadilak (rotação)
         
+        Um equipamento com capacidade maior que 1 no horário (slot_capacity)
+        recebe mais de um cliente. Horários com mais clientes do que vagas em
+        equipamentos ficam sem rotação e são listados em 'skipped_slots'.
+        
+        A rotação é calculada de uma vez sobre um retrato de client_schedule
+        (aritmética de índices com numpy) e gravada com um único executemany.
+        
+        Args:
+            dry_run: Apenas calcula e retorna as mudanças em 'changes', sem gravar
+        
         Retorna estatísticas da rotação.
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        import numpy as np
         
-        changes_made = 0
+        changes = []
+        skipped_slots = []
         
         try:
-            # Para cada dia da semana
-            for target_day in range(1, 6):  # 1=Segunda até 5=Sexta
-                # Buscar todos os horários distintos neste dia
+            with self.connection(immediate=not dry_run) as conn:
+                cursor = conn.cursor()
+        
+                cursor.execute('SELECT id FROM equipment ORDER BY id')
+                all_equipment = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+            
+                # Retrato de todos os horários de Segunda (1) a Sexta (5)
                 cursor.execute('''
-                    SELECT DISTINCT time
-                    FROM client_schedule
-                    WHERE day_of_week = ? AND is_active = 1
-                    ORDER BY time
-                ''', (target_day,))
+                    SELECT cs.id, cs.day_of_week, cs.time, cs.equipment_id, u.name
+                    FROM client_schedule cs
+                    JOIN users u ON cs.client_id = u.id
+                    WHERE cs.is_active = 1 AND cs.day_of_week BETWEEN 1 AND 5
+                    ORDER BY cs.day_of_week, cs.time, u.name, cs.id
+                ''')
+                rows = cursor.fetchall()
+            
+                total_equipment = len(all_equipment)
+                if rows and total_equipment:
+                    # Índice de cada linha dentro do seu horário (linhas do horário são contíguas)
+                    slot_keys = np.array([f"{row[1]}|{row[2]}" for row in rows])
+                    slot_names, first_row, slot_of_row, slot_sizes = np.unique(
+                        slot_keys, return_index=True, return_inverse=True, return_counts=True
+                    )
+                    position = np.arange(len(rows)) - first_row[slot_of_row]
                 
-                times = [row[0] for row in cursor.fetchall()]
+                    slot_day = np.array([rows[i][1] for i in first_row], dtype=np.int64)
+                    slot_time = [rows[i][2] for i in first_row]
                 
-                for time in times:
-                    # Buscar todos os clientes neste horário
-                    cursor.execute('''
-                        SELECT cs.id, cs.client_id, cs.equipment_id, u.name
-                        FROM client_schedule cs
-                        JOIN users u ON cs.client_id = u.id
-                        WHERE cs.day_of_week = ? AND cs.time = ? AND cs.is_active = 1
-                        ORDER BY u.name
-                    ''', (target_day, time))
-                    
-                    clients = cursor.fetchall()
-                    
-                    if len(clients) <= 1:
-                        continue  # Não há rotação para fazer se só tem 1 cliente
-                    
-                    # Obter equipamentos disponíveis
-                    cursor.execute('SELECT id FROM equipment ORDER BY id')
-                    all_equipment = [row[0] for row in cursor.fetchall()]
-                    
-                    if len(all_equipment) < len(clients):
-                        print(f"Aviso: Não há equipamentos suficientes para {len(clients)} clientes")
-                        continue
-                    
-                    # Calcular rotação baseada no dia da semana
                     # Cada dia avança uma posição na rotação
-                    rotation_offset = (target_day - 1) % len(all_equipment)
-                    
-                    # Criar lista rotacionada de equipamentos para este dia
-                    rotated_equipment = all_equipment[rotation_offset:] + all_equipment[:rotation_offset]
-                    
-                    # Atribuir equipamentos aos clientes mantendo unicidade
-                    for idx, (schedule_id, client_id, current_eq, client_name) in enumerate(clients):
-                        # Cada cliente recebe um equipamento diferente da lista rotacionada
-                        new_equipment_id = rotated_equipment[idx % len(rotated_equipment)]
-                        
+                    rotation_offset = (slot_day - 1) % total_equipment
+                    # rotated[s, j] = índice do j-ésimo equipamento da lista rotacionada do horário s
+                    rotated = (rotation_offset[:, None] + np.arange(total_equipment)) % total_equipment
+                
+                    # Vagas de cada equipamento no horário, na ordem rotacionada
+                    capacity_map = self._get_capacity_map()
+                    capacities = np.array([
+                        [self.get_equipment_capacity(int(day), time, int(eq), capacity_map)
+                         for eq in all_equipment]
+                        for day, time in zip(slot_day, slot_time)
+                    ], dtype=np.int64)
+                    seat_limits = np.cumsum(np.take_along_axis(capacities, rotated, axis=1), axis=1)
+                    total_seats = seat_limits[:, -1]
+                
+                    # Equipamento da vaga `position` na lista rotacionada do horário
+                    rotated_pos = (seat_limits[slot_of_row] <= position[:, None]).sum(axis=1)
+                    rotated_pos = np.minimum(rotated_pos, total_equipment - 1)
+                    new_equipment = all_equipment[rotated[slot_of_row, rotated_pos]]
+                
+                    # Não há rotação para fazer se só tem 1 cliente
+                    rotatable = slot_sizes > 1
+                    overbooked = rotatable & (slot_sizes > total_seats)
+                    for s in np.flatnonzero(overbooked):
+                        print(f"Aviso: Não há equipamentos suficientes para {slot_sizes[s]} clientes")
+                        skipped_slots.append({
+                            'day': int(slot_day[s]),
+                            'time': slot_time[s],
+                            'clients': int(slot_sizes[s]),
+                            'seats': int(total_seats[s])
+                        })
+                
+                    apply = (rotatable & ~overbooked)[slot_of_row]
+                    for i in np.flatnonzero(apply):
+                        schedule_id, day_of_week, time, current_eq, client_name = rows[i]
+                        new_equipment_id = int(new_equipment[i])
                         if new_equipment_id != current_eq:
-                            cursor.execute('''
-                                UPDATE client_schedule
-                                SET equipment_id = ?
-                                WHERE id = ?
-                            ''', (new_equipment_id, schedule_id))
-                            changes_made += 1
-            
-            conn.commit()
+                            changes.append({
+                                'schedule_id': schedule_id,
+                                'client_name': client_name,
+                                'day_of_week': day_of_week,
+                                'time': time,
+                                'old_equipment_id': current_eq,
+                                'new_equipment_id': new_equipment_id
+                            })
+            
+                if not dry_run:
+                    cursor.executemany(
+                        'UPDATE client_schedule SET equipment_id = ? WHERE id = ?',
+                        [(change['new_equipment_id'], change['schedule_id']) for change in changes]
+                    )
             
         except Exception as e:
+            # connection() já desfez as escritas deste método
             print(f"Erro na rotação de equipamentos: {e}")
-            conn.rollback()
-        finally:
-            conn.close()
+            return {
+                'changes_made': 0,
+                'changes': [],
+                'skipped_slots': skipped_slots,
+                'status': 'error'
+            }
         
         return {
-            'changes_made': changes_made,
-            'status': 'success' if changes_made >= 0 else 'error'
+            'changes_made': len(changes),
+            'changes': changes,
+            'skipped_slots': skipped_slots,
+            'status': 'success'
         }
     
     def check_and_fix_equipment_conflicts(self) -> Dict:
         """
         Verifica se há conflitos de equipamento (mesmo equipamento, mesmo dia/hora, clientes diferentes)
         e corrige automaticamente reatribuindo equipamentos.
+        
+        Os conflitos são detectados com ROW_NUMBER() por (dia, horário, equipamento):
+        as primeiras linhas até a capacidade do equipamento ficam, as demais são
+        reatribuídas contra um mapa de ocupação em memória, na mesma transação.
+        Sem equipamento livre no horário, a linha fica sem equipamento.
+        Rodar de novo sem mudanças no banco não encontra conflitos.
+        
         Retorna um dicionário com estatísticas dos conflitos encontrados e corrigidos.
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         conflicts_found = []
         conflicts_fixed = 0
+        unresolved = 0
         
         try:
-            # Buscar todos os horários ativos agrupados por dia/hora
-            cursor.execute('''
-                SELECT cs.day_of_week, cs.time, cs.equipment_id, 
-                       GROUP_CONCAT(cs.id || ':' || cs.client_id || ':' || u.name, '|') as clients
-                FROM client_schedule cs
-                JOIN users u ON cs.client_id = u.id
-                WHERE cs.is_active = 1 AND cs.equipment_id IS NOT NULL
-                GROUP BY cs.day_of_week, cs.time, cs.equipment_id
-                HAVING COUNT(*) > 1
-            ''')
+            with self.connection(immediate=True) as conn:
+                cursor = conn.cursor()
+        
+                cursor.execute('SELECT id FROM equipment ORDER BY id')
+                all_equipment = [row[0] for row in cursor.fetchall()]
+            
+                cursor.execute('''
+                    SELECT cs.id, cs.client_id, cs.day_of_week, cs.time, cs.equipment_id, u.name,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY cs.day_of_week, cs.time, cs.equipment_id
+                               ORDER BY cs.id
+                           ) AS position,
+                           COUNT(*) OVER (PARTITION BY cs.client_id) AS client_schedules
+                    FROM client_schedule cs
+                    JOIN users u ON cs.client_id = u.id
+                    WHERE cs.is_active = 1
+                    ORDER BY cs.day_of_week, cs.time, cs.equipment_id, position
+                ''')
+                rows = cursor.fetchall()
             
-            conflicts = cursor.fetchall()
-            
-            for day_of_week, time, equipment_id, clients_str in conflicts:
-                # Parsear clientes
-                clients_data = []
-                for client in clients_str.split('|'):
-                    parts = client.split(':')
-                    clients_data.append({
-                        'schedule_id': int(parts[0]),
-                        'client_id': int(parts[1]),
-                        'name': parts[2]
+                # Ocupação {(dia, horário): {equipamento: clientes}} das linhas que ficam
+                capacity_map = self._get_capacity_map()
+                occupancy: Dict[tuple, Dict[int, int]] = {}
+                conflicting = []
+                groups: Dict[tuple, Dict] = {}
+                for row in rows:
+                    schedule_id, client_id, day_of_week, time, equipment_id, name, position, _ = row
+                    if equipment_id is None:
+                        continue
+                    slot = occupancy.setdefault((day_of_week, time), {})
+                    group = groups.setdefault((day_of_week, time, equipment_id), {
+                        'day': day_of_week,
+                        'time': time,
+                        'equipment_id': equipment_id,
+                        'clients': []
                     })
+                    group['clients'].append(name)
+                    if position <= self.get_equipment_capacity(day_of_week, time, equipment_id, capacity_map):
+                        slot[equipment_id] = slot.get(equipment_id, 0) + 1
+                    else:
+                        conflicting.append(row)
+            
+                conflict_keys = dict.fromkeys((row[2], row[3], row[4]) for row in conflicting)
+                conflicts_found = [groups[key] for key in conflict_keys]
+            
+                updates = []
+                total_equipment = len(all_equipment)
+                for schedule_id, client_id, day_of_week, time, equipment_id, name, _, client_schedules in conflicting:
+                    # Mesma ordem de preferência de solve_equipment_assignment
+                    rotation_offset = client_schedules % total_equipment if total_equipment else 0
+                    rotated_order = all_equipment[rotation_offset:] + all_equipment[:rotation_offset]
                 
-                conflicts_found.append({
-                    'day': day_of_week,
-                    'time': time,
-                    'equipment_id': equipment_id,
-                    'clients': [c['name'] for c in clients_data]
-                })
+                    slot = occupancy[(day_of_week, time)]
+                    new_equipment_id = next((
+                        eq for eq in rotated_order
+                        if slot.get(eq, 0) < self.get_equipment_capacity(day_of_week, time, eq, capacity_map)
+                    ), None)
                 
-                # Corrigir: manter o primeiro, reatribuir os outros
-                for i, client_data in enumerate(clients_data):
-                    if i == 0:
-                        continue  # Manter o primeiro com equipamento atual
-                    
-                    # Reatribuir equipamento para os demais
-                    new_equipment_id = self.assign_equipment_to_client(
-                        client_data['client_id'], 
-                        day_of_week, 
-                        time
-                    )
-                    
-                    if new_equipment_id and new_equipment_id != equipment_id:
-                        cursor.execute('''
-                            UPDATE client_schedule 
-                            SET equipment_id = ? 
-                            WHERE id = ?
-                        ''', (new_equipment_id, client_data['schedule_id']))
+                    if new_equipment_id is None:
+                        unresolved += 1
+                    else:
+                        slot[new_equipment_id] = slot.get(new_equipment_id, 0) + 1
                         conflicts_fixed += 1
+                    updates.append((new_equipment_id, schedule_id))
             
-            conn.commit()
+                cursor.executemany(
+                    'UPDATE client_schedule SET equipment_id = ? WHERE id = ?', updates
+                )
             
         except Exception as e:
+            # connection() já desfez as escritas deste método: nada foi corrigido
             print(f"Erro ao verificar conflitos: {e}")
-        finally:
-            conn.close()
+            conflicts_fixed = 0
+            unresolved = 0
         
         return {
             'conflicts_found': len(conflicts_found),
             'conflicts_fixed': conflicts_fixed,
+            'unresolved': unresolved,
             'details': conflicts_found
         }
     
     def generate_weekly_appointments(self, start_date: str, end_date: str) -> bool:
         """Gera agendamentos automáticos baseados nos horários fixos dos clientes"""
         try:
-            from datetime import datetime, timedelta
+            from datetime import timedelta
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection(immediate=True) as conn:
+                cursor = conn.cursor()
             
-            # Buscar todos os horários fixos
-            schedules = self.get_all_client_schedules()
+                # Buscar todos os horários fixos
+                schedules = self.get_all_client_schedules()
             
-            start = datetime.strptime(start_date, '%Y-%m-%d')
-            end = datetime.strptime(end_date, '%Y-%m-%d')
+                # Primeira sequência ativa de cada (cliente, dia), como em get_client_sequences
+                cursor.execute('''
+                    SELECT id, client_id, day_of_week FROM client_sequences
+                    WHERE is_active = 1
+                    ORDER BY day_of_week, name
+                ''')
+                sequences = {}
+                for sequence_id, client_id, day_of_week in cursor.fetchall():
+                    sequences.setdefault((client_id, day_of_week), sequence_id)
             
-            current_date = start
-            while current_date <= end:
-                day_of_week = current_date.weekday() + 1  # 1=Segunda
-                
-                # Buscar horários fixos para este dia
-                day_schedules = [s for s in schedules if s['day_of_week'] == day_of_week]
-                
-                for schedule in day_schedules:
+                # Agendamentos e ocupação já existentes no período
+                cursor.execute('''
+                    SELECT client_id, date, time FROM appointments
+                    WHERE date BETWEEN ? AND ? AND status != 'cancelled'
+                ''', (start_date, end_date))
+                existing = set(cursor.fetchall())
+            
+                cursor.execute('''
+                    SELECT date, time, booked FROM slot_occupancy
+                    WHERE date BETWEEN ? AND ?
+                ''', (start_date, end_date))
+                booked = {(date, time): count for date, time, count in cursor.fetchall()}
+            
+                start = datetime.strptime(start_date, '%Y-%m-%d')
+                end = datetime.strptime(end_date, '%Y-%m-%d')
+            
+                capacity_map = self._get_capacity_map()
+                new_appointments = []
+                current_date = start
+                while current_date <= end:
+                    day_of_week = current_date.weekday() + 1  # 1=Segunda
                     date_str = current_date.strftime('%Y-%m-%d')
+                
+                    # Horários fixos para este dia
+                    for schedule in schedules:
+                        if schedule['day_of_week'] != day_of_week:
+                            continue
                     
-                    # Verificar se já existe agendamento
-                    cursor.execute('''
-                        SELECT COUNT(*) FROM appointments 
-                        WHERE client_id = ? AND date = ? AND time = ? AND status != 'cancelled'
-                    ''', (schedule['client_id'], date_str, schedule['time']))
+                        client_id, time = schedule['client_id'], schedule['time']
+                        if (client_id, date_str, time) in existing:
+                            continue
                     
-                    if cursor.fetchone()[0] == 0:
-                        # Buscar sequência personalizada do cliente para este dia
-                        client_sequences = self.get_client_sequences(schedule['client_id'], day_of_week)
-                        sequence_id = client_sequences[0]['id'] if client_sequences else None
-                        
-                        # Criar agendamento
-                        cursor.execute('''
-                            INSERT INTO appointments (client_id, date, time, day_of_week, client_sequence_id) 
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (schedule['client_id'], date_str, schedule['time'], day_of_week, sequence_id))
+                        # Não passar da capacidade do horário
+                        if booked.get((date_str, time), 0) >= self.get_slot_capacity(day_of_week, time, capacity_map):
+                            continue
+                    
+                        booked[(date_str, time)] = booked.get((date_str, time), 0) + 1
+                        existing.add((client_id, date_str, time))
+                        new_appointments.append((
+                            client_id, date_str, time, day_of_week,
+                            sequences.get((client_id, day_of_week))
+                        ))
                 
-                current_date += timedelta(days=1)
+                    current_date += timedelta(days=1)
             
-            conn.commit()
-            conn.close()
-            return True
-        except:
+                cursor.executemany('''
+                    INSERT INTO appointments (client_id, date, time, day_of_week, client_sequence_id) 
+                    VALUES (?, ?, ?, ?, ?)
+                ''', new_appointments)
+            
+                return True
+        except sqlite3.Error as e:
+            logger.error("Erro ao gerar agendamentos semanais: %s", e)
             return False
 
-    # MÉTODOS DE AGENDAMENTOS
-    def create_appointment(self, client_id: int, date: str, time: str, client_sequence_id: int = None, is_recurring: bool = False) -> bool:
-        """Cria novo agendamento"""
-        try:
-            conn = sqlite3.connect(self.db_path)
+    # MÉTODOS DE CAPACIDADE
+    def _get_capacity_map(self) -> Dict[tuple, int]:
+        """Retorna o mapa de capacidades, relendo slot_capacity só quando ela muda
+
+        A geração de slot_capacity (table_versions) muda a cada escrita, inclusive
+        de outro processo ou de outra instância de Database no mesmo arquivo.
+        """
+        generation = self.get_table_versions().get('slot_capacity')
+        cached = self._capacity_cache
+        if cached is not None and generation is not None and cached[0] == generation:
+            return cached[1]
+
+        with self.connection() as conn:
+            rows = conn.execute(
+                'SELECT day_of_week, time, equipment_id, capacity FROM slot_capacity'
+            ).fetchall()
+        capacity_map = {(dow, time, eq): capacity for dow, time, eq, capacity in rows}
+        self._capacity_cache = (generation, capacity_map)
+        return capacity_map
+
+    def _lookup_capacity(self, day_of_week: int, time: str, equipment_id: int, default: int,
+                         capacity_map: Dict[tuple, int] = None) -> int:
+        """Busca a regra mais específica: dia+horário, dia, horário e por fim geral"""
+        if capacity_map is None:
+            capacity_map = self._get_capacity_map()
+        for key in ((day_of_week, time, equipment_id), (day_of_week, '', equipment_id),
+                    (0, time, equipment_id), (0, '', equipment_id)):
+            if key in capacity_map:
+                return capacity_map[key]
+        return default
+
+    def get_slot_capacity(self, day_of_week: int, time: str, capacity_map: Dict[tuple, int] = None) -> int:
+        """Retorna quantos clientes cabem no horário (dia da semana 1=Segunda)
+
+        Em laços, resolva o mapa uma vez com _get_capacity_map() e passe-o em
+        `capacity_map`, evitando revalidar o cache a cada consulta.
+        """
+        return self._lookup_capacity(day_of_week, time, 0, self.DEFAULT_SLOT_CAPACITY, capacity_map)
+
+    def get_equipment_capacity(self, day_of_week: int, time: str, equipment_id: int,
+                               capacity_map: Dict[tuple, int] = None) -> int:
+        """Retorna quantos clientes podem usar o equipamento ao mesmo tempo no horário"""
+        return self._lookup_capacity(day_of_week, time, equipment_id, self.DEFAULT_EQUIPMENT_CAPACITY,
+                                     capacity_map)
+
+    def get_slot_capacities(self) -> List[Dict]:
+        """Lista as regras de capacidade cadastradas"""
+        with self.connection() as conn:
             cursor = conn.cursor()
-            
-            # Calcular dia da semana
-            from datetime import datetime
-            appointment_date = datetime.strptime(date, '%Y-%m-%d')
-            day_of_week = appointment_date.weekday() + 1  # Streamlit usa 1=Segunda
-            
-            # Verificar se o cliente já tem agendamento nesta data/hora
-            cursor.execute('''
-                SELECT COUNT(*) FROM appointments 
-                WHERE client_id = ? AND date = ? AND time = ? AND status != 'cancelled'
-            ''', (client_id, date, time))
-            client_has_appointment = cursor.fetchone()[0]
-            
-            if client_has_appointment > 0:
-                conn.close()
-                print(f"Cliente já tem reposição nesta data/hora")
-                return False
-            
-            # Verificar quantos clientes já estão agendados neste dia/hora
-            # 1. Contar agendamentos confirmados
-            cursor.execute('''
-                SELECT COUNT(*) FROM appointments 
-                WHERE date = ? AND time = ? AND status != 'cancelled'
-            ''', (date, time))
-            confirmed_appointments = cursor.fetchone()[0]
-            
-            # 2. Contar horários fixos (que não têm agendamento nesta data)
-            cursor.execute('''
-                SELECT COUNT(*) FROM client_schedule cs
-                WHERE cs.day_of_week = ? AND cs.time = ? AND cs.is_active = 1
-                AND cs.client_id NOT IN (
-                    SELECT client_id FROM appointments 
-                    WHERE date = ? AND time = ? AND status != 'cancelled'
-                )
-            ''', (day_of_week, time, date, time))
-            fixed_without_appointment = cursor.fetchone()[0]
-            
-            total_clients = confirmed_appointments + fixed_without_appointment
-            
-            # Verificar limite de 3 clientes
-            if total_clients >= 3:
-                conn.close()
-                print(f"Horário lotado: {total_clients} clientes já agendados")
-                return False  # Horário lotado (3 clientes)
-            
+
             cursor.execute('''
-                INSERT INTO appointments (client_id, date, time, day_of_week, client_sequence_id, is_recurring) 
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (client_id, date, time, day_of_week, client_sequence_id, 1 if is_recurring else 0))
-            
-            conn.commit()
-            conn.close()
+                SELECT sc.day_of_week, sc.time, sc.equipment_id, e.name, sc.capacity
+                FROM slot_capacity sc
+                LEFT JOIN equipment e ON sc.equipment_id = e.id
+                ORDER BY sc.day_of_week, sc.time, sc.equipment_id
+            ''')
+
+            return [{
+                'day_of_week': row[0] or None,
+                'time': row[1] or None,
+                'equipment_id': row[2] or None,
+                'equipment_name': row[3],
+                'capacity': row[4]
+            } for row in cursor.fetchall()]
+
+    def set_slot_capacity(self, capacity: int, day_of_week: int = None, time: str = None,
+                          equipment_id: int = None) -> bool:
+        """Cria ou atualiza uma regra de capacidade
+
+        Args:
+            capacity: Número máximo de clientes
+            day_of_week: Dia da semana (1=Segunda); None = todos os dias
+            time: Horário 'HH:MM'; None = todos os horários
+            equipment_id: Equipamento; None = capacidade do horário inteiro
+        """
+        try:
+            with self.connection() as conn:
+                conn.execute('''
+                    INSERT INTO slot_capacity (day_of_week, time, equipment_id, capacity)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (day_of_week, time, equipment_id)
+                    DO UPDATE SET capacity = excluded.capacity
+                ''', (day_of_week or 0, time or '', equipment_id or 0, capacity))
+            self._capacity_cache = None
             return True
         except Exception as e:
-            print(f"Erro ao criar agendamento: {e}")
+            print(f"Erro ao salvar capacidade: {e}")
             return False
 
-    def create_recurring_appointments(self, client_id: int, start_date: str, days_times: dict, client_sequence_id: int = None, weeks_ahead: int = 12) -> int:
-        """Cria agendamentos recorrentes para várias semanas
+    def delete_slot_capacity(self, day_of_week: int = None, time: str = None,
+                             equipment_id: int = None) -> bool:
+        """Remove uma regra de capacidade (volta a valer a regra mais geral)"""
+        try:
+            with self.connection() as conn:
+                conn.execute('''
+                    DELETE FROM slot_capacity
+                    WHERE day_of_week = ? AND time = ? AND equipment_id = ?
+                ''', (day_of_week or 0, time or '', equipment_id or 0))
+            self._capacity_cache = None
+            return True
+        except Exception as e:
+            print(f"Erro ao remover capacidade: {e}")
+            return False
+
+    # MÉTODOS DE AGENDAMENTOS
+    def create_appointment(self, client_id: int, date: str, time: str, client_sequence_id: int = None, is_recurring: bool = False) -> bool:
+        """Cria novo agendamento"""
+        report = self.create_appointments_bulk(
+            client_id, [(date, time)], client_sequence_id, is_recurring=is_recurring
+        )
+        if not report:
+            return False
+        if not report[0]['accepted']:
+            print(report[0]['reason'])
+            return False
+        return True
+
+    def _read_slot_occupancy(self, cursor: sqlite3.Cursor, client_id: int,
+                             requested: List[tuple]) -> Dict[tuple, tuple]:
+        """Lê a ocupação dos horários pedidos
         
         Args:
-            client_id: ID do cliente
-            start_date: Data de início (YYYY-MM-DD)
-            days_times: Dict {day_of_week: time} ex: {1: "09:00", 3: "14:00"}
-            client_sequence_id: ID da sequência do cliente
-            weeks_ahead: Quantas semanas à frente criar
+            requested: Lista de (date, time, day_of_week)
         
         Returns:
-            Número de agendamentos criados
+            {(date, time): (clientes ocupando o horário, cliente já agendado)}
         """
-        try:
-            from datetime import datetime, timedelta
-            
-            start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-            created_count = 0
-            
-            # Para cada semana até weeks_ahead
-            for week in range(weeks_ahead):
+        unique_pairs = list(dict.fromkeys(requested))
+        occupancy = {}
+        # Limita o número de parâmetros por consulta
+        for start in range(0, len(unique_pairs), 300):
+            chunk = unique_pairs[start:start + 300]
+            params = [value for pair in chunk for value in pair] + [client_id, client_id]
+            sql = self._SLOT_OCCUPANCY_SQL.format(values=', '.join(['(?, ?, ?)'] * len(chunk)))
+            cursor.execute(sql, params)
+            for date, time, confirmed, own, fixed in cursor.fetchall():
+                occupancy[(date, time)] = (confirmed + fixed, own)
+        return occupancy
+
+    def create_appointments_bulk(self, client_id: int, occurrences: List[tuple],
+                                 client_sequence_id: int = None,
+                                 is_recurring: bool = False) -> List[Dict]:
+        """Cria vários agendamentos de um cliente numa única transação
+
+        A ocupação de todos os (date, time) pedidos é lida numa só consulta
+        (contador slot_occupancy) e comparada com a capacidade de cada horário
+        (slot_capacity); os admissíveis são inseridos com executemany.
+
+        Args:
+            client_id: ID do cliente
+            occurrences: Lista de (date 'YYYY-MM-DD', time 'HH:MM')
+            client_sequence_id: ID da sequência do cliente
+            is_recurring: Marca os agendamentos como recorrentes
+
+        Returns:
+            Relatório por ocorrência, na ordem recebida:
+            [{'date', 'time', 'accepted': bool, 'reason': str ou None}]
+        """
+        if not occurrences:
+            return []
+
+        try:
+            # Dia da semana de cada ocorrência (Streamlit usa 1=Segunda)
+            requested = []
+            for date, time in occurrences:
+                day_of_week = datetime.strptime(date, '%Y-%m-%d').weekday() + 1
+                requested.append((date, time, day_of_week))
+
+            # BEGIN IMMEDIATE: a checagem de lotação e o INSERT ficam serializados
+            # entre sessões, impedindo que duas reservas passem do limite
+            with self.connection(immediate=True) as conn:
+                cursor = conn.cursor()
+
+                occupancy = self._read_slot_occupancy(cursor, client_id, requested)
+
+                capacity_map = self._get_capacity_map()
+                report = []
+                to_insert = []
+                booked = set()
+                for date, time, day_of_week in requested:
+                    total_clients, own = occupancy[(date, time)]
+                    if own or (date, time) in booked:
+                        reason = "Cliente já tem reposição nesta data/hora"
+                    elif total_clients >= self.get_slot_capacity(day_of_week, time, capacity_map):
+                        reason = f"Horário lotado: {total_clients} clientes já agendados"
+                    else:
+                        reason = None
+                        booked.add((date, time))
+                        to_insert.append((client_id, date, time, day_of_week,
+                                          client_sequence_id, 1 if is_recurring else 0))
+                    report.append({'date': date, 'time': time,
+                                   'accepted': reason is None, 'reason': reason})
+
+                cursor.executemany('''
+                    INSERT INTO appointments (client_id, date, time, day_of_week, client_sequence_id, is_recurring)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', to_insert)
+
+                return report
+        except Exception as e:
+            print(f"Erro ao criar agendamentos: {e}")
+            return []
+
+    def create_recurring_appointments(self, client_id: int, start_date: str, days_times: dict, client_sequence_id: int = None, weeks_ahead: int = 12) -> int:
+        """Cria agendamentos recorrentes para várias semanas
+        
+        Args:
+            client_id: ID do cliente
+            start_date: Data de início (YYYY-MM-DD)
+            days_times: Dict {day_of_week: time} ex: {1: "09:00", 3: "14:00"}
+            client_sequence_id: ID da sequência do cliente
+            weeks_ahead: Quantas semanas à frente criar
+        
+        Returns:
+            Número de agendamentos criados
+        """
+        try:
+            from datetime import timedelta
+            
+            start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
+            # Horário de Brasília sem tzinfo, comparável com as datas calculadas
+            now = get_brasilia_now().replace(tzinfo=None)
+            occurrences = []
+            
+            # Para cada semana até weeks_ahead
+            for week in range(weeks_ahead):
                 week_start = start_date_obj + timedelta(weeks=week)
                 
                 # Para cada dia da semana selecionado
@@ -1358,57 +1878,64 @@ class Database:
                     appointment_date = week_start + timedelta(days=days_to_add)
                     
                     # Pular se a data/hora já passou
-                    now = get_brasilia_now()
                     appointment_datetime = datetime.combine(appointment_date.date(), datetime.strptime(time, '%H:%M').time())
                     
                     if appointment_datetime <= now:
                         continue
                     
-                    # Criar agendamento se não existir
-                    if self.create_appointment(
-                        client_id, 
-                        appointment_date.strftime('%Y-%m-%d'), 
-                        time, 
-                        client_sequence_id, 
-                        is_recurring=True
-                    ):
-                        created_count += 1
-            
-            return created_count
+                    occurrences.append((appointment_date.strftime('%Y-%m-%d'), time))
+            
+            report = self.create_appointments_bulk(
+                client_id, occurrences, client_sequence_id, is_recurring=True
+            )
+            return sum(1 for item in report if item['accepted'])
         except Exception as e:
             print(f"Erro ao criar agendamentos recorrentes: {e}")
             return 0
     
-    def get_appointments(self, client_id: int = None, date_filter: str = None) -> List[Dict]:
-        """Retorna lista de agendamentos"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    @cached_read('appointments', 'users', 'client_sequences')
+    def get_appointments(self, client_id: int = None, date_filter: str = None,
+                         start_date: str = None, end_date: str = None,
+                         status: str = None, limit: int = None, after: tuple = None,
+                         include_cancelled: bool = True) -> List[Dict]:
+        """Retorna lista de agendamentos, com filtros e paginação aplicados no SQL
         
-        # Verificar se a coluna client_sequence_id existe
-        cursor.execute("PRAGMA table_info(appointments)")
-        columns = [col[1] for col in cursor.fetchall()]
+        Args:
+            client_id: ID do cliente
+            date_filter: Data exata (YYYY-MM-DD)
+            start_date: Data inicial do intervalo, inclusiva (YYYY-MM-DD)
+            end_date: Data final do intervalo, inclusiva (YYYY-MM-DD)
+            status: Retorna apenas agendamentos com este status
+            limit: Tamanho máximo da página
+            after: Chave (data, hora, id) do último agendamento da página anterior;
+                a próxima página começa logo depois dela. Continua valendo mesmo
+                que esse agendamento tenha sido removido ou remarcado
+            include_cancelled: False para ignorar agendamentos cancelados
         
-        if 'client_sequence_id' in columns:
-            # Nova estrutura com client_sequence_id
-            query = '''
-                SELECT a.*, u.name as client_name, u.phone as client_phone, 
-                       cs.name as sequence_name
-                FROM appointments a
-                JOIN users u ON a.client_id = u.id
-                LEFT JOIN client_sequences cs ON a.client_sequence_id = cs.id
-            '''
-        else:
-            # Estrutura antiga com equipment_sequence_id
-            query = '''
-                SELECT a.*, u.name as client_name, u.phone as client_phone, 
-                       es.name as sequence_name
-                FROM appointments a
-                JOIN users u ON a.client_id = u.id
-                LEFT JOIN equipment_sequences es ON a.equipment_sequence_id = es.id
-            '''
+        Returns:
+            Lista de agendamentos ordenada por data, hora e id
+        """
+        query, params = self._appointments_query(
+            client_id=client_id, date_filter=date_filter, start_date=start_date,
+            end_date=end_date, status=status, limit=limit, after=after,
+            include_cancelled=include_cancelled
+        )
+
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        columns = self.APPOINTMENT_COLUMNS
+        return [dict(zip(columns, row)) for row in rows]
+
+    def _appointments_query(self, client_id: int = None, date_filter: str = None,
+                            start_date: str = None, end_date: str = None,
+                            status: str = None, limit: int = None, after: tuple = None,
+                            include_cancelled: bool = True) -> tuple:
+        """Monta o SQL e os parâmetros de get_appointments (mesmos argumentos)"""
+        # Schema garantido pelas migrações: colunas explícitas, sem PRAGMA table_info
+        query = self._APPOINTMENTS_SQL
         
         params = []
-        
         conditions = []
         if client_id:
             conditions.append('a.client_id = ?')
@@ -1418,154 +1945,96 @@ class Database:
             conditions.append('a.date = ?')
             params.append(date_filter)
         
+        if start_date:
+            conditions.append('a.date >= ?')
+            params.append(start_date)
+        
+        if end_date:
+            conditions.append('a.date <= ?')
+            params.append(end_date)
+        
+        if status:
+            conditions.append('a.status = ?')
+            params.append(status)
+        
+        if not include_cancelled:
+            conditions.append("a.status != 'cancelled'")
+        
+        if after:
+            # Paginação por chave: continua após o último registro da página anterior
+            conditions.append('(a.date, a.time, a.id) > (?, ?, ?)')
+            params.extend(after)
+        
         if conditions:
             query += ' WHERE ' + ' AND '.join(conditions)
         
-        query += ' ORDER BY a.date, a.time'
+        query += ' ORDER BY a.date, a.time, a.id'
         
-        cursor.execute(query, params)
-        appointments = cursor.fetchall()
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
         
-        conn.close()
-        
-        # Adaptar retorno baseado na estrutura
-        # Verificar quais colunas existem
-        has_is_recurring = 'is_recurring' in columns
-        has_attended = 'attended' in columns
-        
-        if 'client_sequence_id' in columns:
-            if has_is_recurring and has_attended:
-                # Estrutura completa: id(0), client_id(1), date(2), time(3), day_of_week(4), 
-                # client_sequence_id(5), last_equipment_used(6), status(7), 
-                # delay_notification(8), absence_notification(9), created_at(10), 
-                # is_recurring(11), attended(12), [JOINs: client_name(13), client_phone(14), sequence_name(15)]
-                return [{
-                    'id': apt[0],
-                    'client_id': apt[1],
-                    'date': apt[2],
-                    'time': apt[3],
-                    'day_of_week': apt[4],
-                    'client_sequence_id': apt[5],
-                    'last_equipment_used': apt[6],
-                    'status': apt[7],
-                    'delay_notification': apt[8],
-                    'absence_notification': apt[9],
-                    'created_at': apt[10],
-                    'is_recurring': apt[11],
-                    'attended': apt[12],
-                    'client_name': apt[13] if len(apt) > 13 else None,
-                    'client_phone': apt[14] if len(apt) > 14 else None,
-                    'sequence_name': apt[15] if len(apt) > 15 else None
-                } for apt in appointments]
-            elif has_attended:
-                # Com attended mas sem is_recurring
-                return [{
-                    'id': apt[0],
-                    'client_id': apt[1],
-                    'date': apt[2],
-                    'time': apt[3],
-                    'day_of_week': apt[4],
-                    'client_sequence_id': apt[5],
-                    'last_equipment_used': apt[6],
-                    'status': apt[7],
-                    'delay_notification': apt[8],
-                    'absence_notification': apt[9],
-                    'created_at': apt[10],
-                    'attended': apt[11],
-                    'client_name': apt[12] if len(apt) > 12 else None,
-                    'client_phone': apt[13] if len(apt) > 13 else None,
-                    'sequence_name': apt[14] if len(apt) > 14 else None
-                } for apt in appointments]
-            else:
-                # Schema antigo sem attended
-                return [{
-                    'id': apt[0],
-                    'client_id': apt[1],
-                    'date': apt[2],
-                    'time': apt[3],
-                    'day_of_week': apt[4],
-                    'client_sequence_id': apt[5],
-                    'last_equipment_used': apt[6],
-                    'status': apt[7],
-                    'delay_notification': apt[8],
-                    'absence_notification': apt[9],
-                    'created_at': apt[10],
-                    'client_name': apt[11],
-                    'client_phone': apt[12],
-                    'sequence_name': apt[13] if len(apt) > 13 else None,
-                    'attended': None
-                } for apt in appointments]
-        else:
-            # Estrutura antiga com equipment_sequence_id
-            return [{
-                'id': apt[0],
-                'client_id': apt[1],
-                'date': apt[2],
-                'time': apt[3],
-                'day_of_week': apt[4],
-                'equipment_sequence_id': apt[5],
-                'client_sequence_id': apt[5],  # Usar o mesmo valor para compatibilidade
-                'last_equipment_used': apt[6],
-                'status': apt[7],
-                'delay_notification': apt[8],
-                'absence_notification': apt[9],
-                'created_at': apt[10],
-                'client_name': apt[11],
-                'client_phone': apt[12],
-                'sequence_name': apt[13],
-                'attended': apt[14] if len(apt) > 14 else None
-            } for apt in appointments]
+        return query, params
+
+    @cached_read('appointments', 'users')
+    def get_day_view_appointments(self, date: str) -> List[tuple]:
+        """Agendamentos do dia para a grade diária
+
+        Returns:
+            Tuplas (id, client_id, time, attended, equipamento, observacao, client_name)
+            ordenadas por horário
+        """
+        with self.connection() as conn:
+            return conn.execute(self._DAY_VIEW_SQL, (date,)).fetchall()
     
     def update_appointment_notifications(self, appointment_id: int, delay_notification: str = None, 
                                        absence_notification: str = None) -> bool:
         """Atualiza notificações do agendamento e cria registro de notificação"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            # Atualizar campos de notificação no appointment
-            cursor.execute('''
-                UPDATE appointments 
-                SET delay_notification = ?, absence_notification = ? 
-                WHERE id = ?
-            ''', (delay_notification, absence_notification, appointment_id))
+                # Atualizar campos de notificação no appointment
+                cursor.execute('''
+                    UPDATE appointments 
+                    SET delay_notification = ?, absence_notification = ? 
+                    WHERE id = ?
+                ''', (delay_notification, absence_notification, appointment_id))
             
-            # Buscar informações do appointment para criar notificação
-            cursor.execute('''
-                SELECT a.client_id, u.name, u.phone, a.date, a.time
-                FROM appointments a
-                JOIN users u ON a.client_id = u.id
-                WHERE a.id = ?
-            ''', (appointment_id,))
+                # Buscar informações do appointment para criar notificação
+                cursor.execute('''
+                    SELECT a.client_id, u.name, u.phone, a.date, a.time
+                    FROM appointments a
+                    JOIN users u ON a.client_id = u.id
+                    WHERE a.id = ?
+                ''', (appointment_id,))
             
-            apt_info = cursor.fetchone()
+                apt_info = cursor.fetchone()
             
-            if apt_info:
-                client_id, client_name, client_phone, apt_date, apt_time = apt_info
+                if apt_info:
+                    client_id, client_name, client_phone, apt_date, apt_time = apt_info
                 
-                # Criar mensagem de notificação
-                message = ""
-                notification_type = ""
+                    # Criar mensagem de notificação
+                    message = ""
+                    notification_type = ""
                 
-                if delay_notification:
-                    notification_type = "delay"
-                    message = f"Atraso notificado para {apt_date} às {apt_time}: {delay_notification}"
-                elif absence_notification:
-                    notification_type = "absence"
-                    message = f"Falta notificada para {apt_date} às {apt_time}: {absence_notification}"
+                    if delay_notification:
+                        notification_type = "delay"
+                        message = f"Atraso notificado para {apt_date} às {apt_time}: {delay_notification}"
+                    elif absence_notification:
+                        notification_type = "absence"
+                        message = f"Falta notificada para {apt_date} às {apt_time}: {absence_notification}"
                 
-                if message:
-                    # Inserir notificação na tabela notifications
-                    now = get_brasilia_now().strftime('%Y-%m-%d %H:%M:%S')
+                    if message:
+                        # Inserir notificação na tabela notifications
+                        now = get_brasilia_now().strftime('%Y-%m-%d %H:%M:%S')
                     
-                    cursor.execute('''
-                        INSERT INTO notifications (client_id, client_name, type, message, is_read, created_at)
-                        VALUES (?, ?, ?, ?, 0, ?)
-                    ''', (client_id, client_name, notification_type, message, now))
+                        cursor.execute('''
+                            INSERT INTO notifications (client_id, client_name, type, message, is_read, created_at)
+                            VALUES (?, ?, ?, ?, 0, ?)
+                        ''', (client_id, client_name, notification_type, message, now))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except Exception as e:
             print(f"Erro ao atualizar notificações: {e}")
             return False
@@ -1573,99 +2042,134 @@ class Database:
     def update_appointment_equipment(self, appointment_id: int, last_equipment_used: str) -> bool:
         """Atualiza último equipamento usado"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('''
-                UPDATE appointments 
-                SET last_equipment_used = ? 
-                WHERE id = ?
-            ''', (last_equipment_used, appointment_id))
+                cursor.execute('''
+                    UPDATE appointments 
+                    SET last_equipment_used = ? 
+                    WHERE id = ?
+                ''', (last_equipment_used, appointment_id))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except:
             return False
     
     def reschedule_appointment(self, appointment_id: int, new_date: str, new_time: str) -> bool:
         """Reagenda compromisso"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            # Verificar se novo horário está disponível
-            cursor.execute('''
-                SELECT COUNT(*) FROM appointments 
-                WHERE date = ? AND time = ? AND status != 'cancelled' AND id != ?
-            ''', (new_date, new_time, appointment_id))
+                # Verificar se novo horário está disponível
+                cursor.execute('''
+                    SELECT COUNT(*) FROM appointments 
+                    WHERE date = ? AND time = ? AND status != 'cancelled' AND id != ?
+                ''', (new_date, new_time, appointment_id))
             
-            if cursor.fetchone()[0] > 0:
-                conn.close()
-                return False  # Horário ocupado
+                if cursor.fetchone()[0] > 0:
+                    return False  # Horário ocupado
             
-            # Calcular novo dia da semana
-            from datetime import datetime
-            appointment_date = datetime.strptime(new_date, '%Y-%m-%d')
-            day_of_week = appointment_date.weekday() + 1
+                # Calcular novo dia da semana
+                from datetime import datetime
+                appointment_date = datetime.strptime(new_date, '%Y-%m-%d')
+                day_of_week = appointment_date.weekday() + 1
             
-            cursor.execute('''
-                UPDATE appointments 
-                SET date = ?, time = ?, day_of_week = ?, status = 'rescheduled' 
-                WHERE id = ?
-            ''', (new_date, new_time, day_of_week, appointment_id))
+                cursor.execute('''
+                    UPDATE appointments 
+                    SET date = ?, time = ?, day_of_week = ?, status = 'rescheduled' 
+                    WHERE id = ?
+                ''', (new_date, new_time, day_of_week, appointment_id))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except:
             return False
     
     def cancel_appointment(self, appointment_id: int) -> bool:
         """Cancela agendamento"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('UPDATE appointments SET status = "cancelled" WHERE id = ?', (appointment_id,))
+                cursor.execute('UPDATE appointments SET status = "cancelled" WHERE id = ?', (appointment_id,))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except:
             return False
     
+    @cached_read('appointments', 'users')
     def get_notifications(self) -> List[Dict]:
         """Retorna agendamentos com notificações"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT a.*, u.name as client_name, u.phone as client_phone 
-            FROM appointments a
-            JOIN users u ON a.client_id = u.id
-            WHERE (a.delay_notification IS NOT NULL AND a.delay_notification != '') 
-               OR (a.absence_notification IS NOT NULL AND a.absence_notification != '')
-            ORDER BY a.date DESC, a.time DESC
-        ''')
+            cursor.execute('''
+                SELECT a.*, u.name as client_name, u.phone as client_phone 
+                FROM appointments a
+                JOIN users u ON a.client_id = u.id
+                WHERE (a.delay_notification IS NOT NULL AND a.delay_notification != '') 
+                   OR (a.absence_notification IS NOT NULL AND a.absence_notification != '')
+                ORDER BY a.date DESC, a.time DESC
+            ''')
         
-        notifications = cursor.fetchall()
-        conn.close()
+            notifications = cursor.fetchall()
+        
+            return [{
+                'id': notif[0],
+                'client_id': notif[1],
+                'date': notif[2],
+                'time': notif[3],
+                'delay_notification': notif[8],
+                'absence_notification': notif[9],
+                'client_name': notif[11],
+                'client_phone': notif[12]
+            } for notif in notifications]
+    
+    def get_unread_notification_count(self) -> int:
+        """Quantidade de notificações não lidas (tabela notifications)
+        
+        Lida do contador notification_counter (mantido por triggers) e guardada
+        em cache no processo até o próximo commit no banco (PRAGMA data_version).
+        """
+        version = self._data_version()
+        cached = self._unread_cache
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        
+        try:
+            with self.connection() as conn:
+                row = conn.execute('SELECT unread FROM notification_counter WHERE id = 1').fetchone()
+        except Exception as e:
+            print(f"Erro ao contar notificações não lidas: {e}")
+            return 0
         
-        return [{
-            'id': notif[0],
-            'client_id': notif[1],
-            'date': notif[2],
-            'time': notif[3],
-            'delay_notification': notif[8],
-            'absence_notification': notif[9],
-            'client_name': notif[11],
-            'client_phone': notif[12]
-        } for notif in notifications]
-    
-    def get_schedule_data(self) -> pd.DataFrame:
+        unread = row[0] if row else 0
+        self._unread_cache = (version, unread)
+        return unread
+
+    @cached_read('notifications', 'users')
+    def get_unread_notifications(self, limit: int = 5) -> List[tuple]:
+        """Notificações não lidas mais recentes (popup do painel)
+
+        Returns:
+            Tuplas (id, client_id, client_name, type, message, is_read, created_at, phone)
+        """
+        with self.connection() as conn:
+            return conn.execute(self._UNREAD_NOTIFICATIONS_SQL, (limit,)).fetchall()
+    
+    def get_schedule_data(self) -> 'pd.DataFrame':
         """Retorna dados para visualização da grade de horários com horários fixos"""
-        appointments = self.get_appointments()
+        import pandas as pd
+        from datetime import timedelta
+        
+        # A grade não tem datas: mostra a semana atual (segunda a sexta)
+        today = get_brasilia_today()
+        week_start = today - timedelta(days=today.weekday())
+        appointments = self.get_appointments(
+            start_date=week_start.strftime('%Y-%m-%d'),
+            end_date=(week_start + timedelta(days=4)).strftime('%Y-%m-%d'),
+            include_cancelled=False
+        )
         client_schedules = self.get_all_client_schedules()
         
         # Criar DataFrame para visualização
@@ -1699,11 +2203,20 @@ class Database:
         
         return pd.DataFrame(schedule_data)
     
-    def get_week_schedule_data(self, start_date: str) -> pd.DataFrame:
+    def get_week_schedule_data(self, start_date: str) -> 'pd.DataFrame':
         """Retorna dados da grade de horários para uma semana específica"""
+        import pandas as pd
         from datetime import datetime, timedelta
         
-        appointments = self.get_appointments()
+        # Converter start_date para objeto datetime
+        start = datetime.strptime(start_date, '%Y-%m-%d')
+        
+        # Apenas os agendamentos da semana exibida (segunda a sexta)
+        appointments = self.get_appointments(
+            start_date=start_date,
+            end_date=(start + timedelta(days=4)).strftime('%Y-%m-%d'),
+            include_cancelled=False
+        )
         client_schedules = self.get_all_client_schedules()
         
         # Normalizar hora para formato HH:MM
@@ -1713,8 +2226,19 @@ class Database:
             except Exception:
                 return t
         
-        # Converter start_date para objeto datetime
-        start = datetime.strptime(start_date, '%Y-%m-%d')
+        # Indexar numa única passada: agendamentos por (data, HH:MM), horários fixos
+        # por (dia da semana, HH:MM) e o horário fixo de cada cliente
+        appointments_by_slot: Dict[tuple, List[Dict]] = {}
+        for apt in appointments:
+            if apt['status'] != 'cancelled':
+                appointments_by_slot.setdefault((apt['date'], norm_time(apt['time'])), []).append(apt)
+        
+        fixed_by_slot: Dict[tuple, List[Dict]] = {}
+        schedule_by_client: Dict[tuple, Dict] = {}
+        for sched in client_schedules:
+            sched_time = norm_time(sched['time'])
+            fixed_by_slot.setdefault((sched['day_of_week'], sched_time), []).append(sched)
+            schedule_by_client.setdefault((sched['day_of_week'], sched_time, sched['client_id']), sched)
         
         # Criar DataFrame para visualização da semana
         schedule_data = []
@@ -1722,41 +2246,31 @@ class Database:
         # Horários de 6h às 20h
         hours = [f"{h:02d}:00" for h in range(6, 21)]
         
+        # Colunas da semana (Segunda a Sexta)
+        days = []
+        for i, day_name in enumerate(['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta']):
+            current_date = start + timedelta(days=i)
+            days.append((
+                current_date.strftime('%Y-%m-%d'),
+                current_date.weekday() + 1,  # 1 = Segunda, 2 = Terça, ..., 5 = Sexta
+                f"{day_name} {current_date.strftime('%d/%m')}"  # Coluna com dia e data
+            ))
+        
         for hour in hours:
             row = {'Horário': hour}
             
-            # Para cada dia da semana (Segunda a Sexta)
-            for i in range(5):  # 0 = Segunda, 1 = Terça, etc.
-                current_date = start + timedelta(days=i)
-                date_str = current_date.strftime('%Y-%m-%d')
-                day_of_week = current_date.weekday() + 1  # 1 = Segunda, 2 = Terça, ..., 5 = Sexta
-                day_name = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta'][i]
-                # Criar coluna com dia e data
-                column_name = f"{day_name} {current_date.strftime('%d/%m')}"
-                
-                # Procurar TODOS os agendamentos confirmados para este dia/hora/data
-                day_appointments = [apt for apt in appointments 
-                                  if norm_time(apt['time']) == norm_time(hour) 
-                                  and apt['date'] == date_str 
-                                  and apt['status'] != 'cancelled']
+            for date_str, day_of_week, column_name in days:
+                day_appointments = appointments_by_slot.get((date_str, hour), [])
                 
                 # Coletar IDs dos clientes que já têm appointment
                 clients_with_appointments = {apt['client_id'] for apt in day_appointments}
                 
-                # Procurar horários fixos para este dia/hora (incluindo os que têm appointment)
-                fixed_schedules = [sched for sched in client_schedules 
-                                 if norm_time(sched['time']) == norm_time(hour) 
-                                 and sched['day_of_week'] == day_of_week]
-                
                 # Montar lista de clientes para exibir
                 client_list = []
                 
                 # Adicionar clientes com appointments
                 for apt in day_appointments:
-                    client_sched = next((s for s in client_schedules 
-                                       if s['client_id'] == apt['client_id'] 
-                                       and s['day_of_week'] == day_of_week
-                                       and norm_time(s['time']) == norm_time(hour)), None)
+                    client_sched = schedule_by_client.get((day_of_week, hour, apt['client_id']))
                     
                     if client_sched and client_sched.get('equipment_name'):
                         client_list.append(f"✅ {apt['client_name']} 🏋️{client_sched['equipment_name']}")
@@ -1764,19 +2278,15 @@ class Database:
                         client_list.append(f"✅ {apt['client_name']}")
                 
                 # Adicionar clientes com horário fixo mas SEM appointment ainda
-                for sched in fixed_schedules:
+                for sched in fixed_by_slot.get((day_of_week, hour), []):
                     if sched['client_id'] not in clients_with_appointments:
                         if sched.get('equipment_name'):
                             client_list.append(f"📅 {sched['client_name']} 🏋️{sched['equipment_name']}")
                         else:
                             client_list.append(f"📅 {sched['client_name']}")
                 
-                # Se tem algum cliente (com ou sem appointment), mostrar
-                if client_list:
-                    # Usar <br> para quebra de linha HTML (funciona melhor no Streamlit)
-                    row[column_name] = "<br>".join(client_list)
-                else:
-                    row[column_name] = ""
+                # Usar <br> para quebra de linha HTML (funciona melhor no Streamlit)
+                row[column_name] = "<br>".join(client_list)
             
             schedule_data.append(row)
         
@@ -1786,11 +2296,20 @@ class Database:
         """Retorna semanas que contêm agendamentos no período"""
         from datetime import datetime, timedelta
         
-        appointments = self.get_appointments()
-        
         start = datetime.strptime(start_date, '%Y-%m-%d')
         end = datetime.strptime(end_date, '%Y-%m-%d')
         
+        # Apenas agendamentos entre a segunda da primeira semana e a sexta da última
+        first_week_start = start - timedelta(days=start.weekday())
+        last_week_start = first_week_start + timedelta(days=7 * ((end - start).days // 7))
+        
+        # Contagem por semana (segunda-feira da data), só de segunda a sexta
+        with self.connection() as conn:
+            counts = dict(conn.execute(
+                self._WEEKLY_COUNTS_SQL,
+                (first_week_start.strftime('%Y-%m-%d'), (last_week_start + timedelta(days=4)).strftime('%Y-%m-%d'))
+            ).fetchall())
+        
         # Encontrar todas as semanas no período
         weeks = []
         current = start
@@ -1800,49 +2319,44 @@ class Database:
             week_start = current - timedelta(days=current.weekday())
             week_end = week_start + timedelta(days=4)  # Sexta-feira
             
-            # Verificar se há agendamentos nesta semana
-            week_appointments = [apt for apt in appointments 
-                               if week_start.strftime('%Y-%m-%d') <= apt['date'] <= week_end.strftime('%Y-%m-%d')
-                               and apt['status'] != 'cancelled']
+            appointments_count = counts.get(week_start.strftime('%Y-%m-%d'), 0)
             
             weeks.append({
                 'start_date': week_start.strftime('%Y-%m-%d'),
                 'end_date': week_end.strftime('%Y-%m-%d'),
                 'week_label': f"{week_start.strftime('%d/%m')} - {week_end.strftime('%d/%m')}",
-                'appointments_count': len(week_appointments),
-                'has_appointments': len(week_appointments) > 0
+                'appointments_count': appointments_count,
+                'has_appointments': appointments_count > 0
             })
             
             current += timedelta(days=7)
         
         return weeks
     
+    @cached_read('appointments', 'users', 'client_schedule', 'equipment')
     def get_week_schedule_data_with_details(self, start_date: str) -> List[Dict]:
-        """Retorna dados detalhados da grade de horários com appointments por data"""
-        from datetime import datetime, timedelta
+        """Retorna dados detalhados da grade de horários com appointments por data
         
-        # Buscar apenas appointments (sistema novo baseado em datas)
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        Uma única consulta traz os appointments da semana com o equipamento e o
+        tipo do horário fixo do cliente; a grade é montada numa passada.
+        
+        Returns:
+            [{'time': 'HH:MM', 'days': [{'date', 'day_of_week', 'day_name',
+              'clients': [{'client_id', 'client_name', 'appointment_id', 'date',
+                           'time', 'status', 'attended', 'has_appointment',
+                           'equipment_id', 'equipment_name', 'schedule_type'}]}]}]
+            com uma entrada por hora (6h às 20h) e um dia por coluna (Segunda a Sexta)
+        """
+        from datetime import datetime, timedelta
         
         # Calcular range de datas (segunda a sexta da semana)
         start = datetime.strptime(start_date, '%Y-%m-%d')
         end = start + timedelta(days=4)  # Segunda a Sexta
         
-        # Buscar appointments da semana
-        cursor.execute('''
-            SELECT a.id, a.client_id, a.date, a.time, a.day_of_week, 
-                   a.status, a.attended, u.name as client_name
-            FROM appointments a
-            JOIN users u ON a.client_id = u.id
-            WHERE a.date >= ? AND a.date <= ?
-            AND a.status != 'cancelled'
-            AND a.attended IS NULL
-            ORDER BY a.date, a.time
-        ''', (start_date, end.strftime('%Y-%m-%d')))
-        
-        appointments = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            appointments = conn.execute(
+                self._WEEK_DETAILS_SQL, (start_date, end.strftime('%Y-%m-%d'))
+            ).fetchall()
         
         # Normalizar hora para formato HH:MM
         def norm_time(t: str) -> str:
@@ -1853,51 +2367,50 @@ class Database:
         
         # Horários de 6h às 20h
         hours = [f"{h:02d}:00" for h in range(6, 21)]
+        days = []
+        for i, day_name in enumerate(['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta']):
+            current_date = start + timedelta(days=i)
+            days.append((current_date.strftime('%Y-%m-%d'), current_date.weekday() + 1, day_name))
         
+        # Grade vazia com um índice (data, HH:MM) -> lista de clientes da célula
         schedule_details = []
-        
+        cells: Dict[tuple, List[Dict]] = {}
         for hour in hours:
             hour_data = {
                 'time': hour,
                 'days': []
             }
-            
-            # Para cada dia da semana (Segunda a Sexta)
-            for i in range(5):  # 0 = Segunda, 1 = Terça, etc.
-                current_date = start + timedelta(days=i)
-                date_str = current_date.strftime('%Y-%m-%d')
-                day_of_week = current_date.weekday() + 1  # 1 = Segunda, ..., 5 = Sexta
-                day_name = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta'][i]
-                
+            for date_str, day_of_week, day_name in days:
                 day_data = {
                     'date': date_str,
                     'day_of_week': day_of_week,
                     'day_name': day_name,
                     'clients': []
                 }
-                
-                # Procurar appointments para este dia/hora específicos
-                for apt in appointments:
-                    apt_date = apt[2]
-                    apt_time = norm_time(apt[3])
-                    
-                    if apt_date == date_str and apt_time == norm_time(hour):
-                        # Appointment encontrado para esta data/hora
-                        client_info = {
-                            'client_id': apt[1],
-                            'client_name': apt[7],
-                            'appointment_id': apt[0],
-                            'status': apt[5],
-                            'attended': apt[6],
-                            'has_appointment': True,
-                            'equipment_name': None  # Pode adicionar lógica de equipamento depois se necessário
-                        }
-                        day_data['clients'].append(client_info)
-                
+                cells[(date_str, hour)] = day_data['clients']
                 hour_data['days'].append(day_data)
-            
             schedule_details.append(hour_data)
         
+        # Distribuir os appointments nas células numa única passada
+        for (appointment_id, client_id, apt_date, apt_time, status, attended,
+             client_name, equipment_id, equipment_name, schedule_type) in appointments:
+            cell = cells.get((apt_date, norm_time(apt_time)))
+            if cell is None:
+                continue  # Fora da grade (ex.: 08:30)
+            cell.append({
+                'client_id': client_id,
+                'client_name': client_name,
+                'appointment_id': appointment_id,
+                'date': apt_date,
+                'time': apt_time,
+                'status': status,
+                'attended': attended,
+                'has_appointment': True,
+                'equipment_id': equipment_id,
+                'equipment_name': equipment_name,
+                'schedule_type': schedule_type or 'Fixo'
+            })
+        
         return schedule_details
     
     def mark_attendance(self, appointment_id: int, attended: bool = None) -> bool:
@@ -1911,27 +2424,69 @@ class Database:
             True se marcado com sucesso
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            if attended is None:
-                value = None
-            else:
-                value = 1 if attended else 0
+                if attended is None:
+                    value = None
+                else:
+                    value = 1 if attended else 0
             
-            cursor.execute('''
-                UPDATE appointments 
-                SET attended = ? 
-                WHERE id = ?
-            ''', (value, appointment_id))
+                cursor.execute('''
+                    UPDATE appointments 
+                    SET attended = ? 
+                    WHERE id = ?
+                ''', (value, appointment_id))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except Exception as e:
             print(f"Erro ao marcar presença: {e}")
             return False
     
+    def get_attendance_summary(self, start: str, end: str, client_id: int = None) -> Dict:
+        """Conta presenças, faltas e agendamentos não marcados no período
+        
+        Uma única consulta agrupada por dia; os totais do período são a soma dos dias.
+        
+        Args:
+            start: Data inicial, inclusiva (YYYY-MM-DD)
+            end: Data final, inclusiva (YYYY-MM-DD)
+            client_id: Limita a um cliente
+        
+        Returns:
+            {'by_date': {date: {'present': int, 'absent': int, 'unmarked': int}},
+             'present': int, 'absent': int, 'unmarked': int}
+        """
+        try:
+            return self._read_attendance_summary(start, end, client_id)
+        except Exception as e:
+            print(f"Erro ao buscar resumo de presenças: {e}")
+            return {'by_date': {}, 'present': 0, 'absent': 0, 'unmarked': 0}
+    
+    @cached_read('appointments', 'users')
+    def _read_attendance_summary(self, start: str, end: str, client_id: int = None) -> Dict:
+        """Leitura de get_attendance_summary, em cache (erros sobem para quem chama)"""
+        summary = {'by_date': {}, 'present': 0, 'absent': 0, 'unmarked': 0}
+        
+        params = [start, end]
+        client_filter = ''
+        if client_id:
+            client_filter = ' AND a.client_id = ?'
+            params.append(client_id)
+        
+        with self.connection() as conn:
+            rows = conn.execute(
+                self._ATTENDANCE_SUMMARY_SQL.format(client_filter=client_filter), params
+            ).fetchall()
+        
+        for date_str, present, absent, unmarked in rows:
+            summary['by_date'][date_str] = {'present': present, 'absent': absent, 'unmarked': unmarked}
+            summary['present'] += present
+            summary['absent'] += absent
+            summary['unmarked'] += unmarked
+        
+        return summary
+    
     def get_appointment_by_details(self, client_id: int, date: str, time: str) -> Optional[Dict]:
         """Busca um agendamento específico por detalhes
         
@@ -1944,30 +2499,29 @@ class Database:
             Dict com dados do agendamento ou None
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, client_id, date, time, attended, status
-                FROM appointments
-                WHERE client_id = ? AND date = ? AND time = ?
-                ORDER BY id DESC
-                LIMIT 1
-            ''', (client_id, date, time))
-            
-            row = cursor.fetchone()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            if row:
-                return {
-                    'id': row[0],
-                    'client_id': row[1],
-                    'date': row[2],
-                    'time': row[3],
-                    'attended': row[4],
-                    'status': row[5]
-                }
-            return None
+                cursor.execute('''
+                    SELECT id, client_id, date, time, attended, status
+                    FROM appointments
+                    WHERE client_id = ? AND date = ? AND time = ?
+                    ORDER BY id DESC
+                    LIMIT 1
+                ''', (client_id, date, time))
+            
+                row = cursor.fetchone()
+            
+                if row:
+                    return {
+                        'id': row[0],
+                        'client_id': row[1],
+                        'date': row[2],
+                        'time': row[3],
+                        'attended': row[4],
+                        'status': row[5]
+                    }
+                return None
         except Exception as e:
             print(f"Erro ao buscar agendamento: {e}")
             return None
@@ -1978,18 +2532,16 @@ class Database:
                             quantidade: int, data_vencimento: str, observacoes: str = "") -> bool:
         """Cria uma conta a receber para um cliente"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('''
-                INSERT INTO contas_receber (client_id, tipo_plano, valor, quantidade, 
-                                           data_vencimento, observacoes)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (client_id, tipo_plano, valor, quantidade, data_vencimento, observacoes))
+                cursor.execute('''
+                    INSERT INTO contas_receber (client_id, tipo_plano, valor, quantidade, 
+                                               data_vencimento, observacoes)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (client_id, tipo_plano, valor, quantidade, data_vencimento, observacoes))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except Exception as e:
             print(f"Erro ao criar conta a receber: {e}")
             return False
@@ -1997,9 +2549,17 @@ class Database:
     def get_contas_receber(self, client_id: int = None) -> List[Dict]:
         """Busca contas a receber, opcionalmente filtradas por cliente"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            return self._read_contas_receber(client_id)
+        except Exception as e:
+            print(f"Erro ao buscar contas a receber: {e}")
+            return []
+    
+    @cached_read('contas_receber', 'users')
+    def _read_contas_receber(self, client_id: int = None) -> List[Dict]:
+        """Leitura de get_contas_receber, em cache (erros sobem para quem chama)"""
+        with self.connection() as conn:
             cursor = conn.cursor()
-            
+        
             if client_id:
                 cursor.execute('''
                     SELECT cr.*, u.name as client_name
@@ -2015,10 +2575,9 @@ class Database:
                     JOIN users u ON cr.client_id = u.id
                     ORDER BY cr.data_vencimento
                 ''')
-            
+        
             rows = cursor.fetchall()
-            conn.close()
-            
+        
             contas = []
             for row in rows:
                 contas.append({
@@ -2035,25 +2594,20 @@ class Database:
                     'client_name': row[10]
                 })
             return contas
-        except Exception as e:
-            print(f"Erro ao buscar contas a receber: {e}")
-            return []
     
     def update_pagamento_receber(self, conta_id: int, data_pagamento: str) -> bool:
         """Marca uma conta a receber como paga"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('''
-                UPDATE contas_receber 
-                SET data_pagamento = ?, status = 'pago'
-                WHERE id = ?
-            ''', (data_pagamento, conta_id))
+                cursor.execute('''
+                    UPDATE contas_receber 
+                    SET data_pagamento = ?, status = 'pago'
+                    WHERE id = ?
+                ''', (data_pagamento, conta_id))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except Exception as e:
             print(f"Erro ao atualizar pagamento: {e}")
             return False
@@ -2061,12 +2615,10 @@ class Database:
     def delete_conta_receber(self, conta_id: int) -> bool:
         """Exclui uma conta a receber"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM contas_receber WHERE id = ?', (conta_id,))
-            conn.commit()
-            conn.close()
-            return True
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM contas_receber WHERE id = ?', (conta_id,))
+                return True
         except Exception as e:
             print(f"Erro ao excluir conta a receber: {e}")
             return False
@@ -2074,51 +2626,56 @@ class Database:
     def create_conta_pagar(self, data_debito: str, tipo_debito: str, valor_total: float,
                           quantidade: int, tipo_parcelamento: str, observacoes: str = "", 
                           recorrente: bool = False) -> bool:
-        """Cria uma conta a pagar e suas parcelas"""
+        """Cria uma conta a pagar e suas parcelas
+        
+        Conta recorrente é gravada só como regra (data_debito, mensal, valor_total):
+        as ocorrências são geradas sob demanda por _iter_parcelas_recorrentes e só
+        viram linha em parcelas_pagar quando pagas, editadas ou excluídas.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            # Se for recorrente, ajustar quantidade para até dezembro
-            from datetime import datetime
-            from dateutil.relativedelta import relativedelta
+                from datetime import datetime
+                from dateutil.relativedelta import relativedelta
             
-            data_inicial = datetime.strptime(data_debito, '%Y-%m-%d')
+                data_inicial = datetime.strptime(data_debito, '%Y-%m-%d')
             
-            if recorrente:
-                # Calcular meses até dezembro do ano atual
-                meses_ate_dezembro = 12 - data_inicial.month + 1
-                quantidade = meses_ate_dezembro
+                if recorrente:
+                    # Regra mensal sem data final: nenhuma parcela gravada
+                    quantidade = 1
+                    tipo_parcelamento = 'mensal'
             
-            # Inserir conta principal
-            cursor.execute('''
-                INSERT INTO contas_pagar (data_debito, tipo_debito, valor_total, quantidade,
-                                         tipo_parcelamento, observacoes, recorrente)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (data_debito, tipo_debito, valor_total, quantidade, tipo_parcelamento, observacoes, 
-                  1 if recorrente else 0))
-            
-            conta_id = cursor.lastrowid
-            
-            # Criar parcelas
-            valor_parcela = valor_total / quantidade if tipo_parcelamento == 'parcelado' else valor_total
-            
-            for i in range(quantidade):
-                if tipo_parcelamento == 'mensal' or recorrente:
-                    data_vencimento = data_inicial + relativedelta(months=i)
-                    valor_atual = valor_total
-                else:  # parcelado
-                    data_vencimento = data_inicial + relativedelta(months=i)
-                    valor_atual = valor_parcela
-                
+                # Inserir conta principal
                 cursor.execute('''
-                    INSERT INTO parcelas_pagar (conta_pagar_id, numero_parcela, data_vencimento, valor)
-                    VALUES (?, ?, ?, ?)
-                ''', (conta_id, i + 1, data_vencimento.strftime('%Y-%m-%d'), valor_atual))
+                    INSERT INTO contas_pagar (data_debito, tipo_debito, valor_total, quantidade,
+                                             tipo_parcelamento, observacoes, recorrente)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (data_debito, tipo_debito, valor_total, quantidade, tipo_parcelamento, observacoes, 
+                      1 if recorrente else 0))
             
-            conn.commit()
-            conn.close()
-            return True
+                conta_id = cursor.lastrowid
+            
+                if recorrente:
+                    return True
+            
+                # Criar parcelas
+                valor_parcela = valor_total / quantidade if tipo_parcelamento == 'parcelado' else valor_total
+            
+                for i in range(quantidade):
+                    if tipo_parcelamento == 'mensal':
+                        data_vencimento = data_inicial + relativedelta(months=i)
+                        valor_atual = valor_total
+                    else:  # parcelado
+                        data_vencimento = data_inicial + relativedelta(months=i)
+                        valor_atual = valor_parcela
+                
+                    cursor.execute('''
+                        INSERT INTO parcelas_pagar (conta_pagar_id, numero_parcela, data_vencimento, valor)
+                        VALUES (?, ?, ?, ?)
+                    ''', (conta_id, i + 1, data_vencimento.strftime('%Y-%m-%d'), valor_atual))
+            
+                return True
         except Exception as e:
             print(f"Erro ao criar conta a pagar: {e}")
             return False
@@ -2126,70 +2683,167 @@ class Database:
     def get_contas_pagar(self) -> List[Dict]:
         """Busca todas as contas a pagar"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('SELECT * FROM contas_pagar ORDER BY data_debito DESC')
-            rows = cursor.fetchall()
-            conn.close()
+                cursor.execute('SELECT * FROM contas_pagar ORDER BY data_debito DESC')
+                rows = cursor.fetchall()
             
-            contas = []
-            for row in rows:
-                contas.append({
-                    'id': row[0],
-                    'data_debito': row[1],
-                    'tipo_debito': row[2],
-                    'valor_total': row[3],
-                    'quantidade': row[4],
-                    'tipo_parcelamento': row[5],
-                    'status': row[6],
-                    'observacoes': row[7],
-                    'created_at': row[8],
-                    'recorrente': row[9] if len(row) > 9 else 0
-                })
-            return contas
+                contas = []
+                for row in rows:
+                    contas.append({
+                        'id': row[0],
+                        'data_debito': row[1],
+                        'tipo_debito': row[2],
+                        'valor_total': row[3],
+                        'quantidade': row[4],
+                        'tipo_parcelamento': row[5],
+                        'status': row[6],
+                        'observacoes': row[7],
+                        'created_at': row[8],
+                        'recorrente': row[9] if len(row) > 9 else 0
+                    })
+                return contas
         except Exception as e:
             print(f"Erro ao buscar contas a pagar: {e}")
             return []
     
-    def get_parcelas_pagar(self, conta_id: int = None) -> List[Dict]:
-        """Busca parcelas de contas a pagar"""
+    @staticmethod
+    def _vencimento_recorrente(data_debito: str, numero_parcela: int) -> str:
+        """Vencimento da n-ésima ocorrência de uma conta recorrente (dia limitado ao fim do mês)"""
+        from dateutil.relativedelta import relativedelta
+        
+        vencimento = date.fromisoformat(data_debito) + relativedelta(months=numero_parcela - 1)
+        return vencimento.strftime('%Y-%m-%d')
+    
+    def _iter_parcelas_recorrentes(self, cursor: sqlite3.Cursor, data_inicio: Optional[str],
+                                   data_fim: str, conta_id: int = None) -> Iterator[Dict]:
+        """
+        Gera as ocorrências das contas a pagar recorrentes que vencem na janela
+        
+        A n-ésima ocorrência vence em data_debito + (n - 1) meses e vale
+        valor_total. Ocorrências que já têm linha em parcelas_pagar (paga, editada
+        ou excluída) são puladas: a linha gravada vale no lugar delas.
+        
+        Args:
+            cursor: Cursor da transação atual
+            data_inicio: Primeiro vencimento da janela (None = desde data_debito)
+            data_fim: Último vencimento da janela (inclusive)
+            conta_id: Limita a uma conta
+        
+        Yields:
+            Parcela no formato de get_parcelas_pagar com 'id' None, por conta e vencimento
+        """
+        filtro = 'AND cp.id = ?' if conta_id else ''
+        params = (conta_id,) if conta_id else ()
+        
+        cursor.execute(f'''
+            SELECT cp.id, cp.data_debito, cp.valor_total, cp.tipo_debito
+            FROM contas_pagar cp
+            WHERE cp.recorrente = 1 {filtro}
+            ORDER BY cp.id
+        ''', params)
+        regras = cursor.fetchall()
+        
+        if not regras:
+            return
+        
+        cursor.execute(f'''
+            SELECT pp.conta_pagar_id, pp.numero_parcela
+            FROM parcelas_pagar pp
+            JOIN contas_pagar cp ON cp.id = pp.conta_pagar_id
+            WHERE cp.recorrente = 1 {filtro}
+        ''', params)
+        gravadas = set(cursor.fetchall())
+        
+        janela_inicio = date.fromisoformat(data_inicio) if data_inicio else None
+        
+        for cp_id, data_debito, valor_total, tipo_debito in regras:
+            inicio = date.fromisoformat(data_debito)
+            
+            # Pular direto para a primeira ocorrência que pode cair na janela
+            numero = 1
+            if janela_inicio:
+                numero += max(0, (janela_inicio.year - inicio.year) * 12 + janela_inicio.month - inicio.month)
+            
+            while True:
+                vencimento = self._vencimento_recorrente(data_debito, numero)
+                if vencimento > data_fim:
+                    break
+                if (not data_inicio or vencimento >= data_inicio) and (cp_id, numero) not in gravadas:
+                    yield {
+                        'id': None,
+                        'conta_pagar_id': cp_id,
+                        'numero_parcela': numero,
+                        'data_vencimento': vencimento,
+                        'valor': valor_total,
+                        'data_pagamento': None,
+                        'status': 'pendente',
+                        'tipo_debito': tipo_debito
+                    }
+                numero += 1
+    
+    def _gravar_parcelas(self, cursor: sqlite3.Cursor, parcelas: List[Dict]):
+        """Grava ocorrências geradas como linhas de parcelas_pagar (pendentes)"""
+        cursor.executemany('''
+            INSERT INTO parcelas_pagar (conta_pagar_id, numero_parcela, data_vencimento, valor)
+            VALUES (?, ?, ?, ?)
+        ''', [(p['conta_pagar_id'], p['numero_parcela'], p['data_vencimento'], p['valor'])
+              for p in parcelas])
+    
+    def get_parcelas_pagar(self, conta_id: int = None, ate: str = None) -> List[Dict]:
+        """Busca parcelas de contas a pagar
+        
+        Inclui as ocorrências ainda não gravadas das contas recorrentes que vencem
+        até `ate` (padrão: 31/12 do ano atual), com 'id' None; use
+        materializar_parcela_pagar para obter um id antes de pagar/editar/excluir.
+        """
+        if ate is None:
+            ate = f"{get_brasilia_today().year}-12-31"
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            if conta_id:
-                cursor.execute('''
-                    SELECT pp.*, cp.tipo_debito
-                    FROM parcelas_pagar pp
-                    JOIN contas_pagar cp ON pp.conta_pagar_id = cp.id
-                    WHERE pp.conta_pagar_id = ?
-                    ORDER BY pp.numero_parcela
-                ''', (conta_id,))
-            else:
-                cursor.execute('''
-                    SELECT pp.*, cp.tipo_debito
-                    FROM parcelas_pagar pp
-                    JOIN contas_pagar cp ON pp.conta_pagar_id = cp.id
-                    ORDER BY pp.data_vencimento
-                ''')
+                if conta_id:
+                    cursor.execute('''
+                        SELECT pp.*, cp.tipo_debito
+                        FROM parcelas_pagar pp
+                        JOIN contas_pagar cp ON pp.conta_pagar_id = cp.id
+                        WHERE pp.conta_pagar_id = ? AND pp.status IS NOT 'excluida'
+                        ORDER BY pp.numero_parcela
+                    ''', (conta_id,))
+                else:
+                    cursor.execute('''
+                        SELECT pp.*, cp.tipo_debito
+                        FROM parcelas_pagar pp
+                        JOIN contas_pagar cp ON pp.conta_pagar_id = cp.id
+                        WHERE pp.status IS NOT 'excluida'
+                        ORDER BY pp.data_vencimento
+                    ''')
             
-            rows = cursor.fetchall()
-            conn.close()
+                rows = cursor.fetchall()
             
-            parcelas = []
-            for row in rows:
-                parcelas.append({
-                    'id': row[0],
-                    'conta_pagar_id': row[1],
-                    'numero_parcela': row[2],
-                    'data_vencimento': row[3],
-                    'valor': row[4],
-                    'data_pagamento': row[5],
-                    'status': row[6],
-                    'tipo_debito': row[7]
-                })
-            return parcelas
+                parcelas = []
+                for row in rows:
+                    parcelas.append({
+                        'id': row[0],
+                        'conta_pagar_id': row[1],
+                        'numero_parcela': row[2],
+                        'data_vencimento': row[3],
+                        'valor': row[4],
+                        'data_pagamento': row[5],
+                        'status': row[6],
+                        'tipo_debito': row[7]
+                    })
+            
+                # Ocorrências das recorrentes geradas sob demanda
+                parcelas.extend(self._iter_parcelas_recorrentes(cursor, None, ate, conta_id))
+                if conta_id:
+                    parcelas.sort(key=lambda p: p['numero_parcela'])
+                else:
+                    parcelas.sort(key=lambda p: p['data_vencimento'])
+                return parcelas
         except Exception as e:
             print(f"Erro ao buscar parcelas: {e}")
             return []
@@ -2197,218 +2851,564 @@ class Database:
     def update_pagamento_pagar(self, parcela_id: int, data_pagamento: str) -> bool:
         """Marca uma parcela como paga"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('''
-                UPDATE parcelas_pagar 
-                SET data_pagamento = ?, status = 'pago'
-                WHERE id = ?
-            ''', (data_pagamento, parcela_id))
+                cursor.execute('''
+                    UPDATE parcelas_pagar 
+                    SET data_pagamento = ?, status = 'pago'
+                    WHERE id = ?
+                ''', (data_pagamento, parcela_id))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except Exception as e:
             print(f"Erro ao atualizar pagamento: {e}")
             return False
     
+    def materializar_parcela_pagar(self, conta_pagar_id: int, numero_parcela: int) -> Optional[int]:
+        """
+        Retorna o id da parcela, gravando a ocorrência da conta recorrente se
+        ela ainda só existe como regra
+        """
+        try:
+            with self.connection(immediate=True) as conn:
+                cursor = conn.cursor()
+            
+                cursor.execute('''
+                    SELECT id FROM parcelas_pagar
+                    WHERE conta_pagar_id = ? AND numero_parcela = ?
+                ''', (conta_pagar_id, numero_parcela))
+                row = cursor.fetchone()
+                if row:
+                    return row[0]
+            
+                cursor.execute('''
+                    SELECT data_debito, valor_total FROM contas_pagar
+                    WHERE id = ? AND recorrente = 1
+                ''', (conta_pagar_id,))
+                conta = cursor.fetchone()
+                if not conta:
+                    return None
+            
+                data_debito, valor_total = conta
+                cursor.execute('''
+                    INSERT INTO parcelas_pagar (conta_pagar_id, numero_parcela, data_vencimento, valor)
+                    VALUES (?, ?, ?, ?)
+                ''', (conta_pagar_id, numero_parcela,
+                      self._vencimento_recorrente(data_debito, numero_parcela), valor_total))
+                return cursor.lastrowid
+        except Exception as e:
+            print(f"Erro ao gravar parcela: {e}")
+            return None
+    
+    def update_parcela_pagar(self, parcela_id: int, tipo_debito: str, valor: float,
+                             data_vencimento: str, status: str, data_pagamento: Optional[str],
+                             recorrente: bool) -> bool:
+        """
+        Atualiza uma parcela e a conta a pagar dela (formulário de edição)
+        
+        Em conta recorrente, a regra só muda quando o valor muda com 'recorrente'
+        marcado: as ocorrências vencidas até hoje são gravadas com o valor antigo
+        e as futuras (geradas ou gravadas) passam a usar o novo. Desmarcar
+        'recorrente' encerra a regra nesta parcela, gravando as anteriores a ela.
+        """
+        try:
+            with self.connection(immediate=True) as conn:
+                cursor = conn.cursor()
+            
+                cursor.execute('''
+                    SELECT pp.conta_pagar_id, pp.numero_parcela, pp.valor, cp.recorrente, cp.data_debito
+                    FROM parcelas_pagar pp
+                    JOIN contas_pagar cp ON cp.id = pp.conta_pagar_id
+                    WHERE pp.id = ?
+                ''', (parcela_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return False
+            
+                conta_id, numero_parcela, valor_antigo, era_recorrente, data_debito = row
+                valor_mudou = valor != valor_antigo
+                hoje_str = get_brasilia_today().strftime('%Y-%m-%d')
+            
+                if era_recorrente and not recorrente:
+                    # Encerrar a regra: as ocorrências anteriores continuam na lista
+                    ate = self._vencimento_recorrente(data_debito, numero_parcela)
+                    self._gravar_parcelas(cursor, [
+                        p for p in self._iter_parcelas_recorrentes(cursor, None, ate, conta_id)
+                        if p['numero_parcela'] < numero_parcela
+                    ])
+                elif era_recorrente and valor_mudou:
+                    # Ocorrências até hoje mantêm o valor antigo
+                    self._gravar_parcelas(cursor, list(
+                        self._iter_parcelas_recorrentes(cursor, None, hoje_str, conta_id)
+                    ))
+            
+                # Atualizar tipo_debito, valor_total e recorrente na conta_pagar principal
+                if era_recorrente and recorrente and not valor_mudou:
+                    cursor.execute('''
+                        UPDATE contas_pagar SET tipo_debito=? WHERE id=?
+                    ''', (tipo_debito, conta_id))
+                else:
+                    cursor.execute('''
+                        UPDATE contas_pagar 
+                        SET tipo_debito=?, valor_total=?, recorrente=?
+                        WHERE id=?
+                    ''', (tipo_debito, valor, 1 if recorrente else 0, conta_id))
+            
+                # Atualizar parcela atual
+                cursor.execute('''
+                    UPDATE parcelas_pagar 
+                    SET valor=?, data_vencimento=?, status=?, data_pagamento=?
+                    WHERE id=?
+                ''', (valor, data_vencimento, status,
+                      data_pagamento if status == 'pago' else None, parcela_id))
+            
+                # Se for recorrente e o valor mudou, atualizar parcelas futuras já gravadas
+                if recorrente and valor_mudou:
+                    cursor.execute('''
+                        UPDATE parcelas_pagar 
+                        SET valor=?
+                        WHERE conta_pagar_id=?
+                        AND data_vencimento > ?
+                        AND id != ?
+                        AND status IS NOT 'excluida'
+                    ''', (valor, conta_id, hoje_str, parcela_id))
+            
+                return True
+        except Exception as e:
+            print(f"Erro ao atualizar parcela: {e}")
+            return False
+    
     def delete_conta_pagar(self, conta_id: int) -> bool:
         """Exclui uma conta a pagar e suas parcelas"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('DELETE FROM parcelas_pagar WHERE conta_pagar_id = ?', (conta_id,))
-            cursor.execute('DELETE FROM contas_pagar WHERE id = ?', (conta_id,))
+                cursor.execute('DELETE FROM parcelas_pagar WHERE conta_pagar_id = ?', (conta_id,))
+                cursor.execute('DELETE FROM contas_pagar WHERE id = ?', (conta_id,))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except Exception as e:
             print(f"Erro ao excluir conta a pagar: {e}")
             return False
     
     def delete_parcela_pagar(self, parcela_id: int) -> bool:
-        """Exclui uma parcela específica. Se for a última, exclui a conta também."""
+        """Exclui uma parcela específica. Se for a última, exclui a conta também.
+        
+        Em conta recorrente a parcela é marcada como 'excluida', para que a
+        ocorrência não volte a ser gerada pela regra.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            # Buscar conta_pagar_id antes de excluir
-            cursor.execute('SELECT conta_pagar_id FROM parcelas_pagar WHERE id = ?', (parcela_id,))
-            result = cursor.fetchone()
+                # Buscar conta_pagar_id antes de excluir
+                cursor.execute('''
+                    SELECT pp.conta_pagar_id, cp.recorrente
+                    FROM parcelas_pagar pp
+                    LEFT JOIN contas_pagar cp ON cp.id = pp.conta_pagar_id
+                    WHERE pp.id = ?
+                ''', (parcela_id,))
+                result = cursor.fetchone()
             
-            if not result:
-                conn.close()
-                return False
+                if not result:
+                    return False
             
-            conta_pagar_id = result[0]
+                conta_pagar_id, recorrente = result
             
-            # Excluir a parcela
-            cursor.execute('DELETE FROM parcelas_pagar WHERE id = ?', (parcela_id,))
+                if recorrente:
+                    cursor.execute('''
+                        UPDATE parcelas_pagar SET status = 'excluida', data_pagamento = NULL
+                        WHERE id = ?
+                    ''', (parcela_id,))
+                    return True
             
-            # Verificar se ainda existem outras parcelas
-            cursor.execute('SELECT COUNT(*) FROM parcelas_pagar WHERE conta_pagar_id = ?', (conta_pagar_id,))
-            count = cursor.fetchone()[0]
+                # Excluir a parcela
+                cursor.execute('DELETE FROM parcelas_pagar WHERE id = ?', (parcela_id,))
             
-            # Se não houver mais parcelas, excluir a conta principal também
-            if count == 0:
-                cursor.execute('DELETE FROM contas_pagar WHERE id = ?', (conta_pagar_id,))
+                # Verificar se ainda existem outras parcelas
+                cursor.execute('SELECT COUNT(*) FROM parcelas_pagar WHERE conta_pagar_id = ?', (conta_pagar_id,))
+                count = cursor.fetchone()[0]
             
-            conn.commit()
-            conn.close()
-            return True
+                # Se não houver mais parcelas, excluir a conta principal também
+                if count == 0:
+                    cursor.execute('DELETE FROM contas_pagar WHERE id = ?', (conta_pagar_id,))
+            
+                return True
         except Exception as e:
             print(f"Erro ao excluir parcela: {e}")
             return False
     
-    def get_fluxo_caixa(self, data_inicio: str, data_fim: str) -> Dict:
-        """Gera relatório de fluxo de caixa para um período, incluindo projeção de contas recorrentes"""
-        try:
-            from datetime import datetime
-            from dateutil.relativedelta import relativedelta
-            
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Contas a receber no período (incluindo as já cadastradas)
-            cursor.execute('''
-                SELECT data_vencimento, SUM(valor) as total
+    @staticmethod
+    def _projetar_mensal(contas: List[tuple], ate: date) -> List[tuple]:
+        """
+        Calendário mensal das contas recorrentes, calculado de uma vez com numpy.
+        
+        Reproduz somar relativedelta(months=1) repetidamente: o dia só diminui
+        quando um mês não o comporta (31/01 -> 28/02 -> 28/03 ...), ou seja, o
+        dia de cada mês é o mínimo acumulado entre o dia inicial e os tamanhos dos
+        meses percorridos.
+        
+        Args:
+            contas: [(chave, valor, data_base 'YYYY-MM-DD', primeiro_passo)] onde
+                primeiro_passo 0 inclui a própria data_base e 1 começa no mês seguinte
+            ate: Última data possível (inclusive)
+        
+        Returns:
+            [(chave, valor, 'YYYY-MM-DD')] por conta, em ordem cronológica
+        """
+        import numpy as np
+        
+        if not contas:
+            return []
+        
+        bases = np.array([conta[2] for conta in contas], dtype='datetime64[D]')
+        base_meses = bases.astype('datetime64[M]')
+        dia_inicial = (bases - base_meses.astype('datetime64[D]')).astype(np.int64) + 1
+        primeiro_passo = np.array([conta[3] for conta in contas], dtype=np.int64)
+        
+        ultimo_mes = np.datetime64(ate, 'M')
+        passos = max(int((ultimo_mes - base_meses).astype(np.int64).max()) + 1, 1)
+        
+        # meses[i, k] = mês da conta i após k passos
+        meses = base_meses[:, None] + np.arange(passos)
+        tamanhos = ((meses + 1).astype('datetime64[D]') - meses.astype('datetime64[D]')).astype(np.int64)
+        tamanhos[:, 0] = dia_inicial
+        dias = np.minimum.accumulate(tamanhos, axis=1)
+        datas = meses.astype('datetime64[D]') + (dias - 1)
+        
+        validas = (np.arange(passos) >= primeiro_passo[:, None]) & (datas <= np.datetime64(ate, 'D'))
+        datas_str = np.datetime_as_string(datas, unit='D')
+        
+        projecao = []
+        for i, k in zip(*np.nonzero(validas)):
+            projecao.append((contas[i][0], contas[i][1], str(datas_str[i, k])))
+        return projecao
+    
+    @staticmethod
+    def _filtrar_projecao(projecao: List[tuple], existentes: set,
+                          data_inicio: str, data_fim: str) -> List[tuple]:
+        """
+        Parcelas projetadas dentro do período cujo (chave, mês) ainda não tem
+        conta cadastrada (anti-join em memória com `existentes`).
+        
+        Returns:
+            [(data 'YYYY-MM-DD', valor)] na ordem do cálculo mês a mês
+        """
+        return [(data_str, valor) for chave, valor, data_str in projecao
+                if data_inicio <= data_str <= data_fim and (chave, data_str[:7]) not in existentes]
+    
+    def _projecao_fluxo_caixa(self, cursor: sqlite3.Cursor, data_inicio: str,
+                              data_fim: str) -> Dict[str, List[tuple]]:
+        """
+        Projeção das contas recorrentes no período (sem as contas já cadastradas)
+        
+        A projeção não consulta o banco por mês: os meses já cadastrados de cada
+        cliente/tipo são lidos numa consulta e o calendário projetado é cruzado
+        com eles em memória. Contas a pagar recorrentes são regras expandidas por
+        _iter_parcelas_recorrentes na janela pedida.
+        
+        Returns:
+            {'receber': [(data, valor)], 'pagar': [(data, valor)]}
+        """
+        from datetime import datetime
+        
+        # Meses do período, para ler só as contas que podem coincidir com a projeção
+        mes_inicio = data_inicio[:7] + '-01'
+        mes_fim = data_fim[:7] + '-31'
+        
+        # Buscar contas a receber recorrentes para projetar até dezembro
+        # Usar apenas a conta mais recente de cada cliente/tipo para evitar duplicação
+        # Pegar a conta com a última data de vencimento para cada client_id + tipo_plano
+        cursor.execute('''
+            WITH todas_contas_recorrentes AS (
+                -- Contas marcadas como Recorrente
+                SELECT DISTINCT client_id, tipo_plano
                 FROM contas_receber
-                WHERE data_vencimento BETWEEN ? AND ?
-                GROUP BY data_vencimento
-            ''', (data_inicio, data_fim))
+                WHERE observacoes LIKE '%Recorrente%'
             
-            receber = {row[0]: row[1] for row in cursor.fetchall()}
+                UNION
             
-            # Buscar contas a receber recorrentes para projetar até dezembro
-            # Usar apenas a conta mais recente de cada cliente/tipo para evitar duplicação
-            # Pegar a conta com a última data de vencimento para cada client_id + tipo_plano
-            cursor.execute('''
-                WITH todas_contas_recorrentes AS (
-                    -- Contas marcadas como Recorrente
-                    SELECT DISTINCT client_id, tipo_plano
-                    FROM contas_receber
-                    WHERE observacoes LIKE '%Recorrente%'
-                    
-                    UNION
-                    
-                    -- Contas com 3 ou mais registros do mesmo tipo
-                    SELECT c2.client_id, c2.tipo_plano
-                    FROM contas_receber c2
-                    GROUP BY c2.client_id, c2.tipo_plano
-                    HAVING COUNT(*) >= 3
-                )
-                SELECT cr.client_id, cr.tipo_plano, cr.valor, cr.quantidade, cr.data_vencimento as ultima_data
+                -- Contas com 3 ou mais registros do mesmo tipo
+                SELECT c2.client_id, c2.tipo_plano
+                FROM contas_receber c2
+                GROUP BY c2.client_id, c2.tipo_plano
+                HAVING COUNT(*) >= 3
+            )
+            SELECT client_id, tipo_plano, valor, quantidade, ultima_data
+            FROM (
+                SELECT cr.id, cr.client_id, cr.tipo_plano, cr.valor, cr.quantidade,
+                       cr.data_vencimento as ultima_data,
+                       MAX(cr.data_vencimento) OVER (
+                           PARTITION BY cr.client_id, cr.tipo_plano
+                       ) as max_data
                 FROM contas_receber cr
                 INNER JOIN todas_contas_recorrentes tcr 
                     ON cr.client_id = tcr.client_id 
                     AND cr.tipo_plano = tcr.tipo_plano
-                WHERE cr.data_vencimento = (
-                    SELECT MAX(cr2.data_vencimento)
-                    FROM contas_receber cr2
-                    WHERE cr2.client_id = cr.client_id
-                    AND cr2.tipo_plano = cr.tipo_plano
-                )
-            ''')
-            
-            contas_recorrentes = cursor.fetchall()
-            
-            # Projetar contas recorrentes até dezembro do ano final
-            data_fim_obj = datetime.strptime(data_fim, '%Y-%m-%d')
-            dezembro = datetime(data_fim_obj.year, 12, 31)
-            
-            for conta in contas_recorrentes:
-                client_id, tipo_plano, valor, quantidade, ultima_data = conta
-                
-                # Começar a partir do mês seguinte à última data cadastrada
-                ultima_data_obj = datetime.strptime(ultima_data, '%Y-%m-%d')
-                mes_atual = ultima_data_obj + relativedelta(months=1)
-                
-                # Projetar mensalmente até dezembro
-                while mes_atual <= dezembro:
-                    data_str = mes_atual.strftime('%Y-%m-%d')
-                    
-                    # Verificar se está no período solicitado
-                    if data_inicio <= data_str <= data_fim:
-                        # Verificar se JÁ EXISTE uma conta cadastrada para este cliente/tipo neste mês
-                        ano_mes = data_str[:7]  # YYYY-MM
-                        cursor.execute('''
-                            SELECT COUNT(*) FROM contas_receber
-                            WHERE client_id=? AND tipo_plano=? 
-                            AND strftime('%Y-%m', data_vencimento) = ?
-                        ''', (client_id, tipo_plano, ano_mes))
-                        
-                        # Só adicionar projeção se NÃO existir conta cadastrada neste mês
-                        if cursor.fetchone()[0] == 0:
-                            receber[data_str] = receber.get(data_str, 0) + valor
-                    
-                    mes_atual = mes_atual + relativedelta(months=1)
-            
-            # Parcelas a pagar no período (incluindo as já cadastradas)
-            cursor.execute('''
-                SELECT data_vencimento, SUM(valor) as total
-                FROM parcelas_pagar
-                WHERE data_vencimento BETWEEN ? AND ?
-                GROUP BY data_vencimento
-            ''', (data_inicio, data_fim))
-            
-            pagar = {row[0]: row[1] for row in cursor.fetchall()}
-            
-            # Buscar contas a pagar recorrentes para projetar até dezembro
-            cursor.execute('''
-                SELECT cp.id, cp.tipo_debito, cp.valor_total, cp.data_debito,
-                       (SELECT MAX(pp.data_vencimento) FROM parcelas_pagar pp WHERE pp.conta_pagar_id = cp.id) as ultima_parcela
-                FROM contas_pagar cp
-                WHERE cp.recorrente = 1
-            ''')
+            )
+            WHERE ultima_data = max_data
+            ORDER BY id
+        ''')
+        
+        contas_recorrentes = cursor.fetchall()
+        
+        # Meses que já têm conta cadastrada por cliente/tipo
+        cursor.execute('''
+            SELECT DISTINCT client_id, tipo_plano, substr(data_vencimento, 1, 7)
+            FROM contas_receber
+            WHERE data_vencimento BETWEEN ? AND ?
+        ''', (mes_inicio, mes_fim))
+        
+        receber_existentes = {((client_id, tipo_plano), ano_mes)
+                              for client_id, tipo_plano, ano_mes in cursor.fetchall()}
+        
+        # Projetar contas recorrentes até dezembro do ano final,
+        # a partir do mês seguinte à última data cadastrada
+        data_fim_obj = datetime.strptime(data_fim, '%Y-%m-%d')
+        dezembro = date(data_fim_obj.year, 12, 31)
+        
+        projecao_receber = self._projetar_mensal([
+            ((client_id, tipo_plano), valor, ultima_data, 1)
+            for client_id, tipo_plano, valor, quantidade, ultima_data in contas_recorrentes
+        ], dezembro)
+        
+        # Contas a pagar recorrentes: ocorrências da regra ainda não gravadas
+        projecao_pagar = [(p['data_vencimento'], p['valor'])
+                          for p in self._iter_parcelas_recorrentes(cursor, data_inicio, data_fim)]
+        
+        return {
+            'receber': self._filtrar_projecao(projecao_receber, receber_existentes, data_inicio, data_fim),
+            'pagar': projecao_pagar
+        }
+    
+    def get_fluxo_caixa(self, data_inicio: str, data_fim: str) -> Dict:
+        """Gera relatório de fluxo de caixa para um período, incluindo projeção de contas recorrentes"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            contas_pagar_recorrentes = cursor.fetchall()
+                # Contas a receber no período (incluindo as já cadastradas)
+                cursor.execute('''
+                    SELECT data_vencimento, SUM(valor) as total
+                    FROM contas_receber
+                    WHERE data_vencimento BETWEEN ? AND ?
+                    GROUP BY data_vencimento
+                ''', (data_inicio, data_fim))
             
-            for conta_pagar in contas_pagar_recorrentes:
-                cp_id, tipo_debito, valor_total, data_debito, ultima_parcela = conta_pagar
-                
-                # Se já existem parcelas, começar após a última. Senão, começar na data de débito
-                if ultima_parcela:
-                    data_inicial_obj = datetime.strptime(ultima_parcela, '%Y-%m-%d')
-                    mes_atual = data_inicial_obj + relativedelta(months=1)
-                else:
-                    data_inicial_obj = datetime.strptime(data_debito, '%Y-%m-%d')
-                    mes_atual = data_inicial_obj
-                
-                # Projetar mensalmente até dezembro
-                while mes_atual <= dezembro:
-                    data_str = mes_atual.strftime('%Y-%m-%d')
-                    
-                    # Verificar se está no período solicitado
-                    if data_inicio <= data_str <= data_fim:
-                        # Verificar se JÁ EXISTE uma parcela cadastrada para esta conta neste mês
-                        ano_mes = data_str[:7]  # YYYY-MM
-                        cursor.execute('''
-                            SELECT COUNT(*) FROM parcelas_pagar
-                            WHERE conta_pagar_id=? 
-                            AND strftime('%Y-%m', data_vencimento) = ?
-                        ''', (cp_id, ano_mes))
-                        
-                        # Só adicionar projeção se NÃO existir parcela cadastrada neste mês
-                        if cursor.fetchone()[0] == 0:
-                            pagar[data_str] = pagar.get(data_str, 0) + valor_total
-                    
-                    mes_atual = mes_atual + relativedelta(months=1)
+                receber = {row[0]: row[1] for row in cursor.fetchall()}
             
-            conn.close()
+                # Parcelas a pagar no período (incluindo as já cadastradas)
+                cursor.execute('''
+                    SELECT data_vencimento, SUM(valor) as total
+                    FROM parcelas_pagar
+                    WHERE data_vencimento BETWEEN ? AND ?
+                    AND status IS NOT 'excluida'
+                    GROUP BY data_vencimento
+                ''', (data_inicio, data_fim))
+            
+                pagar = {row[0]: row[1] for row in cursor.fetchall()}
+            
+                # Somar a projeção na ordem do cálculo mês a mês
+                projecao = self._projecao_fluxo_caixa(cursor, data_inicio, data_fim)
+                for data_str, valor in projecao['receber']:
+                    receber[data_str] = receber.get(data_str, 0) + valor
+                for data_str, valor in projecao['pagar']:
+                    pagar[data_str] = pagar.get(data_str, 0) + valor
             
-            return {
-                'receber': receber,
-                'pagar': pagar
-            }
+                return {
+                    'receber': receber,
+                    'pagar': pagar
+                }
         except Exception as e:
             print(f"Erro ao gerar fluxo de caixa: {e}")
             import traceback
             traceback.print_exc()
             return {'receber': {}, 'pagar': {}}
     
+    def get_fluxo_caixa_mensal(self, ano: int) -> List[Dict]:
+        """
+        Resumo mensal do fluxo de caixa de um ano (12 linhas de fluxo_caixa_mensal)
+        
+        Os totais cadastrados são mantidos por triggers. A projeção das contas
+        recorrentes é guardada junto com a versão dos dados financeiros e só é
+        recalculada quando alguma conta mudou desde o último cálculo.
+        
+        Returns:
+            [{'mes': 'YYYY-MM', 'receber': float, 'pagar': float}] de janeiro a dezembro
+        """
+        meses = [f"{ano}-{mes:02d}" for mes in range(1, 13)]
+        
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                
+                resumo = self._read_fluxo_caixa_mensal(cursor, meses)
+                if resumo is None:
+                    # Projeção desatualizada: recalcular o ano com a escrita reservada
+                    with self.connection(immediate=True):
+                        resumo = self._read_fluxo_caixa_mensal(cursor, meses)
+                        if resumo is None:
+                            self._update_projecao_mensal(cursor, ano, meses)
+                            resumo = self._read_fluxo_caixa_mensal(cursor, meses)
+                
+                return [
+                    {'mes': mes, 'receber': resumo[mes][0], 'pagar': resumo[mes][1]}
+                    for mes in meses
+                ]
+        except Exception as e:
+            print(f"Erro ao buscar fluxo de caixa mensal: {e}")
+            return [{'mes': mes, 'receber': 0, 'pagar': 0} for mes in meses]
+    
+    def _read_fluxo_caixa_mensal(self, cursor: sqlite3.Cursor, meses: List[str]) -> Optional[Dict[str, tuple]]:
+        """
+        Lê os meses do resumo com a projeção somada
+        
+        Returns:
+            {ano_mes: (receber, pagar)} ou None se a projeção de algum mês estiver desatualizada
+        """
+        cursor.execute('''
+            SELECT m.ano_mes,
+                   m.receber + m.receber_projetado,
+                   m.pagar + m.pagar_projetado,
+                   m.projecao_versao = v.versao
+            FROM fluxo_caixa_mensal m, fluxo_caixa_versao v
+            WHERE m.ano_mes BETWEEN ? AND ?
+        ''', (meses[0], meses[-1]))
+        
+        resumo = {}
+        for ano_mes, receber, pagar, atualizado in cursor.fetchall():
+            if not atualizado:
+                return None
+            resumo[ano_mes] = (receber, pagar)
+        
+        if len(resumo) < len(meses):
+            return None
+        return resumo
+    
+    def _update_projecao_mensal(self, cursor: sqlite3.Cursor, ano: int, meses: List[str]):
+        """Recalcula a projeção das recorrentes por mês do ano e grava com a versão atual"""
+        projecao = self._projecao_fluxo_caixa(cursor, f"{ano}-01-01", f"{ano}-12-31")
+        
+        totais = {mes: [0, 0] for mes in meses}
+        for data_str, valor in projecao['receber']:
+            totais[data_str[:7]][0] += valor
+        for data_str, valor in projecao['pagar']:
+            totais[data_str[:7]][1] += valor
+        
+        cursor.executemany('''
+            INSERT INTO fluxo_caixa_mensal (ano_mes, receber_projetado, pagar_projetado, projecao_versao)
+            VALUES (?, ?, ?, (SELECT versao FROM fluxo_caixa_versao))
+            ON CONFLICT (ano_mes) DO UPDATE SET
+                receber_projetado = excluded.receber_projetado,
+                pagar_projetado = excluded.pagar_projetado,
+                projecao_versao = excluded.projecao_versao
+        ''', [(mes, receber, pagar) for mes, (receber, pagar) in totais.items()])
+    
+    def rebuild_fluxo_caixa_mensal(self) -> bool:
+        """
+        Recalcula do zero os totais de fluxo_caixa_mensal a partir das contas
+        
+        Os triggers mantêm o resumo em dia; usar após importar/corrigir dados por
+        fora da aplicação ou para zerar resíduos de arredondamento das somas
+        incrementais. As projeções são refeitas na próxima leitura.
+        """
+        try:
+            with self.connection(immediate=True) as conn:
+                rebuild_fluxo_caixa_mensal(conn.cursor())
+                return True
+        except Exception as e:
+            print(f"Erro ao recalcular fluxo de caixa mensal: {e}")
+            return False
+    
+    @staticmethod
+    def _parse_dias_horarios(dias_semana_json: Optional[str], dias_horarios: dict = None) -> Dict[int, str]:
+        """
+        Converte os dias/horários do contrato em {dia_num: horario}.
+
+        Novo formato: {"1": "08:00", "5": "14:00"}
+        Formato antigo (compatibilidade): [1, 5] - usa horário padrão 08:00
+        """
+        import json
+
+        if dias_horarios:
+            # Usar dicionário fornecido
+            return {int(k): v for k, v in dias_horarios.items()}
+
+        if not dias_semana_json:
+            return {}
+
+        try:
+            data = json.loads(dias_semana_json)
+        except (TypeError, ValueError):
+            return {}
+
+        if isinstance(data, dict):
+            return {int(k): v for k, v in data.items()}
+        if isinstance(data, list):
+            return {int(dia): "08:00" for dia in data}
+        return {}
+
+    @staticmethod
+    def _planejar_appointments_contrato(data_inicio_str: Optional[str], tipo: Optional[str],
+                                        sessoes_total: Optional[int], sessoes_usadas: Optional[int],
+                                        dias_horarios_map: Dict[int, str],
+                                        hoje: date) -> tuple:
+        """
+        Calcula de uma vez as ocorrências de um contrato, sem tocar no banco.
+
+        Returns:
+            (ocorrencias, limite): lista ordenada de (date_str, horario, dia_num) e o
+            número máximo de appointments a criar (None = sem limite).
+        """
+        from datetime import timedelta
+
+        if not data_inicio_str or not dias_horarios_map:
+            return [], 0
+
+        data_inicio = datetime.strptime(data_inicio_str, '%Y-%m-%d').date()
+
+        # Definir data final baseado no tipo de contrato
+        if tipo == 'fixo':
+            # Cliente fixo: gerar appointments por 1 ano (renovado automaticamente)
+            data_fim = hoje + timedelta(days=365)
+            limite = None
+        else:
+            # Cliente sessões: gerar apenas as sessões restantes, no máximo 6 meses
+            limite = (sessoes_total or 0) - (sessoes_usadas or 0)
+            if limite <= 0:
+                return [], 0
+            data_fim = data_inicio + timedelta(days=180)
+
+        inicio = max(data_inicio, hoje)
+        ocorrencias = []
+        for dia_num, horario in dias_horarios_map.items():
+            if not 1 <= dia_num <= 7:
+                continue
+            # Primeira data >= inicio que cai neste dia (1=Segunda ... 7=Domingo)
+            current_date = inicio + timedelta(days=(dia_num - 1 - inicio.weekday()) % 7)
+            while current_date <= data_fim:
+                ocorrencias.append((current_date.strftime('%Y-%m-%d'), horario, dia_num))
+                current_date += timedelta(days=7)
+
+        ocorrencias.sort()
+        return ocorrencias, limite
+
+    def _filtrar_horarios_lotados(self, cursor: sqlite3.Cursor, client_id: int,
+                                  linhas: List[tuple]) -> List[tuple]:
+        """Remove de [(client_id, date, time, dia_num)] os horários já lotados"""
+        if not linhas:
+            return linhas
+        occupancy = self._read_slot_occupancy(
+            cursor, client_id, [(date_str, horario, dia_num) for _, date_str, horario, dia_num in linhas]
+        )
+        capacity_map = self._get_capacity_map()
+        return [
+            linha for linha in linhas
+            if occupancy[(linha[1], linha[2])][0] < self.get_slot_capacity(linha[3], linha[2], capacity_map)
+        ]
+
     def gerar_appointments_cliente(self, client_id: int, dias_horarios: dict = None) -> int:
         """
         Gera appointments automaticamente para um cliente baseado em:
@@ -2416,163 +3416,208 @@ class Database:
         - tipo_contrato ('fixo' ou 'sessoes')
         - sessoes_contratadas
         - dias_semana (JSON object: {"1": "08:00", "5": "14:00"} = Segunda 08h e Sexta 14h)
-        
+
+        As datas são calculadas antes de acessar o banco; as já ocupadas são lidas
+        numa única consulta por intervalo e as faltantes gravadas com executemany,
+        pulando horários que já atingiram a capacidade (slot_capacity).
+
         Args:
             client_id: ID do cliente
             dias_horarios: Dicionário opcional {dia_num: horario} para sobrescrever
-        
+
         Returns:
             Número de appointments criados
         """
-        import json
-        from datetime import timedelta
-        from dateutil.relativedelta import relativedelta
-        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Buscar dados do cliente
-            cursor.execute('''
-                SELECT data_inicio_contrato, tipo_contrato, sessoes_contratadas,
-                       dias_semana, sessoes_utilizadas, contrato_ativo
-                FROM users WHERE id = ?
-            ''', (client_id,))
-            
-            dados = cursor.fetchone()
-            
-            if not dados:
-                conn.close()
-                return 0
-            
-            data_inicio_str, tipo, sessoes_total, dias_semana_json, sessoes_usadas, ativo = dados
-            
-            # Verificar se contrato está ativo
-            if not ativo:
-                conn.close()
-                return 0
-            
-            # Parse data de início
-            if not data_inicio_str:
-                conn.close()
-                return 0
-                
-            data_inicio = datetime.strptime(data_inicio_str, '%Y-%m-%d').date()
-            
-            # Parse dias da semana e horários
-            # Novo formato: {"1": "08:00", "5": "14:00"}
-            # Formato antigo (compatibilidade): [1, 5]
-            if not dias_semana_json:
-                conn.close()
-                return 0
-            
-            dias_horarios_map = {}
-            if dias_horarios:
-                # Usar dicionário fornecido
-                dias_horarios_map = {int(k): v for k, v in dias_horarios.items()}
-            else:
-                # Carregar do banco
-                try:
-                    data = json.loads(dias_semana_json)
-                    if isinstance(data, dict):
-                        # Novo formato: {"1": "08:00", "5": "14:00"}
-                        dias_horarios_map = {int(k): v for k, v in data.items()}
-                    elif isinstance(data, list):
-                        # Formato antigo: [1, 5] - usar horário padrão
-                        dias_horarios_map = {dia: "08:00" for dia in data}
-                except:
-                    conn.close()
+            with self.connection(immediate=True) as conn:
+                cursor = conn.cursor()
+
+                # Buscar dados do cliente
+                cursor.execute('''
+                    SELECT data_inicio_contrato, tipo_contrato, sessoes_contratadas,
+                           dias_semana, sessoes_utilizadas, contrato_ativo
+                    FROM users WHERE id = ?
+                ''', (client_id,))
+
+                dados = cursor.fetchone()
+
+                if not dados:
                     return 0
-            
-            if not dias_horarios_map:
-                conn.close()
-                return 0
-            
-            # Definir data final baseado no tipo de contrato
-            if tipo == 'fixo':
-                # Cliente fixo: gerar appointments por 1 ano (ilimitado, renovado automaticamente)
-                # Gerar 52 semanas à frente da data atual
-                data_fim = get_brasilia_today() + timedelta(days=365)
-            else:
-                # Cliente sessões: gerar apenas as sessões restantes
-                sessoes_restantes = (sessoes_total or 0) - (sessoes_usadas or 0)
-                if sessoes_restantes <= 0:
-                    conn.close()
+
+                data_inicio_str, tipo, sessoes_total, dias_semana_json, sessoes_usadas, ativo = dados
+
+                # Verificar se contrato está ativo
+                if not ativo or not dias_semana_json:
                     return 0
-                # Máximo 6 meses no futuro
-                data_fim = data_inicio + timedelta(days=180)
-            
-            # Deletar appointments futuros existentes (não marcados)
-            hoje = get_brasilia_today().strftime('%Y-%m-%d')
-            cursor.execute('''
-                DELETE FROM appointments
-                WHERE client_id = ? AND date >= ? AND attended IS NULL
-            ''', (client_id, hoje))
-            
-            # Iterar pelas datas e criar appointments
-            current_date = data_inicio if data_inicio >= get_brasilia_today() else get_brasilia_today()
-            appointments_criados = 0
-            
-            while current_date <= data_fim:
-                # Verificar se é um dos dias da semana do cliente (1=Segunda, 5=Sexta)
-                weekday = current_date.weekday() + 1  # Python: 0=Segunda, converte para 1=Segunda
-                
-                if weekday in dias_horarios_map:
-                    # Pegar horário específico para este dia
-                    horario = dias_horarios_map[weekday]
-                    
-                    # Verificar se já existe appointment para este dia
-                    date_str = current_date.strftime('%Y-%m-%d')
-                    cursor.execute('''
-                        SELECT id FROM appointments
-                        WHERE client_id = ? AND date = ? AND status != 'cancelled'
-                    ''', (client_id, date_str))
-                    
-                    if not cursor.fetchone():
-                        # Criar appointment com horário específico do dia
-                        cursor.execute('''
-                            INSERT INTO appointments 
-                            (client_id, date, time, day_of_week, status, created_at)
-                            VALUES (?, ?, ?, ?, 'scheduled', datetime('now'))
-                        ''', (client_id, date_str, horario, weekday))
-                        
-                        appointments_criados += 1
-                        
-                        # Se tipo sessões, parar ao atingir o limite
-                        if tipo == 'sessoes' and appointments_criados >= (sessoes_total - sessoes_usadas):
-                            break
-                
-                current_date += timedelta(days=1)
-            
-            conn.commit()
-            conn.close()
-            
-            return appointments_criados
-            
+
+                hoje = get_brasilia_today()
+                ocorrencias, limite = self._planejar_appointments_contrato(
+                    data_inicio_str, tipo, sessoes_total, sessoes_usadas,
+                    self._parse_dias_horarios(dias_semana_json, dias_horarios), hoje
+                )
+                if not ocorrencias:
+                    return 0
+
+                # Deletar appointments futuros existentes (não marcados)
+                hoje_str = hoje.strftime('%Y-%m-%d')
+                cursor.execute('''
+                    DELETE FROM appointments
+                    WHERE client_id = ? AND date >= ? AND attended IS NULL
+                ''', (client_id, hoje_str))
+
+                # Datas que já possuem appointment no intervalo (uma única consulta)
+                cursor.execute(self._EXISTING_DATES_SQL, (client_id, ocorrencias[0][0], ocorrencias[-1][0]))
+                datas_existentes = {row[0] for row in cursor.fetchall()}
+
+                novos = [
+                    (client_id, date_str, horario, dia_num)
+                    for date_str, horario, dia_num in ocorrencias
+                    if date_str not in datas_existentes
+                ]
+                # Pular horários que já atingiram a capacidade
+                novos = self._filtrar_horarios_lotados(cursor, client_id, novos)
+                # Se tipo sessões, parar ao atingir o limite
+                if limite is not None:
+                    novos = novos[:limite]
+
+                cursor.executemany('''
+                    INSERT INTO appointments
+                    (client_id, date, time, day_of_week, status, created_at)
+                    VALUES (?, ?, ?, ?, 'scheduled', datetime('now'))
+                ''', novos)
+
+                return len(novos)
+
         except Exception as e:
             print(f"Erro ao gerar appointments: {e}")
             import traceback
             traceback.print_exc()
             return 0
+
+    def gerar_appointments_todos(self) -> Dict[int, int]:
+        """
+        Regenera os appointments de todos os contratos ativos numa única transação.
+
+        Returns:
+            Dicionário {client_id: appointments criados}
+        """
+        try:
+            with self.connection(immediate=True) as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    SELECT id, data_inicio_contrato, tipo_contrato, sessoes_contratadas,
+                           dias_semana, sessoes_utilizadas
+                    FROM users
+                    WHERE type = 'client' AND contrato_ativo = 1
+                      AND data_inicio_contrato IS NOT NULL AND dias_semana IS NOT NULL
+                ''')
+                contratos = cursor.fetchall()
+
+                hoje = get_brasilia_today()
+                hoje_str = hoje.strftime('%Y-%m-%d')
+
+                planos = {}
+                for client_id, data_inicio_str, tipo, sessoes_total, dias_semana_json, sessoes_usadas in contratos:
+                    ocorrencias, limite = self._planejar_appointments_contrato(
+                        data_inicio_str, tipo, sessoes_total, sessoes_usadas,
+                        self._parse_dias_horarios(dias_semana_json), hoje
+                    )
+                    if ocorrencias:
+                        planos[client_id] = (ocorrencias, limite)
+
+                if not planos:
+                    return {}
+
+                # Deletar appointments futuros não marcados dos contratos regenerados
+                cursor.executemany('''
+                    DELETE FROM appointments
+                    WHERE client_id = ? AND date >= ? AND attended IS NULL
+                ''', [(client_id, hoje_str) for client_id in planos])
+
+                # Datas já ocupadas de todos os clientes numa única consulta
+                data_max = max(ocorrencias[-1][0] for ocorrencias, _ in planos.values())
+                cursor.execute('''
+                    SELECT DISTINCT client_id, date FROM appointments
+                    WHERE date BETWEEN ? AND ? AND status != 'cancelled'
+                ''', (hoje_str, data_max))
+                existentes = set(cursor.fetchall())
+
+                criados = {}
+                for client_id, (ocorrencias, limite) in planos.items():
+                    linhas = [
+                        (client_id, date_str, horario, dia_num)
+                        for date_str, horario, dia_num in ocorrencias
+                        if (client_id, date_str) not in existentes
+                    ]
+                    # Gravado por cliente: a ocupação lida para o próximo já inclui estes
+                    linhas = self._filtrar_horarios_lotados(cursor, client_id, linhas)
+                    if limite is not None:
+                        linhas = linhas[:limite]
+
+                    cursor.executemany('''
+                        INSERT INTO appointments
+                        (client_id, date, time, day_of_week, status, created_at)
+                        VALUES (?, ?, ?, ?, 'scheduled', datetime('now'))
+                    ''', linhas)
+                    criados[client_id] = len(linhas)
+
+                return criados
+
+        except Exception as e:
+            print(f"Erro ao gerar appointments: {e}")
+            import traceback
+            traceback.print_exc()
+            return {}
     
     def marcar_sessao_utilizada(self, client_id: int) -> bool:
         """Incrementa o contador de sessões utilizadas quando marca presença"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('''
-                UPDATE users 
-                SET sessoes_utilizadas = sessoes_utilizadas + 1
-                WHERE id = ?
-            ''', (client_id,))
+                cursor.execute('''
+                    UPDATE users 
+                    SET sessoes_utilizadas = sessoes_utilizadas + 1
+                    WHERE id = ?
+                ''', (client_id,))
             
-            conn.commit()
-            conn.close()
-            return True
+                return True
         except Exception as e:
             print(f"Erro ao marcar sessão utilizada: {e}")
             return False
 
-# Instância global do banco
-db = Database()
\ No newline at end of file
+# Instâncias de Database por caminho, criadas sob demanda por get_db()
+_instances: Dict[str, Database] = {}
+_instances_lock = threading.Lock()
+
+def get_db(db_path: str = "pilates.db") -> Database:
+    """Retorna a instância de Database do caminho informado.
+    
+    A primeira chamada para cada caminho cria as tabelas, aplica as migrações e
+    os dados padrão (o tempo gasto é registrado no log); as seguintes reutilizam
+    a mesma instância.
+    """
+    key = os.path.abspath(db_path)
+    instance = _instances.get(key)
+    if instance is not None:
+        return instance
+    
+    with _instances_lock:
+        instance = _instances.get(key)
+        if instance is None:
+            start = perf_counter()
+            instance = Database(db_path)
+            elapsed_ms = (perf_counter() - start) * 1000
+            logger.info("Banco de dados '%s' inicializado em %.1f ms", db_path, elapsed_ms)
+            _instances[key] = instance
+    return instance
+
+class _LazyDatabase:
+    """Encaminha atributos para get_db(), adiando a inicialização até o primeiro uso"""
+    
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+# Instância global do banco (importar o módulo não acessa o banco)
+db = _LazyDatabase()
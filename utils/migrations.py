@@ -0,0 +1,720 @@
+import sqlite3
+from datetime import date
+from typing import Callable, List, Tuple
+
+from dateutil.relativedelta import relativedelta
+
+# Migrações versionadas do schema.
+#
+# A versão aplicada fica gravada em PRAGMA user_version. Cada passo roda uma
+# única vez, em sua própria transação, e é idempotente (pode ser reaplicado em
+# bancos antigos que já tenham parte das colunas). Um banco já migrado custa
+# apenas a leitura do user_version na inicialização.
+#
+# Para alterar o schema, acrescente um novo passo ao final de MIGRATIONS;
+# nunca edite um passo que já foi publicado.
+
+
+def _column_names(cursor: sqlite3.Cursor, table: str) -> List[str]:
+    """Retorna os nomes das colunas de uma tabela"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [col[1] for col in cursor.fetchall()]
+
+
+def _add_column(cursor: sqlite3.Cursor, table: str, column: str, definition: str) -> bool:
+    """Adiciona coluna se ainda não existir. Retorna True se a coluna foi criada"""
+    if column in _column_names(cursor, table):
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+
+def _m001_base_tables(cursor: sqlite3.Cursor):
+    """Cria as tabelas base"""
+    # Tabela de usuários
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            type TEXT NOT NULL DEFAULT 'client',
+            medical_history TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de equipamentos
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS equipment (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de sequências de equipamentos (templates globais)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS equipment_sequences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            day_of_week INTEGER NOT NULL,
+            equipment_order TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de sequências personalizadas por cliente
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS client_sequences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            day_of_week INTEGER NOT NULL,
+            equipment_order TEXT NOT NULL,
+            current_position INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Tabela de horários fixos por cliente
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS client_schedule (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            day_of_week INTEGER NOT NULL,
+            time TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT 1,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES users (id),
+            UNIQUE(client_id, day_of_week, time)
+        )
+    ''')
+
+    # Tabela de agendamentos
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            day_of_week INTEGER NOT NULL,
+            client_sequence_id INTEGER,
+            last_equipment_used TEXT,
+            status TEXT DEFAULT 'scheduled',
+            delay_notification TEXT,
+            absence_notification TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES users (id),
+            FOREIGN KEY (client_sequence_id) REFERENCES client_sequences (id)
+        )
+    ''')
+
+    # Tabela de notificações
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            client_name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            message TEXT NOT NULL,
+            is_read INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Tabela de contas a receber
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contas_receber (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            tipo_plano TEXT NOT NULL,
+            valor REAL NOT NULL,
+            quantidade INTEGER,
+            data_vencimento TEXT NOT NULL,
+            data_pagamento TEXT,
+            status TEXT DEFAULT 'pendente',
+            observacoes TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Tabela de contas a pagar
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contas_pagar (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            data_debito TEXT NOT NULL,
+            tipo_debito TEXT NOT NULL,
+            valor_total REAL NOT NULL,
+            quantidade INTEGER DEFAULT 1,
+            tipo_parcelamento TEXT DEFAULT 'mensal',
+            status TEXT DEFAULT 'pendente',
+            observacoes TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de parcelas de contas a pagar
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS parcelas_pagar (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conta_pagar_id INTEGER NOT NULL,
+            numero_parcela INTEGER NOT NULL,
+            data_vencimento TEXT NOT NULL,
+            valor REAL NOT NULL,
+            data_pagamento TEXT,
+            status TEXT DEFAULT 'pendente',
+            FOREIGN KEY (conta_pagar_id) REFERENCES contas_pagar (id)
+        )
+    ''')
+
+
+def _m002_legacy_columns(cursor: sqlite3.Cursor):
+    """Adiciona colunas criadas em versões anteriores via ALTER TABLE"""
+    appointments_columns = _column_names(cursor, 'appointments')
+
+    if _add_column(cursor, 'appointments', 'client_sequence_id', 'INTEGER'):
+        # Migrar dados da coluna antiga se existir
+        if 'equipment_sequence_id' in appointments_columns:
+            cursor.execute('''
+                UPDATE appointments
+                SET client_sequence_id = equipment_sequence_id
+                WHERE equipment_sequence_id IS NOT NULL
+            ''')
+
+    _add_column(cursor, 'appointments', 'is_recurring', 'INTEGER DEFAULT 0')
+    _add_column(cursor, 'appointments', 'attended', 'INTEGER DEFAULT NULL')
+    _add_column(cursor, 'client_sequences', 'current_position', 'INTEGER DEFAULT 0')
+    _add_column(cursor, 'client_schedule', 'equipment_id', 'INTEGER')
+    _add_column(cursor, 'client_schedule', 'schedule_type', "TEXT DEFAULT 'Fixo'")
+    _add_column(cursor, 'client_schedule', 'sessions_count', 'INTEGER DEFAULT 0')
+    _add_column(cursor, 'contas_pagar', 'recorrente', 'INTEGER DEFAULT 0')
+
+
+def _m003_contract_columns(cursor: sqlite3.Cursor):
+    """Adiciona colunas de contrato do cliente e de edição do agendamento"""
+    _add_column(cursor, 'users', 'data_inicio_contrato', 'TEXT')
+    _add_column(cursor, 'users', 'tipo_contrato', "TEXT DEFAULT 'fixo'")
+    _add_column(cursor, 'users', 'sessoes_contratadas', 'INTEGER DEFAULT 0')
+    _add_column(cursor, 'users', 'sessoes_utilizadas', 'INTEGER DEFAULT 0')
+    _add_column(cursor, 'users', 'dias_semana', 'TEXT')
+    _add_column(cursor, 'users', 'contrato_ativo', 'INTEGER DEFAULT 1')
+    _add_column(cursor, 'appointments', 'observacao', 'TEXT')
+    _add_column(cursor, 'appointments', 'equipamento', 'TEXT')
+
+
+def _m004_backfill_schedule_equipment(cursor: sqlite3.Cursor):
+    """Atribui equipamento aos horários ativos que ainda não têm"""
+    # O k-ésimo horário pendente de cada dia/hora recebe o k-ésimo equipamento
+    # livre naquele dia/hora. Sem equipamento livre, usa a ordem circular de
+    # equipamentos.
+    # O resultado é calculado antes do UPDATE para não depender da ordem em
+    # que o SQLite aplica as alterações.
+    cursor.execute('''
+        CREATE TEMP TABLE equipment_backfill AS
+        WITH equipment_ranked AS (
+            SELECT id,
+                   ROW_NUMBER() OVER (ORDER BY id) - 1 AS pos,
+                   COUNT(*) OVER () AS total
+            FROM equipment
+        ),
+        pending AS (
+            SELECT id, day_of_week, time,
+                   ROW_NUMBER() OVER (PARTITION BY day_of_week, time ORDER BY id) - 1 AS slot_rank
+            FROM client_schedule
+            WHERE is_active = 1 AND (equipment_id IS NULL OR equipment_id = '')
+        ),
+        free AS (
+            SELECT s.day_of_week, s.time, e.id AS equipment_id,
+                   ROW_NUMBER() OVER (PARTITION BY s.day_of_week, s.time ORDER BY e.id) - 1 AS free_rank
+            FROM (SELECT DISTINCT day_of_week, time FROM pending) s
+            CROSS JOIN equipment e
+            WHERE NOT EXISTS (
+                SELECT 1 FROM client_schedule cs
+                WHERE cs.day_of_week = s.day_of_week AND cs.time = s.time
+                AND cs.is_active = 1 AND cs.equipment_id = e.id
+            )
+        )
+        SELECT p.id AS schedule_id,
+               COALESCE(f.equipment_id,
+                        (SELECT er.id FROM equipment_ranked er
+                         WHERE er.pos = p.slot_rank % er.total)) AS equipment_id
+        FROM pending p
+        LEFT JOIN free f
+            ON f.day_of_week = p.day_of_week AND f.time = p.time AND f.free_rank = p.slot_rank
+    ''')
+
+    cursor.execute('''
+        UPDATE client_schedule
+        SET equipment_id = (
+            SELECT eb.equipment_id FROM equipment_backfill eb
+            WHERE eb.schedule_id = client_schedule.id
+        )
+        WHERE id IN (SELECT schedule_id FROM equipment_backfill WHERE equipment_id IS NOT NULL)
+    ''')
+
+    cursor.execute('DROP TABLE equipment_backfill')
+
+
+# Índices secundários gerenciados pelas migrações (nome -> definição).
+# Cobrem os filtros das consultas quentes listadas em Database.hot_queries().
+INDEXES = {
+    # Grade diária/semanal, histórico e checagem de lotação: date ou (date, time)
+    'idx_appointments_date_time': 'appointments (date, time)',
+    # Agendamentos de um cliente em um dia ou período
+    'idx_appointments_client_date': 'appointments (client_id, date)',
+    # Horários fixos ocupando um dia/hora
+    'idx_client_schedule_slot': 'client_schedule (day_of_week, time, is_active)',
+    # Parcelas (ocorrências gravadas) de uma conta a pagar
+    'idx_parcelas_pagar_conta': 'parcelas_pagar (conta_pagar_id, numero_parcela)',
+    # Notificações não lidas mais recentes (popup do painel)
+    'idx_notifications_unread': 'notifications (is_read, created_at)',
+}
+
+
+def _create_indexes(cursor: sqlite3.Cursor, names: List[str]):
+    """Cria os índices gerenciados informados"""
+    for name in names:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {INDEXES[name]}")
+
+
+def _m005_hot_path_indexes(cursor: sqlite3.Cursor):
+    """Cria índices das consultas de agendamentos e horários fixos"""
+    _create_indexes(cursor, [
+        'idx_appointments_date_time',
+        'idx_appointments_client_date',
+        'idx_client_schedule_slot',
+    ])
+
+
+def _m006_slot_occupancy(cursor: sqlite3.Cursor):
+    """Cria o contador de ocupação por horário mantido por triggers"""
+    # Uma linha por (date, time) com agendamentos não cancelados
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS slot_occupancy (
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            booked INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (date, time)
+        ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('DELETE FROM slot_occupancy')
+    cursor.execute('''
+        INSERT INTO slot_occupancy (date, time, booked)
+        SELECT date, time, COUNT(*) FROM appointments
+        WHERE status != 'cancelled'
+        GROUP BY date, time
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_slot_occupancy_insert
+        AFTER INSERT ON appointments
+        WHEN NEW.status != 'cancelled'
+        BEGIN
+            INSERT INTO slot_occupancy (date, time, booked)
+            VALUES (NEW.date, NEW.time, 1)
+            ON CONFLICT (date, time) DO UPDATE SET booked = booked + 1;
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_slot_occupancy_delete
+        AFTER DELETE ON appointments
+        WHEN OLD.status != 'cancelled'
+        BEGIN
+            UPDATE slot_occupancy SET booked = booked - 1
+            WHERE date = OLD.date AND time = OLD.time;
+        END
+    ''')
+
+    # Mudança de data/hora ou cancelamento: tira do horário antigo, soma no novo
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_slot_occupancy_update
+        AFTER UPDATE OF date, time, status ON appointments
+        BEGIN
+            UPDATE slot_occupancy SET booked = booked - 1
+            WHERE OLD.status != 'cancelled' AND date = OLD.date AND time = OLD.time;
+            INSERT INTO slot_occupancy (date, time, booked)
+            SELECT NEW.date, NEW.time, 1 WHERE NEW.status != 'cancelled'
+            ON CONFLICT (date, time) DO UPDATE SET booked = booked + 1;
+        END
+    ''')
+
+
+def _m007_slot_capacity(cursor: sqlite3.Cursor):
+    """Cria a tabela de capacidade por horário e por equipamento"""
+    # day_of_week 0 = qualquer dia, time '' = qualquer horário,
+    # equipment_id 0 = capacidade do horário inteiro (clientes por aula)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS slot_capacity (
+            day_of_week INTEGER NOT NULL DEFAULT 0,
+            time TEXT NOT NULL DEFAULT '',
+            equipment_id INTEGER NOT NULL DEFAULT 0,
+            capacity INTEGER NOT NULL CHECK (capacity >= 0),
+            PRIMARY KEY (day_of_week, time, equipment_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Padrão histórico: 3 clientes por horário
+    cursor.execute('''
+        INSERT OR IGNORE INTO slot_capacity (day_of_week, time, equipment_id, capacity)
+        VALUES (0, '', 0, 3)
+    ''')
+
+
+def rebuild_fluxo_caixa_mensal(cursor: sqlite3.Cursor):
+    """Recalcula os totais mensais cadastrados e invalida as projeções guardadas"""
+    cursor.execute('DELETE FROM fluxo_caixa_mensal')
+    cursor.execute('''
+        INSERT INTO fluxo_caixa_mensal (ano_mes, receber, pagar)
+        SELECT ano_mes, SUM(receber), SUM(pagar)
+        FROM (
+            SELECT substr(data_vencimento, 1, 7) as ano_mes, valor as receber, 0 as pagar
+            FROM contas_receber
+            UNION ALL
+            SELECT substr(data_vencimento, 1, 7), 0, valor
+            FROM parcelas_pagar
+            WHERE status IS NOT 'excluida'
+        )
+        GROUP BY ano_mes
+    ''')
+    cursor.execute('UPDATE fluxo_caixa_versao SET versao = versao + 1')
+
+
+def _m008_fluxo_caixa_mensal(cursor: sqlite3.Cursor):
+    """Cria o resumo mensal do fluxo de caixa mantido por triggers"""
+    # receber/pagar: totais cadastrados do mês (triggers).
+    # *_projetado: projeção das contas recorrentes, válida enquanto
+    # projecao_versao = fluxo_caixa_versao.versao (recalculada sob demanda)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fluxo_caixa_mensal (
+            ano_mes TEXT PRIMARY KEY,
+            receber REAL NOT NULL DEFAULT 0,
+            pagar REAL NOT NULL DEFAULT 0,
+            receber_projetado REAL NOT NULL DEFAULT 0,
+            pagar_projetado REAL NOT NULL DEFAULT 0,
+            projecao_versao INTEGER
+        ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fluxo_caixa_versao (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            versao INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO fluxo_caixa_versao (id, versao) VALUES (1, 0)')
+
+    rebuild_fluxo_caixa_mensal(cursor)
+
+    # Totais cadastrados: contas_receber.valor -> receber, parcelas_pagar.valor -> pagar
+    for table, column in (('contas_receber', 'receber'), ('parcelas_pagar', 'pagar')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_fluxo_{column}_insert
+            AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO fluxo_caixa_mensal (ano_mes, {column})
+                VALUES (substr(NEW.data_vencimento, 1, 7), NEW.valor)
+                ON CONFLICT (ano_mes) DO UPDATE SET {column} = {column} + excluded.{column};
+            END
+        ''')
+
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_fluxo_{column}_delete
+            AFTER DELETE ON {table}
+            BEGIN
+                UPDATE fluxo_caixa_mensal SET {column} = {column} - OLD.valor
+                WHERE ano_mes = substr(OLD.data_vencimento, 1, 7);
+            END
+        ''')
+
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_fluxo_{column}_update
+            AFTER UPDATE OF valor, data_vencimento ON {table}
+            WHEN OLD.valor IS NOT NEW.valor OR OLD.data_vencimento IS NOT NEW.data_vencimento
+            BEGIN
+                UPDATE fluxo_caixa_mensal SET {column} = {column} - OLD.valor
+                WHERE ano_mes = substr(OLD.data_vencimento, 1, 7);
+                INSERT INTO fluxo_caixa_mensal (ano_mes, {column})
+                VALUES (substr(NEW.data_vencimento, 1, 7), NEW.valor)
+                ON CONFLICT (ano_mes) DO UPDATE SET {column} = {column} + excluded.{column};
+            END
+        ''')
+
+    # Colunas que alteram a projeção das recorrentes (pagamentos não alteram)
+    projection_inputs = {
+        'contas_receber': 'client_id, tipo_plano, valor, data_vencimento, observacoes',
+        'parcelas_pagar': 'conta_pagar_id, valor, data_vencimento',
+        'contas_pagar': 'data_debito, valor_total, recorrente',
+    }
+    for table, columns in projection_inputs.items():
+        for event in ('INSERT', 'DELETE', f'UPDATE OF {columns}'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_fluxo_versao_{table}_{event.split()[0].lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE fluxo_caixa_versao SET versao = versao + 1;
+                END
+            ''')
+
+
+def _m009_recurring_payable_rules(cursor: sqlite3.Cursor):
+    """Guarda contas a pagar recorrentes como regra, sem parcelas futuras gravadas"""
+    _create_indexes(cursor, ['idx_parcelas_pagar_conta'])
+
+    # Parcela 'excluida' = ocorrência da regra apagada pelo usuário; não entra nos totais
+    for trigger in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_fluxo_pagar_{trigger}')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_fluxo_pagar_insert
+        AFTER INSERT ON parcelas_pagar
+        WHEN NEW.status IS NOT 'excluida'
+        BEGIN
+            INSERT INTO fluxo_caixa_mensal (ano_mes, pagar)
+            VALUES (substr(NEW.data_vencimento, 1, 7), NEW.valor)
+            ON CONFLICT (ano_mes) DO UPDATE SET pagar = pagar + excluded.pagar;
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_fluxo_pagar_delete
+        AFTER DELETE ON parcelas_pagar
+        WHEN OLD.status IS NOT 'excluida'
+        BEGIN
+            UPDATE fluxo_caixa_mensal SET pagar = pagar - OLD.valor
+            WHERE ano_mes = substr(OLD.data_vencimento, 1, 7);
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_fluxo_pagar_update
+        AFTER UPDATE OF valor, data_vencimento, status ON parcelas_pagar
+        WHEN OLD.valor IS NOT NEW.valor OR OLD.data_vencimento IS NOT NEW.data_vencimento
+            OR (OLD.status IS 'excluida') != (NEW.status IS 'excluida')
+        BEGIN
+            UPDATE fluxo_caixa_mensal SET pagar = pagar - OLD.valor
+            WHERE OLD.status IS NOT 'excluida' AND ano_mes = substr(OLD.data_vencimento, 1, 7);
+            INSERT INTO fluxo_caixa_mensal (ano_mes, pagar)
+            SELECT substr(NEW.data_vencimento, 1, 7), NEW.valor WHERE NEW.status IS NOT 'excluida'
+            ON CONFLICT (ano_mes) DO UPDATE SET pagar = pagar + excluded.pagar;
+        END
+    ''')
+
+    # Parcelas apagadas antes da regra (buracos na numeração) continuam excluídas
+    cursor.execute('''
+        WITH RECURSIVE numeros(conta_pagar_id, numero, ultimo) AS (
+            SELECT pp.conta_pagar_id, 1, MAX(pp.numero_parcela)
+            FROM parcelas_pagar pp
+            JOIN contas_pagar cp ON cp.id = pp.conta_pagar_id
+            WHERE cp.recorrente = 1
+            GROUP BY pp.conta_pagar_id
+            UNION ALL
+            SELECT conta_pagar_id, numero + 1, ultimo FROM numeros WHERE numero < ultimo
+        )
+        SELECT n.conta_pagar_id, n.numero, cp.data_debito, cp.valor_total
+        FROM numeros n
+        JOIN contas_pagar cp ON cp.id = n.conta_pagar_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM parcelas_pagar pp
+            WHERE pp.conta_pagar_id = n.conta_pagar_id AND pp.numero_parcela = n.numero
+        )
+    ''')
+    cursor.executemany('''
+        INSERT INTO parcelas_pagar (conta_pagar_id, numero_parcela, data_vencimento, valor, status)
+        VALUES (?, ?, ?, ?, 'excluida')
+    ''', [
+        (conta_id, numero, (date.fromisoformat(data_debito) + relativedelta(months=numero - 1)).isoformat(), valor_total)
+        for conta_id, numero, data_debito, valor_total in cursor.fetchall()
+    ])
+
+    # Parcelas pendentes iguais à regra (data_debito + n meses, valor_total)
+    # passam a ser geradas sob demanda; pagas ou editadas ficam como exceção
+    cursor.execute('''
+        SELECT pp.id, pp.numero_parcela, pp.data_vencimento, pp.valor, cp.data_debito, cp.valor_total
+        FROM parcelas_pagar pp
+        JOIN contas_pagar cp ON cp.id = pp.conta_pagar_id
+        WHERE cp.recorrente = 1
+        AND pp.status IS 'pendente' AND pp.data_pagamento IS NULL
+    ''')
+
+    virtuais = []
+    for parcela_id, numero, data_vencimento, valor, data_debito, valor_total in cursor.fetchall():
+        prevista = date.fromisoformat(data_debito) + relativedelta(months=numero - 1)
+        if data_vencimento == prevista.isoformat() and valor == valor_total:
+            virtuais.append((parcela_id,))
+
+    # Cópia das linhas removidas, caso a regra não corresponda a alguma delas.
+    # Restaurar é seguro: ocorrência com linha gravada deixa de ser gerada.
+    #   INSERT INTO parcelas_pagar SELECT * FROM parcelas_pagar_m009_backup
+    #   WHERE id NOT IN (SELECT id FROM parcelas_pagar)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS parcelas_pagar_m009_backup AS
+        SELECT * FROM parcelas_pagar WHERE 0
+    ''')
+    cursor.executemany(
+        'INSERT INTO parcelas_pagar_m009_backup SELECT * FROM parcelas_pagar WHERE id = ?', virtuais
+    )
+    cursor.executemany('DELETE FROM parcelas_pagar WHERE id = ?', virtuais)
+
+
+def _m010_unread_notifications(cursor: sqlite3.Cursor):
+    """Cria o contador de notificações não lidas mantido por triggers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_counter (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            unread INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    cursor.execute('''
+        INSERT OR REPLACE INTO notification_counter (id, unread)
+        SELECT 1, COUNT(*) FROM notifications WHERE is_read = 0
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_notification_counter_insert
+        AFTER INSERT ON notifications
+        WHEN NEW.is_read = 0
+        BEGIN
+            UPDATE notification_counter SET unread = unread + 1 WHERE id = 1;
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_notification_counter_delete
+        AFTER DELETE ON notifications
+        WHEN OLD.is_read = 0
+        BEGIN
+            UPDATE notification_counter SET unread = unread - 1 WHERE id = 1;
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_notification_counter_update
+        AFTER UPDATE OF is_read ON notifications
+        WHEN (OLD.is_read IS 0) != (NEW.is_read IS 0)
+        BEGIN
+            UPDATE notification_counter
+            SET unread = unread + (NEW.is_read IS 0) - (OLD.is_read IS 0)
+            WHERE id = 1;
+        END
+    ''')
+
+    _create_indexes(cursor, ['idx_notifications_unread'])
+
+
+def _m011_table_versions(cursor: sqlite3.Cursor):
+    """Cria o contador de gerações por tabela (table_versions) mantido por triggers"""
+    # Cada escrita numa tabela listada incrementa a geração dela; a interface
+    # compara gerações para saber se precisa buscar os dados de novo
+    tables = (
+        'users', 'equipment', 'equipment_sequences', 'client_sequences',
+        'client_schedule', 'appointments', 'notifications',
+        'contas_receber', 'contas_pagar', 'parcelas_pagar',
+    )
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.executemany(
+        'INSERT OR IGNORE INTO table_versions (table_name, version) VALUES (?, 0)',
+        [(table,) for table in tables]
+    )
+
+    for table in tables:
+        for event in ('INSERT', 'DELETE', 'UPDATE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_table_versions_{table}_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+                END
+            ''')
+
+
+def _m012_slot_capacity_version(cursor: sqlite3.Cursor):
+    """Acompanha a geração de slot_capacity em table_versions"""
+    # O mapa de capacidades em memória do Database é recarregado quando a
+    # geração muda (alterações feitas por outro processo ou instância)
+    cursor.execute(
+        "INSERT OR IGNORE INTO table_versions (table_name, version) VALUES ('slot_capacity', 0)"
+    )
+
+    for event in ('INSERT', 'DELETE', 'UPDATE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_table_versions_slot_capacity_{event.lower()}
+            AFTER {event} ON slot_capacity
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE table_name = 'slot_capacity';
+            END
+        ''')
+
+
+# (versão, passo) em ordem crescente
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Cursor], None]]] = [
+    (1, _m001_base_tables),
+    (2, _m002_legacy_columns),
+    (3, _m003_contract_columns),
+    (4, _m004_backfill_schedule_equipment),
+    (5, _m005_hot_path_indexes),
+    (6, _m006_slot_occupancy),
+    (7, _m007_slot_capacity),
+    (8, _m008_fluxo_caixa_mensal),
+    (9, _m009_recurring_payable_rules),
+    (10, _m010_unread_notifications),
+    (11, _m011_table_versions),
+    (12, _m012_slot_capacity_version),
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Retorna a versão do schema gravada no banco"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """Aplica as migrações pendentes e retorna a versão final do schema"""
+    current_version = get_schema_version(conn)
+    if current_version >= LATEST_SCHEMA_VERSION:
+        return current_version
+
+    # Migrações rodam em transações próprias
+    if conn.in_transaction:
+        conn.commit()
+
+    for version, step in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            # Outro processo pode ter aplicado o passo enquanto aguardávamos o lock
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                current_version = version
+                continue
+            step(cursor)
+            cursor.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        current_version = version
+        print(f"✅ Migração {version} aplicada: {step.__doc__}")
+
+    return current_version
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+# Dados da grade semanal de agendamentos carregados de uma só vez.
+#
+# A grade de appointments_tab mostra dezenas de clientes por semana; em vez de
+# consultar o banco para cada cliente exibido (horário fixo, agendamento, nome),
+# WeekViewData busca tudo num número fixo de consultas e responde por dicionário.
+
+
+class WeekViewData:
+    """Grade e consultas auxiliares de uma semana (segunda a sexta)
+
+    Uso:
+        week = WeekViewData(db, '2025-01-06')
+        for hour_data in week.grid: ...
+        week.get_appointment(client_id, '2025-01-06', '08:00')
+    """
+
+    def __init__(self, database, week_start: str):
+        """
+        Args:
+            database: Objeto com a API de utils.database.Database
+            week_start: Segunda-feira da semana (YYYY-MM-DD)
+        """
+        self.database = database
+        self.week_start = week_start
+        self.week_end = (datetime.strptime(week_start, '%Y-%m-%d') + timedelta(days=4)).strftime('%Y-%m-%d')
+
+        # 1. Grade da semana (clientes por hora/dia)
+        self.grid: List[Dict] = database.get_week_schedule_data_with_details(week_start)
+
+        # 2. Clientes por ID
+        self.clients: Dict[int, Dict] = {client['id']: client for client in database.get_clients()}
+
+        # 3. Horários fixos ativos por (cliente, dia da semana, horário)
+        self.schedules: Dict[tuple, Dict] = {}
+        for sched in database.get_all_client_schedules():
+            self.schedules.setdefault((sched['client_id'], sched['day_of_week'], sched['time']), sched)
+
+        # 4. Agendamentos da semana (qualquer status) por (cliente, data, horário);
+        #    vale o mais recente, como em get_appointment_by_details
+        self.appointments: Dict[tuple, Dict] = {}
+        for apt in database.get_appointments(start_date=week_start, end_date=self.week_end):
+            key = (apt['client_id'], apt['date'], apt['time'])
+            current = self.appointments.get(key)
+            if current is None or apt['id'] > current['id']:
+                self.appointments[key] = apt
+
+    def get_client(self, client_id: int) -> Optional[Dict]:
+        """Retorna o cliente pelo ID"""
+        return self.clients.get(client_id)
+
+    def get_client_name(self, client_id: int, default: str = 'Cliente') -> str:
+        """Retorna o nome do cliente ou `default` se não encontrado"""
+        client = self.clients.get(client_id)
+        return client['name'] if client else default
+
+    def get_schedule(self, client_id: int, day_of_week: int, time: str) -> Optional[Dict]:
+        """Retorna o horário fixo ativo do cliente no dia/horário"""
+        return self.schedules.get((client_id, day_of_week, time))
+
+    def get_schedule_type(self, client_id: int, day_of_week: int, time: str) -> str:
+        """Retorna o tipo do horário fixo ('Fixo' quando não há horário cadastrado)"""
+        sched = self.schedules.get((client_id, day_of_week, time))
+        return sched.get('schedule_type', 'Fixo') if sched else 'Fixo'
+
+    def get_appointment(self, client_id: int, date: str, time: str) -> Optional[Dict]:
+        """Retorna o agendamento do cliente na data/horário
+
+        Datas fora da semana carregada (ex.: edição aberta antes de trocar de
+        semana) são buscadas no banco.
+        """
+        if self.week_start <= date <= self.week_end:
+            return self.appointments.get((client_id, date, time))
+        return self.database.get_appointment_by_details(client_id, date, time)